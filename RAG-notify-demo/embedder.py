@@ -2,20 +2,222 @@
 # requires-python = ">=3.10"
 # dependencies = ["numpy>=1.26","sentence-transformers>=3.0"]
 # ///
-import argparse, json, numpy as np
-from sentence_transformers import SentenceTransformer
-
-ap = argparse.ArgumentParser()
-ap.add_argument("--in", dest="inp", required=True)
-ap.add_argument("--out", required=True)
-ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
-a = ap.parse_args()
-
-model = SentenceTransformer(a.model)  # CPU par défaut
-rows = [json.loads(l) for l in open(a.inp, encoding="utf-8")]
-embs = model.encode([r["text"] for r in rows], normalize_embeddings=True)
-with open(a.out,"w",encoding="utf-8") as f:
-    for r, e in zip(rows, embs):
-        r["embedding"] = e.tolist()
-        f.write(json.dumps(r, ensure_ascii=False)+"\n")
-print(f"Embedded {len(rows)} chunks → {a.out}")
\ No newline at end of file
+import argparse, hashlib, json, os, re, struct, time
+import numpy as np
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_CACHE = os.getenv("EMBED_CACHE", os.path.join("state", "embcache"))
+
+def load_model(name:str=DEFAULT_MODEL):
+    from sentence_transformers import SentenceTransformer  # lourd : importé seulement si on encode ici
+    return SentenceTransformer(name)  # CPU par défaut
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store, one directory per (model, normalization):
+      vectors.f32  float32 slots (capacity×dim), memory-mapped, grown on demand
+      index.npy    sha1(text) digest → slot, with last-use time for LRU eviction
+    Holds at most `max_entries` vectors; the least recently used are evicted first.
+    """
+    KEY = np.dtype([("key","S20"),("slot","<i8"),("atime","<f8")])
+
+    def __init__(self, root:str, model:str, normalize:bool=True, max_entries:int=200_000):
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model) + ("-norm" if normalize else "-raw")
+        self.dir = os.path.join(root, slug)
+        os.makedirs(self.dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.vectors = None
+        self.entries = {}  # digest → [slot, atime]
+        if os.path.exists(os.path.join(self.dir, "index.npy")):
+            for key, slot, atime in np.load(os.path.join(self.dir, "index.npy")).tolist():
+                self.entries[key.ljust(20, b"\0")] = [slot, atime]  # "S" fields drop trailing NULs
+        vf = os.path.join(self.dir, "vectors.f32")
+        if os.path.exists(vf) and os.path.exists(os.path.join(self.dir, "dim")):
+            dim = int(open(os.path.join(self.dir, "dim")).read())
+            self.vectors = np.memmap(vf, dtype=np.float32, mode="r+").reshape(-1, dim)
+        else:
+            self.entries = {}
+        used = {s for s,_ in self.entries.values()}
+        self.free = sorted(set(range(len(self.vectors) if self.vectors is not None else 0)) - used, reverse=True)
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def digest(text:str)->bytes:
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def get(self, texts:list)->list:
+        """Cached vector (or None) for each text; counts hits and misses."""
+        now, out = time.time(), []
+        for t in texts:
+            e = self.entries.get(self.digest(t))
+            if e is None: self.misses += 1; out.append(None); continue
+            e[1] = now; self.hits += 1; out.append(np.array(self.vectors[e[0]]))
+        return out
+
+    def put(self, texts:list, vecs:np.ndarray):
+        texts, vecs = texts[:self.max_entries], np.asarray(vecs, dtype=np.float32)[:self.max_entries]
+        if not len(texts): return
+        self._ensure(vecs.shape[1], len(texts))
+        now = time.time()
+        for t, v in zip(texts, vecs):
+            d = self.digest(t)
+            if d in self.entries: continue
+            slot = self.free.pop()
+            self.vectors[slot] = v
+            self.entries[d] = [slot, now]
+
+    def _ensure(self, dim:int, n:int):
+        """Makes room for n new vectors: grows the slot file, then evicts least recently used entries."""
+        size = len(self.vectors) if self.vectors is not None else 0
+        want = min(self.max_entries, max(len(self.entries)+n, 2*size, 1024))
+        if want > size:
+            vf = os.path.join(self.dir, "vectors.f32")
+            with open(vf, "ab") as f: f.truncate(want*dim*4)
+            open(os.path.join(self.dir, "dim"), "w").write(str(dim))
+            self.vectors = np.memmap(vf, dtype=np.float32, mode="r+").reshape(-1, dim)
+            self.free = sorted(set(self.free) | set(range(size, want)), reverse=True)
+        if len(self.free) < n:
+            lru = sorted(self.entries.items(), key=lambda kv: kv[1][1])[:n-len(self.free)]
+            for d, (slot, _) in lru:
+                del self.entries[d]; self.free.append(slot)
+
+    def close(self):
+        if self.vectors is not None: self.vectors.flush()
+        idx = np.array([(d, s, a) for d,(s,a) in self.entries.items()], dtype=self.KEY)
+        tmp = os.path.join(self.dir, "index.tmp.npy")
+        np.save(tmp, idx); os.replace(tmp, os.path.join(self.dir, "index.npy"))
+
+def indexed_ids(index:str)->set:
+    """Ids of the live (non-tombstoned) chunks of a binary index written by indexer.py."""
+    if not index or not os.path.exists(index+".meta"): return set()
+    deleted = open(index+".del","rb").read() if os.path.exists(index+".del") else b""
+    with open(index+".meta", encoding="utf-8") as f:
+        return {json.loads(l)["id"] for i,l in enumerate(f) if not (i < len(deleted) and deleted[i])}
+
+VEC_MAGIC = b"RAGVEC01"  # binary sidecar: magic, uint32 dim, 4 pad bytes, then float32 rows
+
+class VectorWriter:
+    """Appends float32 vectors to the binary sidecar `<out>.f32`; JSON rows refer to them by "vec" row number."""
+    def __init__(self, path:str):
+        self.f, self.n, self.dim = open(path, "wb"), 0, 0
+    def write(self, v)->int:
+        v = np.asarray(v, dtype=np.float32)
+        if not self.dim:
+            self.dim = v.shape[0]; self.f.write(VEC_MAGIC + struct.pack("<II", self.dim, 0))
+        self.f.write(v.tobytes()); self.n += 1
+        return self.n - 1
+    def close(self): self.f.close()
+
+def dump_rows(rows, f, vw:VectorWriter=None):
+    """Writes embedded rows as JSON lines, vectors to the sidecar `vw` (inline lists when None); rows are left intact."""
+    for r in rows:
+        o = {k:v for k,v in r.items() if k != "embedding"}
+        if "embedding" in r:
+            if vw: o["vec"] = vw.write(r["embedding"])
+            else: o["embedding"] = np.asarray(r["embedding"]).tolist()
+        f.write(json.dumps(o, ensure_ascii=False)+"\n")
+
+def read_batches(inp:str, size:int):
+    """Streams the chunk rows of inp in lists of at most `size`."""
+    batch = []
+    with open(inp, encoding="utf-8") as f:
+        for l in f:
+            batch.append(json.loads(l))
+            if len(batch) >= size: yield batch; batch = []
+    if batch: yield batch
+
+class Embedder:
+    """
+    Streaming embedding stage. For each batch of chunk rows: chunks live in `index`
+    are left without an embedding, cached vectors are reused, and only the misses
+    are encoded (on a process pool when processes > 1). Sets r["embedding"] in place.
+    `model` may be a model name, loaded only if something needs encoding.
+    """
+    def __init__(self, model, model_name:str=None, index:str=None, cache:str=None, cache_size:int=200_000,
+                 batch_size:int=64, processes:int=0):
+        self.model, self.batch_size, self.processes, self.pool = model, batch_size, processes, None
+        self.model_name = model_name or (model if isinstance(model, str) else DEFAULT_MODEL)
+        self.known = indexed_ids(index)
+        self.store = EmbeddingCache(cache, self.model_name, max_entries=cache_size) if cache else None
+        self.total = self.skipped = self.hits = self.misses = 0
+        self.encode_seconds = 0.0  # spent in model.encode
+
+    def _encode(self, texts:list)->np.ndarray:
+        if isinstance(self.model, str): self.model = load_model(self.model)
+        t = time.perf_counter()
+        if self.processes > 1:
+            if self.pool is None: self.pool = self.model.start_multi_process_pool(["cpu"]*self.processes)
+            vecs = self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size, normalize_embeddings=True)
+        else:
+            vecs = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True)
+        self.encode_seconds += time.perf_counter()-t
+        return vecs
+
+    def embed_batch(self, rows:list)->list:
+        todo = [r for r in rows if r["id"] not in self.known]
+        cached = self.store.get([r["text"] for r in todo]) if self.store else [None]*len(todo)
+        miss = [r for r, v in zip(todo, cached) if v is None]
+        embs = self._encode([r["text"] for r in miss]) if miss else []
+        if self.store: self.store.put([r["text"] for r in miss], embs)
+        for r, e in zip(miss, embs): r["embedding"] = e
+        for r, v in zip(todo, cached):
+            if v is not None: r["embedding"] = v
+        self.total += len(rows); self.skipped += len(rows)-len(todo)
+        self.hits += len(todo)-len(miss); self.misses += len(miss)
+        return rows
+
+    def summary(self)->str:
+        return (f"{self.total-self.skipped} chunks ({self.skipped} already indexed; "
+                f"cache {self.hits} hits / {self.misses} misses)")
+
+    def close(self):
+        if self.store: self.store.close()
+        if self.pool is not None: self.model.stop_multi_process_pool(self.pool); self.pool = None
+
+def run(inp:str, out:str, model, index:str=None, cache:str=None, model_name:str=None, cache_size:int=200_000,
+        batch_size:int=64, fmt:str="bin", processes:int=0, timings:dict=None)->str:
+    """
+    Streams the chunks of inp through an Embedder, `batch_size` rows (× processes) at a time,
+    so memory stays flat. fmt="bin" writes vectors to the binary sidecar `<out>.f32`,
+    fmt="json" inlines them as "embedding" float lists. `timings` receives the encode seconds.
+    """
+    emb = Embedder(model, model_name, index, cache, cache_size, batch_size, processes)
+    vw = VectorWriter(out+".f32") if fmt == "bin" else None
+    if not vw and os.path.exists(out+".f32"): os.remove(out+".f32")  # stale sidecar
+    t = time.time()
+    try:
+        with open(out,"w",encoding="utf-8") as f:
+            for batch in read_batches(inp, batch_size*max(1, processes)):
+                dump_rows(emb.embed_batch(batch), f, vw)
+    finally:
+        emb.close()
+        if vw: vw.close()
+        if timings is not None: timings["encode"] = emb.encode_seconds
+    dt = time.time()-t
+    return f"Embedded {emb.summary()} in {dt:.1f}s ({emb.total/max(dt, 1e-9):.0f} chunks/s) → {out}"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--index", help="existing index.bin: chunks it already holds are not re-embedded")
+    ap.add_argument("--cache", default=DEFAULT_CACHE, help="embedding cache directory (default: state/embcache or EMBED_CACHE)")
+    ap.add_argument("--no-cache", dest="cache", action="store_const", const=None)
+    ap.add_argument("--cache-size", type=int, default=200_000, help="max cached vectors per model (LRU eviction)")
+    ap.add_argument("--batch-size", type=int, default=64, help="chunks read and encoded per batch")
+    ap.add_argument("--format", choices=("bin", "json"), default="bin", help="bin: vectors in <out>.f32; json: inline float lists")
+    ap.add_argument("--processes", type=int, default=0, help="encode on a pool of N CPU processes")
+    ap.add_argument("--worker", default=os.getenv("RAG_WORKER"), help="host:port of a running rag_worker.py")
+    a = ap.parse_args(argv)
+    if a.worker:
+        from rag_worker import request
+        print(request(a.worker, "embed", inp=os.path.abspath(a.inp), out=os.path.abspath(a.out), model=a.model,
+                      index=a.index and os.path.abspath(a.index), cache=a.cache and os.path.abspath(a.cache),
+                      cache_size=a.cache_size, batch_size=a.batch_size, fmt=a.format, processes=a.processes))
+    else:
+        print(run(a.inp, a.out, a.model, a.index, a.cache, cache_size=a.cache_size, batch_size=a.batch_size,
+                  fmt=a.format, processes=a.processes))
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 # /// script
 # requires-python = ">=3.10"
-# dependencies = ["fastapi>=0.112", "uvicorn>=0.30"]
+# dependencies = ["fastapi>=0.112", "uvicorn>=0.30", "zstandard>=0.22"]
 # ///
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
 from pathlib import Path
-import json, time
+from typing import Optional
+import asyncio, gzip, hashlib, json, os, re, shutil, sqlite3, struct, threading, time, uuid
+from rag_worker import Metrics
+
+try:
+    import zstandard
+except ImportError:  # zstd-compressed results are then only passed through to clients that accept them
+    zstandard = None
 
 app = FastAPI(title="LDN Inbox (POC)")
 STATE_DIR = Path.cwd() / "state"
@@ -14,23 +23,788 @@ INBOX = STATE_DIR / "inbox"
 INBOX.mkdir(parents=True, exist_ok=True)
 app.mount("/state", StaticFiles(directory=str(STATE_DIR)), name="state")
 
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_WAIT = 60  # seconds a long-poll GET may be held open
+BATCH_MAX_ITEMS = int(os.getenv("INBOX_BATCH_MAX_ITEMS", "10000"))  # notifications per POST /inbox/batch
+
+# Storage backend: "files" (one pretty-printed JSON file per message, the original layout)
+# or "log" (append-only segment files under state/inbox-log/).
+STORAGE = os.getenv("INBOX_STORAGE", "files")
+SEGMENT_BYTES = int(os.getenv("INBOX_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+FSYNC_INTERVAL = float(os.getenv("INBOX_FSYNC_INTERVAL", "0.05"))
+RETENTION_DAYS = float(os.getenv("INBOX_RETENTION_DAYS", "0"))  # 0 = keep everything
+# Job queue over `Create` messages (see JobQueue)
+LEASE_SECONDS = float(os.getenv("INBOX_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("INBOX_MAX_ATTEMPTS", "3"))
+# /results/<name> follows a result still being written (parts/<name>.part) until it completes
+RESULT_NAME = re.compile(r"^[\w.-]+$")
+RESULT_POLL_SECONDS = 0.05
+RESULT_IDLE_SECONDS = float(os.getenv("INBOX_RESULT_IDLE_SECONDS", "600"))  # give up on a stalled producer
+# Content-addressed result store written by the orchestrator: objects/<sha[:2]>/<sha256>[.zst|.gz],
+# and names/<result name> holding the hash of each job's result. Set RESULTS_DIR to the orchestrators'
+# RESULTS_DIR when they do not run from this cwd.
+RESULTS = Path(os.getenv("RESULTS_DIR", STATE_DIR / "results")).resolve()
+RESULT_HASH = re.compile(r"^[0-9a-f]{64}$")
+RESULT_SUFFIXES = {"zstd": ".zst", "gzip": ".gz", "identity": ""}
+
+# --- Metrics ---
+# rag_worker.py's Metrics (run the inbox from a checkout of this folder), with finer buckets for request latencies
+metrics = Metrics("inbox", buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+WAIT_PARAM = re.compile(rb"(^|&)wait=")
+
+class RequestTimer:
+    """
+    ASGI middleware timing every request, until its last body byte, under a
+    "METHOD /route" span ("... (wait)" for long-polls, which include their wait),
+    and counting them by route and status.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started, status = time.perf_counter(), [500]
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = f'{scope["method"]} {getattr(scope.get("route"), "path", "unmatched")}'
+            span = route + " (wait)" if WAIT_PARAM.search(scope.get("query_string", b"")) else route
+            metrics.observe(span, time.perf_counter() - started)
+            metrics.inc("http_requests", route=route, status=status[0])
+
+app.add_middleware(RequestTimer)
+
+def message_id(message) -> str:
+    """Stable id of a notification: SHA-1 of its canonical JSON, computed once when it is stored."""
+    return hashlib.sha1(json.dumps(message, sort_keys=True).encode()).hexdigest()
+
+# --- Storage backends ---
+class FileStore:
+    """One `{millis}.json` file per notification, as served under /state/inbox/."""
+    def __init__(self, root: Path):
+        self.root = root
+        self._seq = 0
+
+    @staticmethod
+    def _order(p: Path):
+        # `{millis}.json` sorts before its same-millisecond siblings `{millis}-{n}.json`
+        millis, _, n = p.stem.partition("-")
+        return (int(millis) if millis.isdigit() else 0, int(n) if n.isdigit() else 0, p.name)
+
+    def load(self) -> list:
+        records = []
+        for p in sorted(self.root.glob("*.json"), key=self._order):
+            try:
+                msg = json.loads(p.read_text(encoding="utf-8"))
+            except Exception:
+                continue
+            self._seq += 1
+            records.append((self._seq, p.name, message_id(msg), msg))
+        return records
+
+    def append(self, message, msg_id: str = None) -> tuple[int, str]:
+        body = json.dumps(message, ensure_ascii=False, indent=2)
+        stem, n = str(int(time.time()*1000)), 0
+        while True:
+            fname = self.root / (f"{stem}-{n}.json" if n else f"{stem}.json")
+            try:
+                # Exclusive create: concurrent POSTs in the same millisecond never overwrite each other
+                with open(fname, "x", encoding="utf-8") as f:
+                    f.write(body)
+                break
+            except FileExistsError:
+                n += 1
+        self._seq += 1
+        return self._seq, fname.name
+
+class SegmentLog:
+    """Append-only inbox log: compact JSON records in rotating segment files.
+
+    Segment `{first_seq}.log` holds one `{"s": seq, "t": millis, "h": id, "m": message}`
+    line per notification. A sparse `{first_seq}.idx` stores a (seq, offset) pair every
+    INDEX_EVERY records so reads from a cursor can seek instead of scanning.
+    Records reach the OS on every append; fsync is batched by a background thread
+    every `fsync_interval` seconds.
+    """
+    INDEX_EVERY = 256
+    _IDX = struct.Struct("<QQ")
+
+    def __init__(self, root: Path, segment_bytes: int = SEGMENT_BYTES, fsync_interval: float = FSYNC_INTERVAL):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._fh = self._idx = None
+        self._segment = None
+        self._count = 0  # records in the active segment
+        self._dirty = False
+        self._finish_compaction()
+
+    def _segments(self) -> list[Path]:
+        return sorted(self.root.glob("*.log"), key=lambda p: int(p.stem))
+
+    def _read_segment(self, seg: Path, since: int = 0):
+        """Yields (seq, end_offset, record) for the complete records of `seg` after `since`."""
+        start = 0
+        idx = seg.with_suffix(".idx")
+        if since and idx.exists():
+            data = idx.read_bytes()
+            for i in range(0, len(data) - len(data) % self._IDX.size, self._IDX.size):
+                seq, off = self._IDX.unpack_from(data, i)
+                if seq > since:
+                    break
+                start = off
+        with open(seg, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn tail from a crash mid-append
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                if rec["s"] > since:
+                    yield rec["s"], offset, rec
+
+    def records(self, since: int = 0):
+        """Yields (seq, name, id, message) for every stored record after `since`."""
+        segs = self._segments()
+        firsts = [int(p.stem) for p in segs]
+        start = max(bisect_right(firsts, since) - 1, 0)
+        for seg in segs[start:]:
+            for seq, _, rec in self._read_segment(seg, since):
+                yield seq, f"{seg.name}#{seq}", rec.get("h") or message_id(rec["m"]), rec["m"]
+
+    def load(self) -> list:
+        if RETENTION_DAYS > 0:
+            self.compact(int((time.time() - RETENTION_DAYS * 86400) * 1000))
+        records = list(self.records())
+        self._open_active()
+        return records
+
+    def _open_active(self):
+        segs = self._segments()
+        if not segs:
+            self._new_segment(1)
+        else:
+            seg = segs[-1]
+            self._seq = int(seg.stem) - 1
+            end, count = 0, 0
+            for seq, end, _ in self._read_segment(seg):
+                self._seq, count = seq, count + 1
+            if end < seg.stat().st_size:
+                with open(seg, "r+b") as f:
+                    f.truncate(end)
+            self._segment, self._count = seg, count
+            self._fh = open(seg, "ab")
+            self._idx = open(seg.with_suffix(".idx"), "ab")
+        threading.Thread(target=self._fsync_loop, daemon=True).start()
+
+    def _new_segment(self, first_seq: int):
+        if self._fh:
+            self._sync()
+            self._fh.close()
+            self._idx.close()
+        self._segment = self.root / f"{first_seq:012d}.log"
+        self._fh = open(self._segment, "ab")
+        self._idx = open(self._segment.with_suffix(".idx"), "ab")
+        self._count = 0
+
+    def append(self, message, msg_id: str = None) -> tuple[int, str]:
+        with self._lock:
+            seq = self._seq + 1
+            line = json.dumps({"s": seq, "t": int(time.time()*1000), "h": msg_id or message_id(message), "m": message},
+                              ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            if self._count and self._fh.tell() + len(line) > self.segment_bytes:
+                self._new_segment(seq)
+            if self._count % self.INDEX_EVERY == 0:
+                self._idx.write(self._IDX.pack(seq, self._fh.tell()))
+                self._idx.flush()
+            self._fh.write(line)
+            self._fh.flush()
+            self._seq, self._count, self._dirty = seq, self._count + 1, True
+            return seq, f"{self._segment.name}#{seq}"
+
+    def _sync(self):
+        if self._dirty:
+            os.fsync(self._fh.fileno())
+            os.fsync(self._idx.fileno())
+            self._dirty = False
+
+    def _fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                self._sync()
+
+    def compact(self, cutoff_millis: int):
+        """Rewrites all segments, dropping records older than `cutoff_millis`.
+
+        Must run before the log is opened for appends. New segments are built in
+        `.compact/` and swapped in once complete, so a crash never loses records.
+        """
+        work = self.root / ".compact"
+        shutil.rmtree(work, ignore_errors=True)
+        work.mkdir()
+        out = idx = None
+        count = last = 0
+        for seg in self._segments():
+            for seq, _, rec in self._read_segment(seg):
+                last = seq
+                if rec["t"] < cutoff_millis:
+                    continue
+                line = json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                if out is None or out.tell() + len(line) > self.segment_bytes:
+                    if out:
+                        out.close(); idx.close()
+                    out = open(work / f"{seq:012d}.log", "wb")
+                    idx = open(work / f"{seq:012d}.idx", "wb")
+                    count = 0
+                if count % self.INDEX_EVERY == 0:
+                    idx.write(self._IDX.pack(seq, out.tell()))
+                out.write(line)
+                count += 1
+        if out:
+            out.close(); idx.close()
+        elif last:
+            # Everything expired: keep an empty segment so cursors keep increasing
+            (work / f"{last + 1:012d}.log").touch()
+            (work / f"{last + 1:012d}.idx").touch()
+        for p in work.iterdir():
+            with open(p, "rb") as f:
+                os.fsync(f.fileno())
+        (work / "DONE").touch()
+        self._finish_compaction()
+
+    def _finish_compaction(self):
+        work = self.root / ".compact"
+        if not (work / "DONE").exists():
+            shutil.rmtree(work, ignore_errors=True)
+            return
+        for p in list(self.root.glob("*.log")) + list(self.root.glob("*.idx")):
+            p.unlink()
+        for p in work.iterdir():
+            if p.name != "DONE":
+                os.replace(p, self.root / p.name)
+        shutil.rmtree(work)
+
+class InboxIndex:
+    """In-memory index of stored notifications, rebuilt once at startup.
+
+    Each message carries the monotonically increasing cursor assigned by the
+    store, so `since=<cursor>` is a bisect and never rescans older history.
+    """
+    def __init__(self):
+        self._seqs = []
+        self._items = []  # (name, id, message), parallel to _seqs
+        self._lock = threading.Lock()
+        self._changed = asyncio.Event()  # replaced and set on every append
+
+    def rebuild(self, records):
+        seqs, items = [], []
+        for seq, name, msg_id, msg in records:
+            seqs.append(seq)
+            items.append((name, msg_id, msg))
+        with self._lock:
+            self._seqs, self._items = seqs, items
+
+    def append(self, seq: int, name: str, msg_id: str, message):
+        """Adds a stored message and wakes up long-polling readers. Call from the event loop."""
+        with self._lock:
+            self._seqs.append(seq)
+            self._items.append((name, msg_id, message))
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_append(self, timeout: float) -> bool:
+        """Waits until the next append; returns False on timeout."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def get(self, seq: int):
+        """(id, message) stored under cursor `seq`, or None."""
+        with self._lock:
+            i = bisect_left(self._seqs, seq)
+            if i < len(self._seqs) and self._seqs[i] == seq:
+                return self._items[i][1:]
+        return None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seqs)
+
+    def all(self) -> list:
+        with self._lock:
+            return [m for _, _, m in self._items]
+
+    def last(self) -> int:
+        """Cursor of the newest message (0 when empty)."""
+        with self._lock:
+            return self._seqs[-1] if self._seqs else 0
+
+    def page(self, since: int = 0, limit: int = DEFAULT_LIMIT, type_: Optional[str] = None,
+             action: Optional[str] = None) -> tuple[list, int]:
+        """Returns up to `limit` (cursor, id, message) triples after `since`, plus the next cursor.
+
+        The next cursor advances past non-matching messages too, so a filtered
+        poller never scans them twice.
+        """
+        out, cursor = [], max(since, 0)
+        with self._lock:
+            i, end = bisect_right(self._seqs, cursor), len(self._seqs)
+            while i < end and len(out) < limit:
+                _, msg_id, msg = self._items[i]
+                cursor = self._seqs[i]
+                i += 1
+                if matches(msg, type_, action):
+                    out.append((cursor, msg_id, msg))
+        return out, cursor
+
+def matches(msg, type_: Optional[str], action: Optional[str]) -> bool:
+    if not isinstance(msg, dict):
+        return type_ is None and action is None
+    if type_ is not None and msg.get("type") != type_:
+        return False
+    if action is not None:
+        inst = msg.get("instrument")
+        if not isinstance(inst, dict) or inst.get("action") != action:
+            return False
+    return True
+
+class JobQueue:
+    """Lease-based work queue over the stored `Create` messages, kept in SQLite.
+
+    A job is `pending` until a worker claims it, which leases it for `lease`
+    seconds under a fresh token. The worker acks it when done (`done`) or nacks
+    it to put it back (`pending`, or `dead` once it has been claimed
+    `max_attempts` times). A lease that runs out without an ack makes the job
+    claimable again, so a crashed worker's jobs are retried: delivery is
+    at-least-once, and a live worker extends its leases to keep them.
+    """
+    def __init__(self, path: Path, lease: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, cursor INTEGER NOT NULL, action TEXT,
+            state TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+            token TEXT, worker TEXT, lease_until REAL, error TEXT, updated REAL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, cursor)")
+
+    @staticmethod
+    def _job(cursor: int, msg_id: str, message):
+        if matches(message, "Create", None):
+            inst = message.get("instrument")
+            return msg_id, cursor, inst.get("action") if isinstance(inst, dict) else None, time.time()
+
+    def sync(self, records):
+        """
+        Aligns the queue with the stored messages at startup: adds new jobs and drops
+        those whose message expired. A job whose message is still stored keeps its
+        state; only its cursor follows the message (e.g. after the inbox was reset).
+        """
+        live = {}
+        for seq, _, msg_id, msg in records:
+            job = self._job(seq, msg_id, msg)
+            if job:
+                live.setdefault(msg_id, job)  # the first copy of a message stored twice, as add() keeps it
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            known = dict(self._db.execute("SELECT id, cursor FROM jobs"))
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in known if i not in live])
+            self._db.executemany("UPDATE jobs SET cursor = ? WHERE id = ?",
+                                 [(live[i][1], i) for i, c in known.items() if i in live and live[i][1] != c])
+            self._db.executemany("INSERT OR IGNORE INTO jobs (id, cursor, action, updated) VALUES (?, ?, ?, ?)",
+                                 list(live.values()))
+
+    def add(self, cursor: int, msg_id: str, message):
+        job = self._job(cursor, msg_id, message)
+        if job:
+            with self._lock:
+                self._db.execute("INSERT OR IGNORE INTO jobs (id, cursor, action, updated) VALUES (?, ?, ?, ?)", job)
+
+    def add_many(self, entries):
+        """add() for several (cursor, id, message) entries, in one transaction."""
+        rows = [job for job in (self._job(*e) for e in entries) if job]
+        if rows:
+            with self._lock, self._db:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.executemany("INSERT OR IGNORE INTO jobs (id, cursor, action, updated) VALUES (?, ?, ?, ?)", rows)
+
+    def claim(self, worker: str, limit: int = 1, action: Optional[str] = None, lease: Optional[float] = None) -> list:
+        """Leases up to `limit` pending jobs, oldest first; returns (id, cursor, token, lease_until, attempt) tuples."""
+        now = time.time()
+        lease_until = now + (lease or self.lease)
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            # Expired leases: the worker is gone or stuck, give the job to someone else
+            self._db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END, "
+                             "error = 'lease expired', token = NULL, updated = ? WHERE state = 'leased' AND lease_until < ?",
+                             (self.max_attempts, now, now))
+            rows = self._db.execute("SELECT id, cursor, attempts FROM jobs WHERE state = 'pending' AND (? IS NULL OR action = ?) "
+                                    "ORDER BY cursor LIMIT ?", (action, action, limit)).fetchall()
+            claimed = []
+            for msg_id, cursor, attempts in rows:
+                token = uuid.uuid4().hex
+                self._db.execute("UPDATE jobs SET state = 'leased', attempts = attempts + 1, token = ?, worker = ?, "
+                                 "lease_until = ?, updated = ? WHERE id = ?", (token, worker, lease_until, now, msg_id))
+                claimed.append((msg_id, cursor, token, lease_until, attempts + 1))
+            return claimed
+
+    def _update(self, sql: str, params: tuple) -> bool:
+        with self._lock:
+            return self._db.execute(sql, params).rowcount == 1
+
+    def ack(self, msg_id: str, token: str) -> bool:
+        return self._update("UPDATE jobs SET state = 'done', token = NULL, error = NULL, updated = ? "
+                            "WHERE id = ? AND token = ? AND state = 'leased'", (time.time(), msg_id, token))
+
+    def nack(self, msg_id: str, token: str, error: Optional[str] = None, retry: bool = True) -> bool:
+        return self._update("UPDATE jobs SET state = CASE WHEN ? AND attempts < ? THEN 'pending' ELSE 'dead' END, "
+                            "token = NULL, error = ?, updated = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                            (retry, self.max_attempts, error, time.time(), msg_id, token))
+
+    def extend(self, msg_id: str, token: str, lease: Optional[float] = None) -> Optional[float]:
+        lease_until = time.time() + (lease or self.lease)
+        ok = self._update("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                          (lease_until, time.time(), msg_id, token))
+        return lease_until if ok else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+store = SegmentLog(STATE_DIR / "inbox-log") if STORAGE == "log" else FileStore(INBOX)
+index = InboxIndex()
+jobs = JobQueue(STATE_DIR / "jobs.db")
+_records = store.load()
+index.rebuild(_records)
+jobs.sync(_records)
+del _records
+
+def store_message(data) -> tuple[int, str, str]:
+    """Stores a notification and indexes it; returns (cursor, stored name, id). Call from the event loop."""
+    msg_id = message_id(data)
+    with metrics.span("store_append"):
+        cursor, name = store.append(data, msg_id)
+    index.append(cursor, name, msg_id, data)
+    return cursor, name, msg_id
+
 @app.post("/inbox")
 async def inbox_post(req: Request):
     data = await req.json()
-    fname = INBOX / f"{int(time.time()*1000)}.json"
-    fname.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    return JSONResponse({"status":"ok","stored":fname.name})
+    cursor, name, msg_id = store_message(data)
+    with metrics.span("jobs_add"):
+        jobs.add(cursor, msg_id, data)
+    return JSONResponse({"status":"ok","stored":name,"cursor":cursor,"id":msg_id})
+
+def store_lines(lines: list, results: list):
+    """Stores the NDJSON `lines` of a batch, appending one result per non-blank line to `results`."""
+    added = []
+    for line in lines:
+        if not line.strip():
+            continue
+        if len(results) >= BATCH_MAX_ITEMS:
+            results.append({"status": "error", "error": f"more than {BATCH_MAX_ITEMS} notifications in the batch"})
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            results.append({"status": "error", "error": f"invalid JSON: {e}"})
+            continue
+        if not isinstance(data, dict):
+            results.append({"status": "error", "error": "not a JSON object"})
+            continue
+        cursor, name, msg_id = store_message(data)
+        added.append((cursor, msg_id, data))
+        results.append({"status": "ok", "stored": name, "cursor": cursor, "id": msg_id})
+    with metrics.span("jobs_add"):
+        jobs.add_many(added)
+
+@app.post("/inbox/batch")
+async def inbox_batch(req: Request):
+    """
+    Stores notifications sent as NDJSON (one JSON object per line), in order, as
+    many POST /inbox would. Lines are stored as the body arrives, and the jobs of
+    each received chunk are queued in one transaction. Returns one result per
+    non-blank line, in order: the fields of a POST /inbox response, or an error
+    for a line that is not a JSON object (the other lines are still stored).
+    """
+    results, rest = [], b""
+    async for chunk in req.stream():
+        *lines, rest = (rest + chunk).split(b"\n")
+        store_lines(lines, results)
+    store_lines([rest], results)
+    stored = sum(r["status"] == "ok" for r in results)
+    metrics.inc("batch_items", stored, status="ok")
+    metrics.inc("batch_items", len(results) - stored, status="error")
+    return {"stored": stored, "failed": len(results) - stored, "items": results}
 
 @app.get("/inbox")
-def inbox_list():
-    items = []
-    for p in sorted(INBOX.glob("*.json")):
+async def inbox_list(
+    since: Optional[int] = Query(None, ge=0, description="Return only messages after this cursor."),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    type: Optional[str] = Query(None, description="Filter on the activity type, e.g. Create."),
+    action: Optional[str] = Query(None, alias="instrument.action", description="Filter on instrument.action."),
+    wait: Optional[float] = Query(None, ge=0, le=MAX_WAIT, description="Long-poll: hold the request up to this many seconds until a matching message arrives."),
+):
+    # Without paging parameters keep the original contract: a bare list of every message.
+    if since is None and limit is None and type is None and action is None and wait is None:
+        return index.all()
+    with metrics.span("index_page"):
+        items, nxt = index.page(since or 0, limit or DEFAULT_LIMIT, type, action)
+    deadline = time.monotonic() + (wait or 0)
+    while not items and time.monotonic() < deadline:
+        if not await index.wait_for_append(deadline - time.monotonic()):
+            break
+        items, nxt = index.page(nxt, limit or DEFAULT_LIMIT, type, action)
+    # `last` lets a poller holding a cursor from before an inbox reset notice it
+    return {"items": [{"cursor": c, "id": i, "message": m} for c, i, m in items], "next": nxt, "last": index.last()}
+
+# --- Results: content-addressed, or streamed while their producer writes them ---
+def stored_result(digest: str):
+    """(path, stored encoding) of a result object, or None."""
+    for encoding, suffix in RESULT_SUFFIXES.items():
+        path = RESULTS / "objects" / digest[:2] / (digest + suffix)
+        if path.is_file():
+            return path, encoding
+    return None
+
+def result_size(path: Path, encoding: str) -> Optional[int]:
+    """Decoded size of a stored result, read from the gzip trailer or the zstd frame header; None if unknown."""
+    if encoding == "identity":
+        return path.stat().st_size
+    with open(path, "rb") as f:
+        if encoding == "gzip":  # ISIZE: single-member files under 4 GiB, as the orchestrator writes them
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack("<I", f.read(4))[0]
+        size = zstandard.frame_content_size(f.read(18)) if zstandard else -1
+        return size if size >= 0 else None
+
+def read_result(path: Path, encoding: str, start: int = 0, length: Optional[int] = None):
+    """Yields the decoded bytes of a stored result from `start`, `length` of them (all if None)."""
+    decode = {"gzip": lambda raw: gzip.GzipFile(fileobj=raw),
+              "zstd": lambda raw: zstandard.ZstdDecompressor().stream_reader(raw)}.get(encoding, nullcontext)
+    with open(path, "rb") as raw, decode(raw) as f:
+        if start:
+            f.seek(start)  # compressed streams decode and discard up to the offset
+        while length is None or length > 0:
+            data = f.read(65536 if length is None else min(65536, length))
+            if not data:
+                return
+            if length is not None:
+                length -= len(data)
+            yield data
+
+def accepts_encoding(request: Request, coding: str) -> bool:
+    for item in request.headers.get("accept-encoding", "").split(","):
+        token, _, params = item.partition(";")
+        if token.strip().lower() in (coding, "*") and not re.fullmatch(r"\s*q=0(\.0*)?\s*", params):
+            return True
+    return False
+
+def byte_range(header: str, size: int):
+    """(start, end) of a single `bytes=` range; None (send everything) for anything else. Raises 416."""
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not m or m.groups() == ("", ""):
+        return None  # multiple ranges or a malformed header: ignored, the whole result is sent
+    first, last = m.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or end < start:
+        raise HTTPException(416, "range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def serve_result(request: Request, digest: str, path: Path, encoding: str, immutable: bool) -> Response:
+    """
+    Serves a stored result: as stored (Content-Encoding) to clients that accept its
+    encoding, otherwise decoded, with single-range support. Each representation has
+    its own strong ETag, so conditional and ranged requests never mix them up.
+    """
+    range_header = request.headers.get("range")
+    passthrough = encoding != "identity" and accepts_encoding(request, encoding) and (
+        range_header is None or (encoding == "zstd" and zstandard is None))
+    if encoding == "zstd" and zstandard is None and not passthrough:
+        raise HTTPException(406, "result is zstd-compressed; send Accept-Encoding: zstd")
+    etag = f'"{digest}-{encoding}"' if passthrough else f'"{digest}"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding",
+               "Cache-Control": "public, max-age=31536000, immutable" if immutable else "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    media_type = "text/plain; charset=utf-8"
+    if passthrough:
+        headers.update({"Content-Encoding": encoding, "Content-Length": str(path.stat().st_size)})
+        body = read_result(path, "identity")
+    else:
+        size = result_size(path, encoding)
+        rng = None
+        if size is not None:
+            headers["Accept-Ranges"] = "bytes"
+            if range_header and request.headers.get("if-range", etag) == etag:
+                rng = byte_range(range_header, size)
+        if rng:
+            start, end = rng
+            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+            body = read_result(path, encoding, start, end - start + 1)
+        else:
+            if size is not None:
+                headers["Content-Length"] = str(size)
+            body = read_result(path, encoding)
+    status = 206 if "Content-Range" in headers else 200
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(body, status_code=status, headers=headers, media_type=media_type)
+
+@app.api_route("/results/{name}", methods=["GET", "HEAD"])
+async def results_get(name: str, request: Request):
+    """
+    Serves a result from the content-addressed store, by hash (immutable, cacheable
+    forever) or by result name. While the orchestrator is still writing a result
+    (as parts/<name>.part), the response streams the bytes as they are appended and
+    ends when it is stored, so a consumer reads the answer as it is generated.
+    Results written directly to state/ by older orchestrators are still served.
+    """
+    if not RESULT_NAME.match(name) or name.endswith(".part"):
+        raise HTTPException(404, "no such result")
+    if RESULT_HASH.match(name):
+        found = stored_result(name)
+        if not found:
+            raise HTTPException(404, "no such result")
+        return serve_result(request, name, *found, immutable=True)
+    path, part = STATE_DIR / name, RESULTS / "parts" / f"{name}.part"
+    for _ in range(2):  # the result may be stored between the checks, and its .part file removed
+        try:
+            digest = (RESULTS / "names" / name).read_text(encoding="ascii").strip()
+        except FileNotFoundError:
+            digest = None
+        if digest:
+            found = stored_result(digest)
+            if not found:
+                raise HTTPException(410, "result expired from the store")
+            return serve_result(request, digest, *found, immutable=False)
+        if path.is_file():
+            return FileResponse(path, media_type="text/plain; charset=utf-8")
         try:
-            items.append(json.loads(p.read_text(encoding="utf-8")))
-        except Exception:
+            f = open(part, "rb")
+            break
+        except FileNotFoundError:
             continue
-    return items
+    else:
+        raise HTTPException(404, "no such result")
+
+    def stored() -> bool:
+        try:
+            return bool(stored_result((RESULTS / "names" / name).read_text(encoding="ascii").strip()))
+        except FileNotFoundError:
+            return False
+
+    async def follow():
+        # The status line has been sent by the time the outcome is known, so a result that was not
+        # stored (the job failed, or the orchestrator stopped writing) aborts the response instead of
+        # ending it cleanly: the client sees a truncated body, not a complete but partial answer.
+        idle = 0.0
+        with f:
+            while True:
+                data = f.read(65536)
+                if data:
+                    idle = 0.0
+                    yield data
+                elif not part.exists():  # removed once stored (names/<name> is written first) or on failure
+                    yield f.read()
+                    if not stored():
+                        raise RuntimeError(f"result {name} was not stored")
+                    return
+                elif idle >= RESULT_IDLE_SECONDS:
+                    raise RuntimeError(f"result {name} got no new bytes for {RESULT_IDLE_SECONDS:g}s")
+                else:
+                    await asyncio.sleep(RESULT_POLL_SECONDS)
+                    idle += RESULT_POLL_SECONDS
+
+    if request.method == "HEAD":
+        f.close()
+        return Response(headers={"Cache-Control": "no-store"}, media_type="text/plain; charset=utf-8")
+    return StreamingResponse(follow(), media_type="text/plain; charset=utf-8",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+# --- Job queue: several orchestrators share the inbox's Create jobs ---
+@app.post("/jobs/claim")
+async def jobs_claim(
+    worker: str = Query(..., description="Name of the claiming worker, for diagnostics."),
+    limit: int = Query(1, ge=1, le=MAX_LIMIT),
+    action: Optional[str] = Query(None, alias="instrument.action", description="Only claim jobs with this instrument.action."),
+    lease: Optional[float] = Query(None, gt=0, description="Lease duration in seconds (default INBOX_LEASE_SECONDS)."),
+    wait: Optional[float] = Query(None, ge=0, le=MAX_WAIT, description="Long-poll: hold the request up to this many seconds until a job is available."),
+):
+    deadline = time.monotonic() + (wait or 0)
+    while True:
+        out = []
+        for msg_id, cursor, token, lease_until, attempt in jobs.claim(worker, limit, action, lease):
+            stored = index.get(cursor)
+            if stored is None or stored[0] != msg_id:
+                jobs.nack(msg_id, token, "message no longer stored", retry=False)
+                continue
+            out.append({"id": msg_id, "cursor": cursor, "token": token, "lease_until": lease_until,
+                        "attempt": attempt, "message": stored[1]})
+        if out or time.monotonic() >= deadline:
+            return {"jobs": out}
+        # New messages wake us up at once; expired leases are noticed within a second
+        await index.wait_for_append(min(1.0, deadline - time.monotonic()))
+
+@app.post("/jobs/{msg_id}/ack")
+async def jobs_ack(msg_id: str, token: str = Query(...)):
+    if not jobs.ack(msg_id, token):
+        raise HTTPException(409, "lease lost: the job expired or was claimed by another worker")
+    return {"status": "done"}
+
+@app.post("/jobs/{msg_id}/nack")
+async def jobs_nack(msg_id: str, token: str = Query(...), error: Optional[str] = None,
+                    retry: bool = Query(True, description="False for permanent failures (e.g. invalid parameters).")):
+    if not jobs.nack(msg_id, token, error, retry):
+        raise HTTPException(409, "lease lost: the job expired or was claimed by another worker")
+    return {"status": "released"}
+
+@app.post("/jobs/{msg_id}/extend")
+async def jobs_extend(msg_id: str, token: str = Query(...), lease: Optional[float] = Query(None, gt=0)):
+    lease_until = jobs.extend(msg_id, token, lease)
+    if lease_until is None:
+        raise HTTPException(409, "lease lost: the job expired or was claimed by another worker")
+    return {"lease_until": lease_until}
+
+@app.get("/jobs")
+async def jobs_stats():
+    return jobs.stats()
+
+# --- Metrics ---
+@app.get("/metrics")
+async def metrics_get():
+    """Request and storage timings, message and job counts, in the Prometheus text format."""
+    lines = ["# TYPE inbox_messages gauge", f"inbox_messages {len(index)}", "# TYPE inbox_jobs gauge"]
+    lines += [f'inbox_jobs{{state="{state}"}} {n}' for state, n in sorted(jobs.stats().items())]
+    return PlainTextResponse(metrics.render() + "\n".join(lines) + "\n",
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8080)
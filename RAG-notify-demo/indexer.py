@@ -1,19 +1,246 @@
 # /// script
 # requires-python = ">=3.10"
-# dependencies = []
+# dependencies = ["numpy>=1.26"]
 # ///
-import argparse, json, time
-ap = argparse.ArgumentParser()
-ap.add_argument("--in", dest="inp", required=True)
-ap.add_argument("--out", required=True)
-a = ap.parse_args()
-
-rows = [json.loads(l) for l in open(a.inp, encoding="utf-8")]
-index = {
-  "created_at": time.time(),
-  "dim": len(rows[0]["embedding"]) if rows else 0,
-  "items": rows
-}
-with open(a.out,"w",encoding="utf-8") as f:
-    f.write(json.dumps(index))
-print(f"Indexed {len(rows)} items → {a.out}")
\ No newline at end of file
+"""
+Builds a binary vector index from embeddings.jsonl (vectors inline, or in the
+embeddings.jsonl.f32 sidecar written by embedder.py).
+
+Layout for --out state/index.bin:
+  index.bin       MAGIC, uint32 header length, JSON header (dim, count, dtype, model,
+                  normalized, scale), padded to HEADER_BYTES, then a row-major
+                  count×dim matrix that query.py opens with np.memmap
+  index.bin.meta  one JSON object per chunk (id, text, …), without the embedding
+  index.bin.off   uint64 byte offsets of each .meta record (count+1 values)
+  index.bin.ivf   optional (--ann ivf) IVF coarse quantizer: unit centroids from
+                  spherical k-means, plus the row ids of each inverted list
+  index.bin.del   --merge only: one byte per row, 1 = tombstoned (chunk removed or changed)
+
+With --merge, rows are appended to an existing index and chunks of the same
+`source` that are no longer present are tombstoned; the index is rewritten
+without tombstones once they exceed COMPACT_RATIO of the rows.
+"""
+import argparse, io, json, os, struct, time
+import numpy as np
+
+MAGIC = b"RAGIDX01"
+HEADER_BYTES = 4096  # matrix starts on a page boundary
+DTYPES = ("float32", "float16", "int8")
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+COMPACT_RATIO = 0.5
+
+VEC_MAGIC = b"RAGVEC01"  # embedder.py's binary sidecar (<embeddings>.f32)
+
+def read_rows(inp:str):
+    """Streams the rows of an embeddings file, attaching "embedding" from the .f32 sidecar for rows with "vec"."""
+    V = None
+    if os.path.exists(inp+".f32") and os.path.getsize(inp+".f32") > 16:
+        with open(inp+".f32", "rb") as f:
+            magic, dim, _ = struct.unpack("<8sII", f.read(16))
+        if magic != VEC_MAGIC: raise ValueError(f"{inp}.f32 is not an embedding sidecar")
+        V = np.memmap(inp+".f32", dtype=np.float32, mode="r", offset=16).reshape(-1, dim)
+    with open(inp, encoding="utf-8") as f:
+        for l in f:
+            r = json.loads(l)
+            if "vec" in r:
+                if V is None: raise ValueError(f"chunk {r['id']} refers to a missing {inp}.f32")
+                r["embedding"] = V[r.pop("vec")]
+            yield r
+
+def encode_rows(vecs:np.ndarray, dtype:str)->np.ndarray:
+    if dtype == "int8":  # normalized vectors lie in [-1, 1]
+        return np.clip(np.rint(vecs*127), -127, 127).astype(np.int8)
+    return vecs.astype(dtype)
+
+def write_index(rows, out:str, model:str=DEFAULT_MODEL, dtype:str="float32", normalized:bool=True)->int:
+    """Streams (row dict with "embedding") into the binary index files; returns the count."""
+    tmp = out + ".tmp"
+    n, dim, offsets = 0, 0, [0]
+    with open(tmp, "wb") as vf, open(tmp+".meta", "wb") as mf:
+        vf.write(b"\0"*HEADER_BYTES)
+        for r in rows:
+            if "embedding" not in r: raise ValueError(f"chunk {r['id']} has no embedding (embedded with --index? use --merge)")
+            v = np.asarray(r.pop("embedding"), dtype=np.float32)
+            if not dim: dim = v.shape[0]
+            vf.write(encode_rows(v, dtype).tobytes())
+            mf.write((json.dumps(r, ensure_ascii=False)+"\n").encode("utf-8"))
+            offsets.append(mf.tell()); n += 1
+        header = {"format":"rag-index","version":1,"dim":dim,"count":n,"dtype":dtype,"model":model,
+                  "normalized":normalized,"scale":1/127 if dtype == "int8" else 1.0,"created_at":time.time()}
+        h = json.dumps(header).encode("utf-8")
+        vf.seek(0); vf.write(MAGIC + struct.pack("<I", len(h)) + h)
+    np.asarray(offsets, dtype="<u8").tofile(tmp+".off")
+    if os.path.exists(out+".del"): os.remove(out+".del")  # tombstones refer to the old rows
+    for ext in (".meta", ".off", ""):  # vectors last: a reader never sees new vectors with old metadata
+        os.replace(tmp+ext, out+ext)
+    return n
+
+def write_header(out:str, header:dict):
+    h = json.dumps(header).encode("utf-8")
+    assert len(h) + 12 <= HEADER_BYTES
+    with open(out, "r+b") as f: f.write(MAGIC + struct.pack("<I", len(h)) + h)
+
+def read_meta(out:str)->list:
+    with open(out+".meta", encoding="utf-8") as f: return [json.loads(l) for l in f]
+
+def read_deleted(out:str, n:int)->np.ndarray:
+    d = np.zeros(n, dtype=np.uint8)
+    if os.path.exists(out+".del"):
+        old = np.fromfile(out+".del", dtype=np.uint8)[:n]; d[:len(old)] = old
+    return d
+
+def open_matrix(path:str):
+    """Returns (header, memory-mapped count×dim matrix) of a binary index."""
+    with open(path, "rb") as f:
+        if f.read(8) != MAGIC: raise ValueError(f"{path}: not a binary index")
+        (hlen,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(hlen))
+    n, dim = header["count"], header["dim"]
+    if not n: return header, np.zeros((0, dim), dtype=header["dtype"])
+    return header, np.memmap(path, dtype=header["dtype"], mode="r", offset=HEADER_BYTES, shape=(n, dim))
+
+# --- IVF (approximate search) ---
+def assign(X, C:np.ndarray, block:int=65536)->np.ndarray:
+    """Index of the closest (max inner product) centroid for every row of X."""
+    out = np.empty(X.shape[0], dtype=np.int64)
+    for start in range(0, X.shape[0], block):
+        out[start:start+block] = np.argmax(np.asarray(X[start:start+block], dtype=np.float32) @ C.T, axis=1)
+    return out
+
+def kmeans(X:np.ndarray, nlist:int, iters:int=20, seed:int=0)->np.ndarray:
+    """Spherical k-means (cosine) on the rows of X; returns nlist×dim unit centroids."""
+    rng = np.random.default_rng(seed)
+    C = X[rng.choice(len(X), nlist, replace=False)].copy()
+    for _ in range(iters):
+        a = assign(X, C)
+        sums = np.zeros_like(C)
+        np.add.at(sums, a, X)
+        empty = np.bincount(a, minlength=nlist) == 0
+        if empty.any(): sums[empty] = X[rng.choice(len(X), int(empty.sum()))]  # reseed empty lists
+        C = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return C.astype(np.float32)
+
+def build_ivf(out:str, nlist:int=0, iters:int=10, seed:int=0)->int:
+    """Clusters the index rows into nlist inverted lists (default ~2·sqrt(n)) stored in out.ivf."""
+    header, V = open_matrix(out)
+    n = header["count"]
+    if not n: return 0
+    nlist = min(nlist or max(1, int(2*n**0.5)), n)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, min(n, 64*nlist), replace=False))  # k-means on a sample, assign everything
+    C = kmeans(np.asarray(V[sample], dtype=np.float32), nlist, iters, seed)
+    a = assign(V, C)
+    save_ivf(out, C, a)
+    return nlist
+
+def save_ivf(out:str, C:np.ndarray, a:np.ndarray):
+    """Stores centroids and the inverted lists given each row's list assignment `a`."""
+    ids = np.argsort(a, kind="stable").astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(a, minlength=len(C)))]).astype(np.int64)
+    buf = io.BytesIO()
+    np.savez(buf, centroids=C, offsets=offsets, ids=ids, count=np.int64(len(a)))
+    with open(out+".ivf.tmp", "wb") as f: f.write(buf.getvalue())
+    os.replace(out+".ivf.tmp", out+".ivf")
+
+def load_ivf_assignment(out:str):
+    """(centroids, list of every row) from out.ivf, or (None, None)."""
+    if not os.path.exists(out+".ivf"): return None, None
+    with np.load(out+".ivf") as z:
+        C, offsets, ids = z["centroids"], z["offsets"], z["ids"]
+    a = np.empty(len(ids), dtype=np.int64)
+    a[ids] = np.repeat(np.arange(len(C)), np.diff(offsets))
+    return C, a
+
+# --- Incremental merge ---
+def merge_index(rows, out:str, model:str=DEFAULT_MODEL, dtype:str="float32")->tuple:
+    """
+    Merges chunk rows into an existing index: new ids are appended, live chunks of the
+    same sources missing from `rows` are tombstoned, rows already indexed are left alone
+    (they may come without an embedding). Returns (added, tombstoned, live).
+    Rows are consumed as they come: new vectors are written right after the last
+    committed row, and only the header update at the end makes them visible.
+    """
+    if not os.path.exists(out):
+        n = write_index(rows, out, model, dtype)
+        return n, 0, n
+    header, _ = open_matrix(out)
+    if header["model"] != model or header["dtype"] != dtype:
+        raise ValueError(f"{out} holds {header['model']}/{header['dtype']} vectors; rebuild it without --merge")
+    n = header["count"]
+    meta, deleted = read_meta(out)[:n], read_deleted(out, n)
+    live = {m["id"]: i for i,m in enumerate(meta) if not deleted[i]}
+    incoming, sources, offsets = set(), set(), []
+    meta_end = int(np.fromfile(out+".off", dtype="<u8")[n])
+    with open(out, "r+b") as vf, open(out+".meta", "r+b") as mf:
+        # drop whatever an interrupted merge left past the committed rows
+        vf.seek(HEADER_BYTES + n*header["dim"]*np.dtype(dtype).itemsize); vf.truncate()
+        mf.seek(meta_end); mf.truncate()
+        for r in rows:
+            incoming.add(r["id"]); sources.add(r.get("source"))
+            if r["id"] in live: continue
+            if "embedding" not in r: raise ValueError(f"new chunk {r['id']} has no embedding")
+            v = np.asarray(r.pop("embedding"), dtype=np.float32)
+            if header["dim"] and v.shape[0] != header["dim"]: raise ValueError(f"dim {v.shape[0]} != {header['dim']}")
+            header["dim"] = header["dim"] or v.shape[0]
+            vf.write(encode_rows(v, dtype).tobytes())
+            mf.write((json.dumps(r, ensure_ascii=False)+"\n").encode("utf-8"))
+            offsets.append(mf.tell())
+    tomb = [i for cid,i in live.items() if meta[i].get("source") in sources and cid not in incoming]
+    if not offsets and not tomb: return 0, 0, len(live)
+    with open(out+".off", "r+b") as f:
+        f.seek((n+1)*8); f.truncate(); np.asarray(offsets, dtype="<u8").tofile(f)
+    deleted = np.concatenate([deleted, np.zeros(len(offsets), dtype=np.uint8)])
+    deleted[tomb] = 1
+    deleted.tofile(out+".del.tmp")  # swapped in with the header: tombstones without their replacements would hide chunks
+    header.update(count=n+len(offsets), updated_at=time.time())
+    write_header(out, header)  # last: readers only see the new rows once everything is on disk
+    os.replace(out+".del.tmp", out+".del")
+    C, a = load_ivf_assignment(out)
+    if C is not None:
+        _, V = open_matrix(out)
+        save_ivf(out, C, np.concatenate([a, assign(V[n:], C)]))
+    if deleted.sum() > COMPACT_RATIO*len(deleted): compact(out)
+    return len(offsets), len(tomb), len(live)+len(offsets)-len(tomb)
+
+def compact(out:str):
+    """Rewrites the index without its tombstoned rows (IVF lists are reassigned with the same centroids)."""
+    header, V = open_matrix(out)
+    deleted, C = read_deleted(out, header["count"]), load_ivf_assignment(out)[0]
+    def rows():
+        for i,m in enumerate(read_meta(out)):
+            if not deleted[i]:
+                m["embedding"] = np.asarray(V[i], dtype=np.float32)*header["scale"]; yield m
+    write_index(rows(), out, header["model"], header["dtype"], header.get("normalized", True))
+    if C is not None: save_ivf(out, C, assign(open_matrix(out)[1], C))
+
+def run(inp:str, out:str, model:str=DEFAULT_MODEL, dtype:str="float32", ann:str="none", nlist:int=0, merge:bool=False)->str:
+    if merge:
+        added, tomb, live = merge_index(read_rows(inp), out, model, dtype)
+        if not added and not tomb: return f"Index unchanged ({live} items) → {out}"
+        if ann == "ivf" and not os.path.exists(out+".ivf"): build_ivf(out, nlist)
+        return f"Merged +{added} / -{tomb} items ({live} live) → {out}"
+    n = write_index(read_rows(inp), out, model, dtype)
+    if ann == "ivf":
+        return f"Indexed {n} items → {out} (IVF, {build_ivf(out, nlist)} lists)"
+    if os.path.exists(out+".ivf"): os.remove(out+".ivf")  # stale ANN structure for an older matrix
+    return f"Indexed {n} items → {out}"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--model", default=DEFAULT_MODEL, help="model that produced the embeddings (stored in the header)")
+    ap.add_argument("--dtype", choices=DTYPES, default="float32")
+    ap.add_argument("--ann", choices=("none", "ivf"), default="none", help="also build an approximate-search structure")
+    ap.add_argument("--nlist", type=int, default=0, help="IVF lists (default ~2·sqrt(n))")
+    ap.add_argument("--merge", action="store_true", help="merge into --out instead of overwriting it")
+    ap.add_argument("--worker", default=os.getenv("RAG_WORKER"), help="host:port of a running rag_worker.py")
+    a = ap.parse_args(argv)
+    if a.worker:
+        from rag_worker import request
+        print(request(a.worker, "index", inp=os.path.abspath(a.inp), out=os.path.abspath(a.out), model=a.model, dtype=a.dtype, ann=a.ann, nlist=a.nlist, merge=a.merge))
+    else:
+        print(run(a.inp, a.out, a.model, a.dtype, a.ann, a.nlist, a.merge))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["httpx>=0.27","numpy>=1.26","sentence-transformers>=3.0","tokenizers>=0.15"]
+# ///
+"""
+Runs split → embed → index as one streaming pipeline: three stages connected by
+bounded queues, so fetching, encoding and index writes overlap, and chunks and
+vectors are never serialized to JSONL only to be parsed back.
+
+  split   splitter.iter_chunks, grouped in batches of --batch-size rows
+  embed   embedder.Embedder (skips indexed chunks, embedding cache, encoding)
+  index   indexer.merge_index into --index
+
+--chunks and --embeddings also write the intermediate artifacts, in the formats
+of splitter.py and embedder.py, for provenance.
+
+Run it from a checkout of this folder (it imports the sibling scripts):
+  uv run RAG-notify-demo/pipeline.py --in https://example.org/doc.md --index state/index.bin
+"""
+import argparse, json, os, queue, threading, time
+
+_END = object()
+
+def _put(q:queue.Queue, x, stop:threading.Event)->bool:
+    while not stop.is_set():
+        try: q.put(x, timeout=0.1); return True
+        except queue.Full: pass
+    return False
+
+def _pump(it, q:queue.Queue, stop:threading.Event):
+    """Feeds the items of `it` into q, then _END (or the exception that stopped it)."""
+    try:
+        for x in it:
+            if not _put(q, x, stop): return
+        _put(q, _END, stop)
+    except BaseException as e:
+        _put(q, e, stop)
+
+def _drain(q:queue.Queue, stop:threading.Event):
+    while True:
+        try: x = q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set(): return
+            continue
+        if x is _END: return
+        if isinstance(x, BaseException): raise x
+        yield x
+
+def stage(it, size:int, stop:threading.Event, threads:list):
+    """Runs the generator `it` on its own thread; returns an iterator over its output, at most `size` items ahead."""
+    q = queue.Queue(size)
+    threads.append(threading.Thread(target=_pump, args=(it, q, stop), daemon=True))
+    threads[-1].start()
+    return _drain(q, stop)
+
+def run(inp:str, index:str, model, model_name:str=None, cache:str=None, cache_size:int=200_000,
+        batch_size:int=64, processes:int=0, queue_size:int=4, chunk_size:int=None, overlap:int=None,
+        tokenizer:str=None, dtype:str="float32", ann:str="none", nlist:int=0,
+        chunks:str=None, embeddings:str=None, timings:dict=None)->str:
+    """Runs the pipeline; `timings` (if given) receives the encode seconds."""
+    import embedder, indexer, splitter
+    emb = embedder.Embedder(model, model_name, index, cache, cache_size, batch_size, processes)
+    stop, threads, t = threading.Event(), [], time.time()
+
+    def split():
+        f = open(chunks, "w", encoding="utf-8") if chunks else None
+        try:
+            batch = []
+            for r in splitter.iter_chunks(inp, chunk_size, overlap, tokenizer or splitter.DEFAULT_TOKENIZER):
+                if f: f.write(json.dumps(r, ensure_ascii=False)+"\n")
+                batch.append(r)
+                if len(batch) >= batch_size*max(1, processes): yield batch; batch = []
+            if batch: yield batch
+        finally:
+            if f: f.close()
+
+    def embed(batches):
+        f = open(embeddings, "w", encoding="utf-8") if embeddings else None
+        vw = embedder.VectorWriter(embeddings+".f32") if embeddings else None
+        try:
+            for batch in batches:
+                emb.embed_batch(batch)
+                if f: embedder.dump_rows(batch, f, vw)
+                yield batch
+        finally:
+            if f: f.close(); vw.close()
+
+    try:
+        batches = stage(embed(stage(split(), queue_size, stop, threads)), queue_size, stop, threads)
+        added, tomb, live = indexer.merge_index((r for b in batches for r in b), index, emb.model_name, dtype)
+    finally:
+        stop.set()
+        for th in threads: th.join()  # the embed stage may still be writing to the cache
+        emb.close()
+        if timings is not None: timings["encode"] = emb.encode_seconds
+    if ann == "ivf" and live and not os.path.exists(index+".ivf"): indexer.build_ivf(index, nlist)
+    return (f"Pipelined {emb.summary()}; merged +{added} / -{tomb} items ({live} live) "
+            f"→ {index} in {time.time()-t:.1f}s")
+
+def main(argv=None):
+    import embedder, splitter
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True, help="document URL or file://")
+    ap.add_argument("--index", required=True, help="binary index to merge into (created if missing)")
+    ap.add_argument("--model", default=embedder.DEFAULT_MODEL)
+    ap.add_argument("--cache", default=embedder.DEFAULT_CACHE, help="embedding cache directory")
+    ap.add_argument("--no-cache", dest="cache", action="store_const", const=None)
+    ap.add_argument("--cache-size", type=int, default=200_000)
+    ap.add_argument("--batch-size", type=int, default=64, help="chunks per batch between stages")
+    ap.add_argument("--processes", type=int, default=0, help="encode on a pool of N CPU processes")
+    ap.add_argument("--queue-size", type=int, default=4, help="batches buffered between two stages")
+    ap.add_argument("--tokenizer", default=splitter.DEFAULT_TOKENIZER)
+    ap.add_argument("--chunk-size", type=int, default=None)
+    ap.add_argument("--overlap", type=int, default=None)
+    ap.add_argument("--dtype", choices=("float32", "float16", "int8"), default="float32")
+    ap.add_argument("--ann", choices=("none", "ivf"), default="none")
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--chunks", help="also write the chunks artifact (splitter.py format)")
+    ap.add_argument("--embeddings", help="also write the embeddings artifact (embedder.py format, .f32 sidecar)")
+    ap.add_argument("--worker", default=os.getenv("RAG_WORKER"), help="host:port of a running rag_worker.py")
+    a = ap.parse_args(argv)
+    path = lambda p: p and os.path.abspath(p)
+    args = dict(inp=a.inp, index=path(a.index), cache=path(a.cache), cache_size=a.cache_size, batch_size=a.batch_size,
+                processes=a.processes, queue_size=a.queue_size, chunk_size=a.chunk_size, overlap=a.overlap,
+                tokenizer=a.tokenizer, dtype=a.dtype, ann=a.ann, nlist=a.nlist,
+                chunks=path(a.chunks), embeddings=path(a.embeddings))
+    if a.worker:
+        from rag_worker import request
+        print(request(a.worker, "pipeline", model=a.model, **args))
+    else:
+        print(run(model=a.model, model_name=a.model, **args))
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 # requires-python = ">=3.10"
 # dependencies = ["httpx>=0.27"]
 # ///
-import time, json, httpx, os, hashlib, subprocess, sys
+import time, json, httpx, os, hashlib, http.server, importlib, sqlite3, subprocess, sys, threading, types
+from datetime import datetime, timezone
 
 
 # --- Configuration ---
@@ -12,25 +13,116 @@ SHA = "main"
 RAW_URL = f"https://raw.githubusercontent.com/gegedenice/LLM-notify/{SHA}/RAG-notify-demo"
 # Use current working directory for state, not script location (since script runs from temp when remote)
 STATE_DIR = os.path.join(os.getcwd(), "state")
-SEEN_FILE = os.path.join(STATE_DIR, "seen.txt")
+SEEN_FILE = os.path.join(STATE_DIR, "seen.txt")  # legacy store, imported into SEEN_DB once
+SEEN_DB = os.path.join(STATE_DIR, "seen.db")
+SEEN_TTL_DAYS = float(os.getenv("SEEN_TTL_DAYS", "0"))  # forget processed ids after N days (0 = never)
+PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "100"))
+LONG_POLL = float(os.getenv("INBOX_LONG_POLL", "30"))  # 0 disables long-polling
+FALLBACK = 60  # plain polling period after a long-poll failure
+RAG_WORKER = os.getenv("RAG_WORKER")  # host:port of a warm rag_worker.py; unset → one `uv run` per stage
+PIPELINE = os.getenv("RAG_PIPELINE", "0") == "1"  # split → embed → index streamed in one process (pipeline.py)
+ARTIFACTS = os.getenv("RAG_ARTIFACTS", "1") == "1"  # pipeline mode: still write chunks/embeddings files
+PIPELINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline.py")  # needs a local checkout
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # serve GET /metrics (Prometheus) on this port; 0 = off
 os.makedirs(STATE_DIR, exist_ok=True)
 
-def seen_ids():
-    return set(open(SEEN_FILE).read().split()) if os.path.exists(SEEN_FILE) else set()
-def mark_seen(msgid):
-    with open(SEEN_FILE,"a") as f: f.write(msgid+"\n")
+def import_sibling(name:str):
+    """A sibling script as a module: from this checkout, else fetched from RAW_URL (when run from a URL)."""
+    try: return importlib.import_module(name)
+    except ModuleNotFoundError as e:
+        if e.name != name: raise
+        url = f"{RAW_URL}/{name}.py"
+        r = httpx.get(url, follow_redirects=True, timeout=30); r.raise_for_status()
+        module = sys.modules[name] = types.ModuleType(name)
+        exec(compile(r.text, url, "exec"), module.__dict__)
+        return module
 
-def sha(s: str) -> str: return hashlib.sha1(s.encode()).hexdigest()  # id simple
+rag_worker = import_sibling("rag_worker")  # Metrics, and the client of RAG_WORKER
+metrics = rag_worker.Metrics("rag_orchestrator")
 
-def post_announce(obj_name, path, who):
+def serve_metrics(port:int):
+    """Serves GET /metrics from a background thread: this orchestrator's spans, then the worker's (RAG_WORKER)."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics": return self.send_error(404)
+            text = metrics.render()
+            if RAG_WORKER:
+                try: text += rag_worker.request(RAG_WORKER, "metrics", timeout=5)
+                except (OSError, RuntimeError) as e: text += f"# rag_worker unavailable: {e}\n"
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers(); self.wfile.write(body)
+        def log_message(self, *args): pass
+    srv = http.server.ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    print(f"metrics on http://0.0.0.0:{port}/metrics", file=sys.stderr)
+
+def now_iso()->str: return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+class SeenStore:
+    """
+    Processed message ids in SQLite, looked up by primary key instead of loaded
+    into memory, plus the poller's high-water mark: the inbox cursor up to which
+    every message is processed, so a restart resumes there instead of re-reading
+    the whole inbox. Ids older than `ttl_days` are pruned at startup (0 = never).
+    """
+    def __init__(self, path: str, ttl_days: float = 0, legacy: str = None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, at REAL NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE INDEX IF NOT EXISTS seen_at ON seen (at)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy and os.path.exists(legacy) and self._meta("legacy_imported") is None:
+            at = os.path.getmtime(legacy)
+            with open(legacy, encoding="utf-8") as f, self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)",
+                                     ((line.strip(), at) for line in f if line.strip()))
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_imported', '1')")
+        if ttl_days > 0:
+            self._db.execute("DELETE FROM seen WHERE at < ?", (time.time() - ttl_days * 86400,))
+
+    def _meta(self, key: str):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, msg_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM seen WHERE id = ?", (msg_id,)).fetchone() is not None
+
+    def add(self, msg_id: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO seen VALUES (?, ?)", (msg_id, time.time()))
+
+    def cursor(self) -> int:
+        with self._lock:
+            return int(self._meta("cursor") or 0)
+
+    def set_cursor(self, cursor: int):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('cursor', ?)", (str(cursor),))
+
+def sha(s: str) -> str: return hashlib.sha1(s.encode()).hexdigest()  # id simple (inboxes that do not send ids)
+
+def post_announce(obj_name, path, who, details=None):
+    """
+    Announces a produced state object; path=None when it was streamed without being written to disk.
+    `details` (start/end times, stage durations) are added to the generating activity.
+    """
     payload = {
       "@context": ["https://www.w3.org/ns/activitystreams","https://www.w3.org/ns/prov#"],
       "type": "Announce",
       "actor": "https://smartbibl.ia/actors/runner",
-      "object": {"type":"Document","id":f"urn:smartbibl:state:{obj_name}","name":obj_name,"url":f"file://{path}"},
-      "prov:wasGeneratedBy": {"type":"Activity","prov:wasAssociatedWith": who}
+      "object": {"type":"Document","id":f"urn:smartbibl:state:{obj_name}","name":obj_name},
+      "prov:wasGeneratedBy": {"type":"Activity","prov:wasAssociatedWith": who, **(details or {})}
     }
-    httpx.post(INBOX_URL, headers={"Content-Type":"application/ld+json"}, json=payload, timeout=30)
+    if path: payload["object"]["url"] = f"file://{path}"
+    with metrics.span("announce"):
+        httpx.post(INBOX_URL, headers={"Content-Type":"application/ld+json"}, json=payload, timeout=30)
 
 def run(cmd):
     print("→", " ".join(cmd)); 
@@ -38,29 +130,83 @@ def run(cmd):
     print(p.stdout); 
     if p.stderr: print(p.stderr, file=sys.stderr)
 
+def stage(script, op, **args)->float:
+    """
+    Runs one pipeline stage on the warm worker when RAG_WORKER is set, else as a `uv run` subprocess.
+    Returns its duration in seconds (also recorded as the `op` span).
+    """
+    t = time.perf_counter()
+    with metrics.span(op):
+        if RAG_WORKER:
+            print("→", op, "@", RAG_WORKER); print(rag_worker.request(RAG_WORKER, op, **args))
+        else:
+            cmd = ["uv","run",script if os.path.isabs(script) else f"{RAW_URL}/{script}"]
+            for k,v in args.items():
+                flag = "--in" if k == "inp" else f"--{k.replace('_','-')}"
+                cmd += [flag] if v is True else [flag, str(v)]
+            run(cmd)
+    return round(time.perf_counter()-t, 6)
+
+def activity(started:str, durations:dict)->dict:
+    """Provenance details of a job's activity so far: start and end times, seconds per stage."""
+    return {"prov:startedAtTime": started, "prov:endedAtTime": now_iso(), "durations": dict(durations)}
+
 def main():
-    done = seen_ids()
+    seen = SeenStore(SEEN_DB, SEEN_TTL_DAYS, legacy=SEEN_FILE)
+    if METRICS_PORT: serve_metrics(METRICS_PORT)
+    cursor, fallback_until = seen.cursor(), 0.0
     while True:
-        msgs = httpx.get(INBOX_URL, timeout=30).json()
-        for m in msgs:
-            msgid = sha(json.dumps(m, sort_keys=True))
-            if msgid in done: continue
+        wait = LONG_POLL if time.monotonic() >= fallback_until else 0
+        params = {"since":cursor,"limit":PAGE_SIZE,"type":"Create","instrument.action":"index"}
+        if wait: params["wait"] = wait
+        try:
+            with metrics.span("poll_fetch_wait" if wait else "poll_fetch"):  # long-polls include their wait
+                r = httpx.get(INBOX_URL, params=params, timeout=30+wait); r.raise_for_status()
+                page = r.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"inbox fetch failed: {e}", file=sys.stderr)
+            if wait: fallback_until = time.monotonic() + FALLBACK  # stream dropped → plain polling for a while
+            time.sleep(5); continue
+        if page.get("last", page["next"]) < cursor:
+            print(f"inbox cursor went back from {cursor}; rescanning", file=sys.stderr)
+            cursor = 0; continue
+        for it in page["items"]:
+            m = it["message"]
+            msgid = it.get("id") or sha(json.dumps(m, sort_keys=True))
+            with metrics.span("dedup"): duplicate = msgid in seen
+            if duplicate: continue
             if m.get("type") != "Create": continue
             inst = m.get("instrument",{}); 
             if inst.get("action") != "index": continue
             obj = m.get("object",{})
             url = obj.get("url") or obj.get("id")
+            # each Announce's activity carries the job's start time and the seconds spent per stage so far
+            started, durations = now_iso(), {}
+            if PIPELINE:
+                # split → embed → index streamed through bounded queues, same announces
+                durations["pipeline"] = stage(PIPELINE_SCRIPT, "pipeline", inp=url, index=os.path.join(STATE_DIR,"index.bin"),
+                      cache=os.path.join(STATE_DIR,"embcache"),
+                      **({"chunks":os.path.join(STATE_DIR,"chunks.jsonl"),
+                          "embeddings":os.path.join(STATE_DIR,"embeddings.jsonl")} if ARTIFACTS else {}))
+                post_announce("chunks", "state/chunks.jsonl" if ARTIFACTS else None, f"splitter.py@{SHA}", activity(started, durations))
+                post_announce("embeddings", "state/embeddings.jsonl" if ARTIFACTS else None, f"embedder.py@{SHA}", activity(started, durations))
+                post_announce("index", "state/index.bin", f"indexer.py@{SHA}", activity(started, durations))
+                seen.add(msgid); seen.set_cursor(it["cursor"])
+                continue
             # 1) split
-            run(["uv","run","<RAW_URL>/splitter.py","--in",url,"--out","state/chunks.jsonl"])
-            post_announce("chunks", "state/chunks.jsonl", f"splitter.py@{SHA}")
+            durations["split"] = stage("splitter.py", "split", inp=url, out=os.path.join(STATE_DIR,"chunks.jsonl"))
+            post_announce("chunks", "state/chunks.jsonl", f"splitter.py@{SHA}", activity(started, durations))
             # 2) embed
-            run(["uv","run","<RAW_URL>/embedder.py","--in","state/chunks.jsonl","--out","state/embeddings.jsonl"])
-            post_announce("embeddings", "state/embeddings.jsonl", f"embedder.py@{SHA}")
-            # 3) index
-            run(["uv","run","<RAW_URL>/indexer.py","--in","state/embeddings.jsonl","--out","state/index.jsonl"])
-            post_announce("index", "state/index.jsonl", f"indexer.py@{SHA}")
-            mark_seen(msgid); done.add(msgid)
-        time.sleep(2)
+            # only chunks not already in the index are embedded, and only cache misses are encoded
+            durations["embed"] = stage("embedder.py", "embed", inp=os.path.join(STATE_DIR,"chunks.jsonl"), out=os.path.join(STATE_DIR,"embeddings.jsonl"),
+                  index=os.path.join(STATE_DIR,"index.bin"), cache=os.path.join(STATE_DIR,"embcache"))
+            post_announce("embeddings", "state/embeddings.jsonl", f"embedder.py@{SHA}", activity(started, durations))
+            # 3) index: merge this document into the shared index (tombstones its removed/changed chunks)
+            durations["index"] = stage("indexer.py", "index", inp=os.path.join(STATE_DIR,"embeddings.jsonl"), out=os.path.join(STATE_DIR,"index.bin"), merge=True)
+            post_announce("index", "state/index.bin", f"indexer.py@{SHA}", activity(started, durations))
+            seen.add(msgid); seen.set_cursor(it["cursor"])  # jobs run in order: the high-water mark follows
+        cursor = page["next"]; seen.set_cursor(cursor)
+        if len(page["items"]) < PAGE_SIZE and not wait: time.sleep(2)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,21 +2,172 @@
 # requires-python = ">=3.10"
 # dependencies = ["numpy>=1.26","sentence-transformers>=3.0"]
 # ///
-import argparse, json, numpy as np
-from sentence_transformers import SentenceTransformer
-
-ap = argparse.ArgumentParser()
-ap.add_argument("--index", required=True)
-ap.add_argument("--q", required=True)
-ap.add_argument("--k", type=int, default=5)
-ap.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
-a = ap.parse_args()
-
-idx = json.loads(open(a.index, encoding="utf-8").read())
-model = SentenceTransformer(a.model)
-qv = model.encode([a.q], normalize_embeddings=True)[0]
-def cos(a,b): return float(np.dot(a,b))
-scored = [(cos(qv, np.array(it["embedding"])), it) for it in idx["items"]]
-scored.sort(key=lambda t: t[0], reverse=True)
-for s,it in scored[:a.k]:
-    print(f"{s:.3f}  {it['id']}: {it['text'][:120].replace('\n',' ')}…")
\ No newline at end of file
+import argparse, json, os, struct, sys, time, numpy as np
+
+MAGIC = b"RAGIDX01"  # see indexer.py for the layout
+HEADER_BYTES = 4096
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_NPROBE = 8
+
+class Index:
+    """Binary index opened lazily: vectors are memory-mapped, chunk metadata is read per hit."""
+    def __init__(self, path:str):
+        with open(path, "rb") as f:
+            if f.read(8) != MAGIC: raise ValueError(f"{path}: not a binary index")
+            (hlen,) = struct.unpack("<I", f.read(4))
+            self.header = json.loads(f.read(hlen))
+        n, dim = self.header["count"], self.header["dim"]
+        self.vectors = (np.memmap(path, dtype=self.header["dtype"], mode="r", offset=HEADER_BYTES, shape=(n, dim))
+                        if n else np.zeros((0, dim), dtype=self.header["dtype"]))
+        self.offsets = np.fromfile(path+".off", dtype="<u8")
+        self._meta_path = path+".meta"
+        self.live = None  # None = every row is live
+        if os.path.exists(path+".del"):
+            d = np.fromfile(path+".del", dtype=np.uint8)[:n]
+            if d.any(): self.live = np.concatenate([d == 0, np.ones(n-len(d), dtype=bool)])
+        self.ivf = IVF(path+".ivf") if os.path.exists(path+".ivf") else None
+        if self.ivf and self.ivf.count != n:
+            print(f"[query] ignoring {path}.ivf built for {self.ivf.count} rows (index has {n})", file=sys.stderr)
+            self.ivf = None
+
+    def __len__(self): return self.header["count"]
+
+    def meta(self, i:int)->dict:
+        with open(self._meta_path, "rb") as f:
+            f.seek(int(self.offsets[i])); return json.loads(f.read(int(self.offsets[i+1]-self.offsets[i])))
+
+class JsonIndex:
+    """Legacy index.jsonl written by earlier indexer.py versions (parsed in full)."""
+    def __init__(self, path:str):
+        idx = json.loads(open(path, encoding="utf-8").read())
+        self.items = idx["items"]
+        self.header = {"dim": idx.get("dim", 0), "count": len(self.items), "dtype": "float32", "model": None, "scale": 1.0}
+        self.vectors = np.array([it["embedding"] for it in self.items], dtype=np.float32).reshape(len(self.items), -1)
+        self.live = self.ivf = None
+    def __len__(self): return len(self.items)
+    def meta(self, i:int)->dict: return self.items[i]
+
+class IVF:
+    """Inverted-file coarse quantizer written by `indexer.py --ann ivf`."""
+    def __init__(self, path:str):
+        with np.load(path) as z:
+            self.centroids, self.offsets, self.ids = z["centroids"], z["offsets"], z["ids"]
+            self.count = int(z["count"])
+
+    def search(self, vectors, Q:np.ndarray, k:int, nprobe:int, scale:float=1.0, live=None)->list:
+        """Scores only the rows of the nprobe lists closest to each query; returns [(scores, ids)] per query."""
+        nprobe = max(1, min(nprobe, len(self.centroids)))
+        lists = np.argpartition(-(Q @ self.centroids.T), nprobe-1, axis=1)[:, :nprobe]
+        out = []
+        for qi, ls in enumerate(lists):
+            cand = np.sort(np.concatenate([self.ids[self.offsets[l]:self.offsets[l+1]] for l in ls]))  # sequential reads
+            if live is not None: cand = cand[live[cand]]
+            s, j = top_k(vectors[cand], Q[qi:qi+1], k, scale)
+            out.append((s[0], cand[j[0]]))
+        return out
+
+def load_index(path:str):
+    with open(path, "rb") as f: binary = f.read(8) == MAGIC
+    return Index(path) if binary else JsonIndex(path)
+
+def load_model(name:str=DEFAULT_MODEL):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+def top_k(vectors, Q:np.ndarray, k:int, scale:float=1.0, block:int=65536, live=None):
+    """
+    Exact top-k by inner product for every row of Q (m×dim) against vectors (n×dim).
+    Scores one block of rows per matrix product and keeps candidates with
+    argpartition, so memory stays O(block·m) and nothing is fully sorted.
+    Rows where the boolean mask `live` is False score -inf.
+    Returns (scores, row ids), both m×k, best first.
+    """
+    n, m = vectors.shape[0], Q.shape[0]
+    k = min(k, n)
+    if k <= 0: return np.zeros((m, 0), np.float32), np.zeros((m, 0), np.int64)
+    best_s = best_i = None
+    for start in range(0, n, block):
+        s = Q @ np.asarray(vectors[start:start+block], dtype=np.float32).T  # m×b
+        if live is not None: s[:, ~live[start:start+block]] = -np.inf
+        kk = min(k, s.shape[1])
+        cand = np.argpartition(-s, kk-1, axis=1)[:, :kk]
+        cs, ci = np.take_along_axis(s, cand, axis=1), cand + start
+        if best_s is not None:
+            cs, ci = np.concatenate([best_s, cs], 1), np.concatenate([best_i, ci], 1)
+            keep = np.argpartition(-cs, k-1, axis=1)[:, :k]
+            cs, ci = np.take_along_axis(cs, keep, axis=1), np.take_along_axis(ci, keep, axis=1)
+        best_s, best_i = cs, ci
+    order = np.argsort(-best_s, axis=1)
+    return np.take_along_axis(best_s, order, axis=1)*scale, np.take_along_axis(best_i, order, axis=1)
+
+def top_k_rows(idx, Q:np.ndarray, k:int, nprobe=None)->list:
+    """[(scores, row ids)] per query: IVF when the index has one and nprobe != 0, exact otherwise."""
+    if idx.ivf is not None and nprobe != 0:
+        return idx.ivf.search(idx.vectors, Q, k, nprobe or DEFAULT_NPROBE, idx.header["scale"], idx.live)
+    return list(zip(*top_k(idx.vectors, Q, k, idx.header["scale"], live=idx.live)))
+
+def search_batch(idx, qs:list, k:int, model, nprobe=None)->list:
+    """Returns, for each question, its k best (score, id, text); all questions share one matrix product per block."""
+    Q = np.asarray(model.encode(list(qs), normalize_embeddings=True), dtype=np.float32).reshape(len(qs), -1)
+    out = []
+    for srow, irow in top_k_rows(idx, Q, k, nprobe):
+        hits = []
+        for s,i in zip(srow, irow):
+            if not np.isfinite(s): continue  # fewer live rows than k
+            m = idx.meta(int(i)); hits.append((float(s), m["id"], m["text"]))
+        out.append(hits)
+    return out
+
+def search(idx, q:str, k:int, model, nprobe=None)->list:
+    """Returns the k best (score, id, text) for question q."""
+    return search_batch(idx, [q], k, model, nprobe)[0]
+
+def bench_recall(idx, Q:np.ndarray, k:int, nprobes:list)->list:
+    """Recall@k of IVF against exact search, with mean per-query latency, for each nprobe."""
+    t = time.perf_counter(); exact = top_k_rows(idx, Q, k, nprobe=0); t_exact = (time.perf_counter()-t)/len(Q)
+    rows = [("exact", 1.0, t_exact)]
+    for nprobe in nprobes:
+        t = time.perf_counter(); approx = top_k_rows(idx, Q, k, nprobe); dt = (time.perf_counter()-t)/len(Q)
+        hit = sum(len(np.intersect1d(e[1], a[1])) for e,a in zip(exact, approx))
+        rows.append((f"nprobe={nprobe}", hit/max(1, sum(len(e[1]) for e in exact)), dt))
+    return rows
+
+def fmt(hits)->str:
+    return "\n".join(f"{s:.3f}  {i}: {t[:120].replace(chr(10),' ')}…" for s,i,t in hits)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--index", required=True)
+    g = ap.add_mutually_exclusive_group(required=True)
+    g.add_argument("--q")
+    g.add_argument("--q-file", help="one question per line, answered in a single batch")
+    g.add_argument("--bench", type=int, metavar="N", help="recall@k of IVF vs exact search on N indexed vectors used as queries")
+    ap.add_argument("--nprobe", type=int, help=f"IVF lists scanned per query (default {DEFAULT_NPROBE}); more = better recall, slower")
+    ap.add_argument("--exact", action="store_true", help="ignore the IVF structure and scan every vector")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--model", help="defaults to the model recorded in the index header")
+    ap.add_argument("--worker", default=os.getenv("RAG_WORKER"), help="host:port of a running rag_worker.py")
+    a = ap.parse_args(argv)
+    nprobe = 0 if a.exact else a.nprobe
+    if a.bench:
+        idx = load_index(a.index)
+        if idx.ivf is None: ap.error("--bench needs an index built with --ann ivf")
+        rng = np.random.default_rng(0)
+        Q = np.asarray(idx.vectors[np.sort(rng.choice(len(idx), min(a.bench, len(idx)), replace=False))], dtype=np.float32)*idx.header["scale"]
+        for name, recall, dt in bench_recall(idx, Q, a.k, [a.nprobe] if a.nprobe else [1, 2, 4, 8, 16, 32, 64]):
+            print(f"{name:>12}  recall@{a.k}={recall:.3f}  {dt*1000:.2f} ms/query")
+        return
+    qs = [a.q] if a.q is not None else [l.strip() for l in open(a.q_file, encoding="utf-8") if l.strip()]
+    if a.worker:
+        from rag_worker import request
+        results = request(a.worker, "query", index=os.path.abspath(a.index), qs=qs, k=a.k, model=a.model, nprobe=nprobe)
+    else:
+        idx = load_index(a.index)
+        results = search_batch(idx, qs, a.k, load_model(a.model or idx.header.get("model") or DEFAULT_MODEL), nprobe)
+    if a.q is not None:
+        print(fmt(results[0])); return
+    for q, hits in zip(qs, results):
+        print(f"## {q}\n{fmt(hits)}\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["httpx>=0.27","numpy>=1.26","sentence-transformers>=3.0"]
+# ///
+"""
+Long-lived RAG worker: loads embedding models once and serves split / embed /
+index / pipeline / query requests over a local TCP socket, so the per-document and
+per-query critical path no longer pays model loading.
+
+Protocol: one JSON object per line, {"op": "embed", "args": {...}}, answered by
+{"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+The "metrics" op returns the worker's timing spans in the Prometheus text format:
+one per op (the "index" span is the index write, "query" covers encoding the
+questions and the search), plus model_load and encode (model.encode only).
+The CLIs (splitter.py, embedder.py, indexer.py, pipeline.py, query.py) forward to a worker
+when given --worker host:port or RAG_WORKER.
+
+Run it from a checkout of this folder (it imports the sibling scripts):
+  uv run RAG-notify-demo/rag_worker.py --listen 127.0.0.1:8765
+"""
+import argparse, json, os, socket, socketserver, sys, threading, time
+from contextlib import contextmanager
+
+DEFAULT_ADDR = "127.0.0.1:8765"
+
+_models, _indexes, _index_locks = {}, {}, {}
+_lock = threading.Lock()
+
+class Metrics:
+    """
+    Timing spans and counters in the Prometheus text format: one `<prefix>_span_seconds`
+    histogram labelled by span, and `<prefix>_<name>_total` counters. Also used by
+    poll_and_run.py and inbox_server.py, so the three endpoints share one layout.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix:str, buckets:tuple=BUCKETS):
+        self.prefix, self.buckets, self._lock, self._spans, self._counters = prefix, buckets, threading.Lock(), {}, {}
+
+    def observe(self, span:str, seconds:float):
+        with self._lock:
+            h = self._spans.setdefault(span, [0]*len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound: h[i] += 1
+            h[-2] += 1; h[-1] += seconds
+
+    @contextmanager
+    def span(self, name:str):
+        t = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter()-t)
+
+    def inc(self, name:str, value:float=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self)->str:
+        label = lambda items: "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+        name = f"{self.prefix}_span_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        with self._lock:
+            for span, h in sorted(self._spans.items()):
+                lines += [f'{name}_bucket{label([("span", span), ("le", b)])} {n}' for b, n in zip(self.buckets, h)]
+                lines += [f'{name}_bucket{label([("span", span), ("le", "+Inf")])} {h[-2]}',
+                          f'{name}_sum{label([("span", span)])} {h[-1]:.6f}', f'{name}_count{label([("span", span)])} {h[-2]}']
+            for counter in sorted({n for n, _ in self._counters}):
+                lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+                lines += [f"{self.prefix}_{counter}_total{label(labels)} {v:g}"
+                          for (n, labels), v in sorted(self._counters.items()) if n == counter]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics("rag_worker")
+OPS = ("split", "embed", "pipeline", "index", "query")
+
+def get_model(name:str):
+    """Returns a warm SentenceTransformer, loading it on first use only."""
+    with _lock:
+        if name not in _models:
+            import embedder
+            t = time.time()
+            with metrics.span("model_load"):
+                _models[name] = (embedder.load_model(name), threading.Lock())
+            print(f"[worker] loaded {name} in {time.time()-t:.1f}s", file=sys.stderr)
+        return _models[name]
+
+def index_lock(path:str):
+    """Lock held while an index file is written: requests run in parallel threads, and a merge reads
+    the index it then replaces, so two writers of one path would lose each other's documents."""
+    with _lock:
+        return _index_locks.setdefault(os.path.realpath(path), threading.Lock())
+
+def get_index(path:str):
+    """Opened index, cached until the file changes."""
+    import query
+    mtime = os.stat(path).st_mtime
+    with _lock:
+        hit = _indexes.get(path)
+        if hit and hit[0] == mtime: return hit[1]
+    idx = query.load_index(path)
+    with _lock: _indexes[path] = (mtime, idx)
+    return idx
+
+def handle(op:str, args:dict):
+    if op == "metrics":
+        return metrics.render()
+    if op not in OPS:
+        raise ValueError(f"unknown op: {op}")
+    ok = False
+    try:
+        with metrics.span(op):
+            result = _handle(op, args)
+        ok = True
+        return result
+    finally:
+        metrics.inc("requests", op=op, ok=str(ok).lower())
+
+def _handle(op:str, args:dict):
+    if op == "split":
+        import splitter
+        return splitter.run(args["inp"], args["out"], args.get("chunk_size"), args.get("overlap"),
+                            args.get("tokenizer", splitter.DEFAULT_TOKENIZER))
+    if op == "embed":
+        import embedder
+        name = args.get("model", embedder.DEFAULT_MODEL)
+        model, lock = get_model(name)
+        timings = {}
+        with lock:  # one encode (and cache writer) at a time per model
+            try:
+                return embedder.run(args["inp"], args["out"], model, args.get("index"), args.get("cache"), name,
+                                    args.get("cache_size", 200_000), args.get("batch_size", 64), args.get("fmt", "bin"),
+                                    args.get("processes", 0), timings)
+            finally:
+                if "encode" in timings: metrics.observe("encode", timings["encode"])
+    if op == "pipeline":
+        import embedder, pipeline
+        name = args.pop("model", None) or embedder.DEFAULT_MODEL
+        model, lock = get_model(name)
+        timings = {}
+        with index_lock(args["index"]), lock:
+            try: return pipeline.run(model=model, model_name=name, timings=timings, **args)
+            finally:
+                if "encode" in timings: metrics.observe("encode", timings["encode"])
+    if op == "index":
+        import indexer
+        with index_lock(args["out"]):
+            return indexer.run(args["inp"], args["out"], args.get("model") or indexer.DEFAULT_MODEL, args.get("dtype", "float32"),
+                               args.get("ann", "none"), args.get("nlist", 0), args.get("merge", False))
+    if op == "query":
+        import query
+        idx = get_index(args["index"])
+        model, lock = get_model(args.get("model") or idx.header.get("model") or query.DEFAULT_MODEL)
+        with lock:
+            qs = args["qs"] if "qs" in args else [args["q"]]
+            res = query.search_batch(idx, qs, args.get("k", 5), model, args.get("nprobe"))
+            return res if "qs" in args else res[0]
+    raise ValueError(f"unknown op: {op}")
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                resp = {"ok": True, "result": handle(req["op"], req.get("args", {}))}
+            except Exception as e:
+                resp = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(resp, ensure_ascii=False)+"\n").encode("utf-8"))
+            self.wfile.flush()
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def _split_addr(addr:str):
+    host, _, port = addr.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def request(addr:str, op:str, timeout:float=600, **args):
+    """Client side: sends one request to a worker and returns its result."""
+    with socket.create_connection(_split_addr(addr), timeout=timeout) as s:
+        s.sendall((json.dumps({"op": op, "args": args}, ensure_ascii=False)+"\n").encode("utf-8"))
+        resp = json.loads(s.makefile("rb").readline())
+    if not resp["ok"]:
+        raise RuntimeError(f"rag_worker {op} failed: {resp['error']}")
+    return resp["result"]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listen", default=os.getenv("RAG_WORKER", DEFAULT_ADDR))
+    ap.add_argument("--preload", default="sentence-transformers/all-MiniLM-L6-v2", help="model to load at startup ('' to skip)")
+    a = ap.parse_args(argv)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if a.preload: get_model(a.preload)
+    with Server(_split_addr(a.listen), Handler) as srv:
+        print(f"[worker] listening on {a.listen}", file=sys.stderr)
+        srv.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,106 @@
 # /// script
 # requires-python = ">=3.10"
-# dependencies = ["httpx>=0.27"]
+# dependencies = ["httpx[http2]>=0.27"]
 # ///
-import argparse, json, httpx, sys
-ap = argparse.ArgumentParser()
-ap.add_argument("--inbox", required=True)
-ap.add_argument("--payload", required=True, help="JSON file")
-a = ap.parse_args()
-response = httpx.get(a.payload)
-response.raise_for_status() # Raise an exception for bad status codes
-data = json.loads(response.text)
-r = httpx.post(a.inbox, headers={"Content-Type":"application/ld+json"}, json=data, timeout=30)
-r.raise_for_status()
-print("Sent:", r.json())
\ No newline at end of file
+"""
+Sends LDN notifications to the inbox: one JSON payload (--payload, a URL or a
+local file), or a JSONL file of them (--payload-file) through POST /inbox/batch.
+"""
+import argparse, itertools, json, httpx, sys, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+def load_payload(src:str)->dict:
+    """Reads a JSON payload from an http(s) URL, a file:// URL or a local path."""
+    if src.startswith(("http://", "https://")):
+        r = httpx.get(src, follow_redirects=True, timeout=30)
+        r.raise_for_status() # Raise an exception for bad status codes
+        return r.json()
+    with open(src.removeprefix("file://"), encoding="utf-8") as f:
+        return json.load(f)
+
+def read_notifications(path:str):
+    """Yields (line number, notification) for each line of a JSONL file; invalid lines yield the error."""
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip(): continue
+            try:
+                m = json.loads(line)
+                if not isinstance(m, dict): raise ValueError("not a JSON object")
+                yield n, m
+            except ValueError as e:
+                yield n, e
+
+def send_batches(inbox:str, notifications, batch_size:int=500, concurrency:int=4, http2:bool=False)->tuple[int,int]:
+    """
+    Posts (line number, notification) pairs to /inbox/batch as NDJSON, batch_size per request and up to
+    `concurrency` requests at a time, over one pool of keep-alive connections (HTTP/2 when asked for and
+    offered). Inboxes without the batch endpoint get one POST /inbox each. Returns (stored, failed).
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    batch_url = inbox.rstrip("/")+"/batch"
+    no_batch_endpoint = threading.Event()  # set once the inbox answers 404/405 to a batch
+
+    def post(client, batch):
+        valid = [(n, m) for n, m in batch if not isinstance(m, Exception)]
+        out = [(n, {"status":"error","error":str(m)}) for n, m in batch if isinstance(m, Exception)]
+        try:
+            if not no_batch_endpoint.is_set():
+                body = "".join(json.dumps(m, ensure_ascii=False)+"\n" for _, m in valid).encode("utf-8")
+                r = client.post(batch_url, content=body, headers={"Content-Type":"application/x-ndjson"})
+                if r.status_code not in (404, 405):
+                    r.raise_for_status()
+                    return out + [(n, item) for (n, _), item in zip(valid, r.json()["items"])]
+                no_batch_endpoint.set()
+            for n, m in valid:
+                r = client.post(inbox, headers={"Content-Type":"application/ld+json"}, json=m)
+                out.append((n, {"status":"ok", **r.json()} if r.is_success else {"status":"error","error":f"HTTP {r.status_code}"}))
+        except httpx.HTTPError as e:
+            done = {n for n, _ in out}
+            out += [(n, {"status":"error","error":str(e)}) for n, _ in valid if n not in done]
+        return out
+
+    stored = failed = 0
+    def collect(futures):
+        nonlocal stored, failed
+        for fut in futures:
+            for n, item in fut.result():
+                if item["status"] == "ok": stored += 1
+                else:
+                    failed += 1
+                    print(f"[ERROR] line {n}: {item['error']}", file=sys.stderr)
+
+    it = iter(notifications)
+    with httpx.Client(http2=http2, limits=limits, timeout=60) as client, ThreadPoolExecutor(concurrency) as pool:
+        inflight = set()
+        while batch := list(itertools.islice(it, batch_size)):
+            if len(inflight) >= concurrency*2:  # bounded read-ahead: the file is never loaded whole
+                done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(done)
+            inflight.add(pool.submit(post, client, batch))
+        collect(inflight)
+    return stored, failed
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--inbox", required=True)
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--payload", help="JSON notification: http(s) URL or local file")
+    src.add_argument("--payload-file", help="JSONL file of notifications ('-' for stdin), sent through POST /inbox/batch")
+    ap.add_argument("--batch-size", type=int, default=500, help="notifications per batch request")
+    ap.add_argument("--concurrency", type=int, default=4, help="batch requests in flight")
+    ap.add_argument("--http2", action="store_true", help="use HTTP/2 when the inbox offers it")
+    a = ap.parse_args(argv)
+    if a.payload:
+        data = load_payload(a.payload)
+        r = httpx.post(a.inbox, headers={"Content-Type":"application/ld+json"}, json=data, timeout=30)
+        r.raise_for_status()
+        print("Sent:", r.json())
+        return 0
+    t = time.perf_counter()
+    stored, failed = send_batches(a.inbox, read_notifications(a.payload_file), a.batch_size, a.concurrency, a.http2)
+    dt = time.perf_counter()-t
+    print(f"Stored {stored} notification(s), {failed} failed, in {dt:.1f}s ({stored/dt if dt else 0:.0f}/s).")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,151 @@
 # /// script
 # requires-python = ">=3.10"
-# dependencies = ["httpx>=0.27"]
+# dependencies = ["httpx>=0.27","tokenizers>=0.15"]
 # ///
-import argparse, httpx, textwrap, json, os
-ap = argparse.ArgumentParser()
-ap.add_argument("--in", dest="inp", required=True)   # URL ou file://
-ap.add_argument("--out", required=True)
-ap.add_argument("--chunk-size", type=int, default=900)  # ~900 caractères
-a = ap.parse_args()
-
-def fetch(u:str)->str:
-    if u.startswith("file://"): 
-        return open(u[7:], encoding="utf-8").read()
-    r = httpx.get(u, timeout=60); r.raise_for_status(); return r.text
-
-text = fetch(a.inp)
-paras = [p.strip() for p in text.splitlines() if p.strip()]
-chunks, buf = [], ""
-for p in paras:
-    if len(buf)+len(p)+1 <= a.chunk_size:
-        buf = f"{buf}\n{p}" if buf else p
-    else:
-        chunks.append(buf); buf = p
-if buf: chunks.append(buf)
+"""
+Streams a document (file:// or HTTP) into chunks.jsonl without holding it in memory.
+
+Lines are read one at a time and packed into chunks of at most --chunk-size
+units, measured with the embedding model's tokenizer (or in characters with
+--tokenizer chars). A Markdown heading always starts a new chunk, consecutive
+chunks of a section share --overlap units, and a paragraph longer than a chunk
+is cut at token boundaries instead of being truncated by the model later.
+"""
+import argparse, functools, hashlib, httpx, json, os, re
+
+DEFAULT_TOKENIZER = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_TOKENS = 254  # the model reads 256 tokens, [CLS] and [SEP] included
+DEFAULT_CHARS = 900
+HEADING = re.compile(r"^#{1,6}\s")
+FENCE = re.compile(r"^(```|~~~)")
+
+def iter_lines(u:str):
+    """Lines of a file:// or HTTP(S) document, streamed."""
+    if u.startswith("file://"):
+        with open(u[7:], encoding="utf-8") as f:
+            yield from f
+        return
+    with httpx.stream("GET", u, timeout=60, follow_redirects=True) as r:
+        r.raise_for_status()
+        yield from r.iter_lines()
+
+def blocks(lines):
+    """(is_heading, paragraph) for each non-empty line; '#' lines inside code fences are not headings."""
+    fenced = False
+    for l in lines:
+        p = l.strip()
+        if not p: continue
+        if FENCE.match(p): fenced = not fenced
+        yield (not fenced and bool(HEADING.match(p))), p
+
+class Chars:
+    """Length in characters; pieces (text, length) are cut at whitespace when possible."""
+    sep = 1  # the "\n" joining paragraphs
+    def __call__(self, s:str)->int: return len(s)
+    def pieces(self, s:str, n:int):
+        while len(s) > n:
+            cut = s.rfind(" ", 0, n+1)
+            cut = cut if cut > 0 else n
+            p = s[:cut].rstrip(); s = s[cut:].lstrip()
+            yield p, len(p)
+        if s: yield s, len(s)
+    def tail(self, s:str, n:int)->str:
+        if len(s) <= n: return s
+        t = s[-n:]
+        return t.split(" ", 1)[1] if " " in t else t
+
+class Tokens:
+    """Length in tokens of a Hugging Face tokenizer (hub name or tokenizer.json path), without special tokens."""
+    sep = 0  # "\n" is whitespace to the tokenizer
+    def __init__(self, name:str):
+        from tokenizers import Tokenizer
+        self.tok = Tokenizer.from_file(name) if os.path.exists(name) else Tokenizer.from_pretrained(name)
+        self.tok.no_truncation(); self.tok.no_padding()
+    def _enc(self, s:str): return self.tok.encode(s, add_special_tokens=False)
+    def __call__(self, s:str)->int: return len(self._enc(s).ids)
+    def pieces(self, s:str, n:int):
+        off, i = self._enc(s).offsets, 0
+        while i < len(off):
+            j = min(i + n, len(off))
+            if j < len(off):  # back off to a word start so the piece re-tokenizes the same
+                k = j
+                while k > i+1 and off[k][0] == off[k-1][1]: k -= 1
+                j = k if k > i+1 else j
+            yield s[off[i][0]:off[j][0] if j < len(off) else len(s)].strip(), j - i
+            i = j
+    def tail(self, s:str, n:int)->str:
+        off = self._enc(s).offsets
+        return s if len(off) <= n else s[off[-n][0]:]
 
-os.makedirs(os.path.dirname(a.out), exist_ok=True)
-with open(a.out,"w",encoding="utf-8") as f:
+@functools.lru_cache(maxsize=4)
+def measure(tokenizer:str):
+    return Chars() if tokenizer == "chars" else Tokens(tokenizer)
+
+def split(paragraphs, length, chunk_size:int, overlap:int=0):
+    """
+    Packs (is_heading, paragraph) pairs into chunks of at most chunk_size units.
+    A heading flushes the current chunk; otherwise the next chunk starts with the
+    last `overlap` units of the previous one. Yields chunks as they fill up.
+    """
+    buf, n, fresh = [], 0, False  # fresh: buf holds more than carried-over overlap
+    for heading, p in paragraphs:
+        if heading and buf:
+            if fresh: yield "\n".join(t for t,_ in buf)
+            buf, n, fresh = [], 0, False
+        for piece, k in length.pieces(p, chunk_size):
+            k += length.sep if buf else 0
+            if buf and n + k > chunk_size:
+                if fresh: yield "\n".join(t for t,_ in buf)
+                carry, m = [], 0
+                for t, l in reversed(buf):
+                    if m + l > overlap: break
+                    carry.insert(0, (t, l)); m += l
+                if not carry and overlap:
+                    t = length.tail(buf[-1][0], overlap); carry, m = [(t, length(t))], length(t)
+                buf, n = (carry, m) if carry and m + k <= chunk_size else ([], 0)
+                if not buf: k -= length.sep
+            buf.append((piece, k)); n += k; fresh = True
+    if fresh: yield "\n".join(t for t,_ in buf)
+
+def chunk_rows(source:str, chunks):
+    """Chunk records with ids namespaced by source and content: unchanged text keeps its id across versions."""
+    ns, seen = hashlib.sha1(source.encode()).hexdigest()[:12], {}
     for i,c in enumerate(chunks):
-        f.write(json.dumps({"id":f"chunk-{i}","text":c}, ensure_ascii=False)+"\n")
-print(f"Wrote {len(chunks)} chunks → {a.out}")
\ No newline at end of file
+        h = hashlib.sha1(c.encode()).hexdigest()
+        n = seen[h] = seen.get(h, -1) + 1  # same paragraph twice in one document
+        yield {"id":f"{ns}:{h[:16]}" + (f"-{n}" if n else ""),"source":source,"pos":i,"hash":h,"text":c}
+
+def iter_chunks(inp:str, chunk_size:int=None, overlap:int=None, tokenizer:str=DEFAULT_TOKENIZER):
+    """Chunk rows of the document at inp, produced lazily."""
+    length = measure(tokenizer)
+    if chunk_size is None: chunk_size = DEFAULT_CHARS if tokenizer == "chars" else DEFAULT_TOKENS
+    if overlap is None: overlap = chunk_size // 8
+    if not 0 <= overlap < chunk_size: raise ValueError("--overlap must be smaller than --chunk-size")
+    return chunk_rows(inp, split(blocks(iter_lines(inp)), length, chunk_size, overlap))
+
+def run(inp:str, out:str, chunk_size:int=None, overlap:int=None, tokenizer:str=DEFAULT_TOKENIZER)->str:
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    n = 0
+    with open(out,"w",encoding="utf-8") as f:
+        for r in iter_chunks(inp, chunk_size, overlap, tokenizer):
+            f.write(json.dumps(r, ensure_ascii=False)+"\n"); n += 1
+    return f"Wrote {n} chunks → {out}"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in", dest="inp", required=True)   # URL ou file://
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="tokenizer measuring chunks (hub name or tokenizer.json), or 'chars'")
+    ap.add_argument("--chunk-size", type=int, default=None, help=f"max chunk length (default {DEFAULT_TOKENS} tokens, {DEFAULT_CHARS} chars)")
+    ap.add_argument("--overlap", type=int, default=None, help="length shared by consecutive chunks of a section (default chunk-size/8)")
+    ap.add_argument("--worker", default=os.getenv("RAG_WORKER"), help="host:port of a running rag_worker.py")
+    a = ap.parse_args(argv)
+    if a.worker:
+        from rag_worker import request
+        print(request(a.worker, "split", inp=a.inp, out=os.path.abspath(a.out), chunk_size=a.chunk_size,
+                      overlap=a.overlap, tokenizer=a.tokenizer))
+    else:
+        print(run(a.inp, a.out, a.chunk_size, a.overlap, a.tokenizer))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["fastapi>=0.112", "uvicorn>=0.30", "httpx>=0.27", "openai>=1.40.0", "numpy>=1.26", "tokenizers>=0.15"]
+# ///
+"""
+Offline end-to-end benchmarks for both demos. Everything runs on this machine:
+the inbox server, a fake OpenAI-compatible provider (fake_openai.py), the
+orchestrators and generated documents, so results are comparable between runs.
+
+  inference  Create jobs generated with send_ldn.py's builder are posted to a
+             local inbox_server.py; inference-notify-demo/poll_and_run.py runs them
+             against fake_openai.py. Reports jobs/s and p50/p95/p99 pickup latency
+             (post → provider request) and completion latency (post → Announce).
+  inbox      Fills an inbox with growing histories and times the GETs a poller
+             makes: the newest page, a filtered scan, and the legacy full listing.
+  rag        Generates Markdown corpora of growing size and times split, embed,
+             index, query and the pipelined mode, then runs index jobs end to end
+             through RAG-notify-demo/poll_and_run.py and a warm rag_worker.py.
+  startup    Cold-start cost of inference.py, which subprocess mode pays per job:
+             `python -X importtime` of the module, checked against
+             --import-budget-ms (the run exits 1 when over budget), and the wall
+             time of --help, --list-models and a short completion.
+  checks     Regression checks on real processes (e.g. job state across an inbox
+             restart); the run exits 1 when one fails.
+
+Run from a checkout of the repository:
+  uv run benchmarks/bench.py                      # every scenario, default sizes
+  uv run benchmarks/bench.py inference --jobs 500 --rate 100 --latency 0.2
+  uv run benchmarks/bench.py inbox rag --json results.json
+
+The rag scenario encodes with a deterministic stand-in model unless --embed-model
+points to a local sentence-transformers model, and splits with --tokenizer
+(default: characters), so it needs no download either.
+"""
+import argparse, hashlib, json, os, random, shutil, socket, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INFERENCE_DIR = os.path.join(ROOT, "inference-notify-demo")
+RAG_DIR = os.path.join(ROOT, "RAG-notify-demo")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Helpers ---
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Service:
+    """A background process (server or orchestrator) logging to <workdir>/<name>.log, stopped on exit."""
+    def __init__(self, name: str, cmd: list, cwd: str, env: dict = None, ready_url: str = None):
+        os.makedirs(cwd, exist_ok=True)
+        self.name, self.log = name, open(os.path.join(cwd, f"{name}.log"), "w")
+        self.proc = subprocess.Popen(cmd, cwd=cwd, stdout=self.log, stderr=subprocess.STDOUT,
+                                     env={**os.environ, "PYTHONUNBUFFERED": "1", **(env or {})})
+        if ready_url:
+            self.wait_ready(ready_url)
+
+    def wait_ready(self, url: str, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.proc.returncode}; see {self.log.name}")
+            try:
+                httpx.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.name} not ready after {timeout}s; see {self.log.name}")
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.log.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.stop()
+
+def start_inbox(demo_dir: str, workdir: str, env: dict = None) -> tuple[Service, str]:
+    """Starts a demo's inbox_server.py with its state under workdir; returns (service, inbox URL)."""
+    port = free_port()
+    svc = Service("inbox", [sys.executable, "-m", "uvicorn", "--app-dir", demo_dir, "inbox_server:app",
+                            "--port", str(port), "--log-level", "warning"],
+                  workdir, env, ready_url=f"http://127.0.0.1:{port}/jobs")
+    return svc, f"http://127.0.0.1:{port}/inbox"
+
+def percentiles(values: list) -> dict:
+    """p50/p95/p99/max of `values` (nearest rank), None entries when empty."""
+    s = sorted(values)
+    pick = lambda p: s[min(len(s) - 1, max(0, round(p / 100 * len(s)) - 1))] if s else None
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "max": s[-1] if s else None}
+
+def ms(v) -> str:
+    return "-" if v is None else f"{v * 1000:.1f}"
+
+def table(title: str, header: list, rows: list):
+    print(f"\n## {title}")
+    widths = [max(len(str(c)) for c in col) for col in zip(header, *rows)]
+    for r in [header, ["-" * w for w in widths], *rows]:
+        print("  ".join(str(c).rjust(w) for c, w in zip(r, widths)))
+
+def activity_id(announce: dict):
+    """The job id an Announce refers to; prov:wasGeneratedBy is an id or an Activity object."""
+    by = announce.get("prov:wasGeneratedBy")
+    return by.get("id") if isinstance(by, dict) else by
+
+def watch_announces(client: httpx.Client, inbox: str, since: int, on_announce, stop: threading.Event):
+    """Long-polls the inbox for Announce messages after cursor `since`, calling on_announce(message, seen_at)."""
+    while not stop.is_set():
+        try:
+            page = client.get(inbox, params={"since": since, "limit": 1000, "type": "Announce", "wait": 1},
+                              timeout=30).json()
+        except httpx.HTTPError:
+            time.sleep(0.2)
+            continue
+        now = time.time()
+        for it in page["items"]:
+            on_announce(it["message"], now)
+        since = page["next"]
+
+# --- Scenario: inference jobs end to end ---
+def bench_inference(a, workdir: str) -> dict:
+    sys.path.insert(0, INFERENCE_DIR)
+    import send_ldn  # the load generator builds the same notifications as the CLI
+
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    services = []
+    try:
+        services.append(Service("fake-openai", [sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"),
+                                                "--port", str(fake_port), "--latency", str(a.latency),
+                                                "--jitter", str(a.jitter), "--error-rate", str(a.error_rate),
+                                                "--rate-limit-rate", str(a.rate_limit_rate)],
+                                workdir, ready_url=f"{fake_url}/v1/models"))
+        results_dir = os.path.join(workdir, "results")  # shared: the inbox serves what the orchestrators store
+        inbox_svc, inbox = start_inbox(INFERENCE_DIR, os.path.join(workdir, "inbox"),
+                                       {"INBOX_STORAGE": a.storage, "RESULTS_DIR": results_dir})
+        services.append(inbox_svc)
+        env = {"INBOX_URL": inbox, "EXECUTION_MODE": a.execution, "LLM_API_KEY": "bench", "LLM_CACHE_DIR": "",
+               "RESULTS_DIR": results_dir,
+               "DEFAULT_CONCURRENCY": str(a.concurrency), "MAX_IN_FLIGHT": str(max(a.concurrency * 2, 32)),
+               "JOB_QUEUE": "1" if a.job_queue else "0",
+               "INFERENCE_SCRIPT_URL": os.path.join(INFERENCE_DIR, "inference.py")}
+        for i in range(a.orchestrators):
+            services.append(Service(f"orchestrator-{i}", [sys.executable, os.path.join(INFERENCE_DIR, "poll_and_run.py")],
+                                    os.path.join(workdir, f"orchestrator-{i}"), {**env, "WORKER_ID": f"bench-{i}"}))
+
+        run = hashlib.sha1(os.urandom(8)).hexdigest()[:8]
+        job = lambda prompt: send_ldn.build_notification(
+            {"provider": "openai", "model": "bench-model", "base_url": f"{fake_url}/v1", "user_prompt": prompt},
+            actor="https://example.org/users/bench")
+        posted, done, lock = {}, {}, threading.Lock()  # notification id -> prompt / completion time
+        stop = threading.Event()
+
+        with httpx.Client(timeout=30) as client:
+            def on_announce(message, seen_at):
+                with lock:
+                    done.setdefault(activity_id(message), seen_at)
+            since = client.get(inbox, params={"since": 0, "limit": 1}).json()["last"]
+            watcher = threading.Thread(target=watch_announces, args=(client, inbox, since, on_announce, stop), daemon=True)
+            watcher.start()
+
+            # Warm-up: the orchestrator starts polling and loads inference.py before the clock starts
+            warm = job(f"bench-{run}-warmup")
+            client.post(inbox, json=warm).raise_for_status()
+            deadline = time.monotonic() + a.timeout
+            while warm["id"] not in done:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"warm-up job not announced within {a.timeout}s; see {workdir}/orchestrator-0")
+                time.sleep(0.05)
+            client.post(f"{fake_url}/stats/reset").raise_for_status()
+
+            sent_at = {}
+            started = time.time()
+            for i in range(a.jobs):
+                if a.rate:
+                    time.sleep(max(0.0, started + i / a.rate - time.time()))
+                n = job(f"bench-{run}-{i}")
+                sent_at[n["id"]] = time.time()
+                client.post(inbox, json=n).raise_for_status()
+                posted[n["id"]] = n["object"]["user_prompt"]
+            post_seconds = time.time() - started
+
+            deadline = time.monotonic() + a.timeout
+            while time.monotonic() < deadline:
+                with lock:
+                    if all(i in done for i in posted):
+                        break
+                time.sleep(0.05)
+            stop.set()
+            stats = client.get(f"{fake_url}/stats").json()
+
+        completed = [i for i in posted if i in done]
+        finished = max((done[i] for i in completed), default=started)
+        pickup = [stats["arrivals"][p] - sent_at[i] for i, p in posted.items() if p in stats["arrivals"]]
+        completion = [done[i] - sent_at[i] for i in completed]
+        result = {"jobs": a.jobs, "completed": len(completed), "post_seconds": post_seconds,
+                  "wall_seconds": finished - started, "jobs_per_second": len(completed) / max(finished - started, 1e-9),
+                  "pickup": percentiles(pickup), "completion": percentiles(completion),
+                  "provider_requests": stats["requests"], "provider_statuses": stats["statuses"],
+                  "config": {k: getattr(a, k) for k in ("execution", "orchestrators", "job_queue", "concurrency", "rate",
+                                                        "latency", "jitter", "error_rate", "rate_limit_rate", "storage")}}
+        table(f"inference: {a.jobs} jobs, {a.orchestrators} orchestrator(s), {a.execution}, provider latency {a.latency}s",
+              ["metric", "p50 ms", "p95 ms", "p99 ms", "max ms"],
+              [[name, ms(p["p50"]), ms(p["p95"]), ms(p["p99"]), ms(p["max"])]
+               for name, p in (("pickup", result["pickup"]), ("completion", result["completion"]))])
+        print(f"completed {len(completed)}/{a.jobs} in {result['wall_seconds']:.2f}s → {result['jobs_per_second']:.1f} jobs/s; "
+              f"provider saw {stats['requests']} requests {stats['statuses']}")
+        return result
+    finally:
+        for svc in reversed(services):
+            svc.stop()
+
+# --- Scenario: inbox GET cost as history grows ---
+def bench_inbox(a, workdir: str) -> dict:
+    inbox_svc, inbox = start_inbox(INFERENCE_DIR, os.path.join(workdir, "inbox-history"), {"INBOX_STORAGE": a.storage})
+    rows, results = [], []
+    try:
+        with httpx.Client(timeout=120, limits=httpx.Limits(max_connections=16)) as client:
+            def post(i: int) -> int:
+                # One job per four messages, as in an inbox mostly filled with Announces
+                message = ({"type": "Create", "instrument": {"action": "infer"}, "object": {"user_prompt": f"q{i}"}}
+                           if i % 4 == 0 else {"type": "Announce", "object": {"name": f"result-{i}"}})
+                r = client.post(inbox, json={"@context": "https://www.w3.org/ns/activitystreams", "id": f"urn:bench:{i}", **message})
+                r.raise_for_status()
+                return r.json()["cursor"]
+
+            def timed(params=None) -> list:
+                out = []
+                for _ in range(a.reps):
+                    t = time.perf_counter()
+                    client.get(inbox, params=params).raise_for_status()
+                    out.append(time.perf_counter() - t)
+                return out
+
+            count = 0
+            with ThreadPoolExecutor(8) as pool:
+                for size in sorted(a.inbox_sizes):
+                    t = time.perf_counter()
+                    last = max(pool.map(post, range(count, size)), default=0)
+                    post_rate = (size - count) / max(time.perf_counter() - t, 1e-9)
+                    count = size
+                    last = max(last, client.get(inbox, params={"since": 0, "limit": 1}).json()["last"])
+                    r = {"messages": size, "post_per_second": post_rate,
+                         "newest_page": percentiles(timed({"since": max(0, last - 100), "limit": 100})),
+                         "filtered_scan": percentiles(timed({"since": 0, "limit": 100, "type": "Create",
+                                                             "instrument.action": "infer"})),
+                         "full_listing": percentiles(timed()) if size <= a.full_listing_max else None}
+                    results.append(r)
+                    rows.append([size, f"{post_rate:.0f}", ms(r["newest_page"]["p50"]), ms(r["newest_page"]["p95"]),
+                                 ms(r["filtered_scan"]["p50"]),
+                                 ms(r["full_listing"]["p50"]) if r["full_listing"] else "-"])
+        table(f"inbox ({a.storage} storage): GET cost as history grows",
+              ["messages", "POST/s", "newest page p50 ms", "p95 ms", "filtered scan p50 ms", "full GET p50 ms"], rows)
+        return {"storage": a.storage, "sizes": results}
+    finally:
+        inbox_svc.stop()
+
+# --- Scenario: RAG stages and orchestrator ---
+class StandInModel:
+    """Deterministic SentenceTransformer stand-in (hash-seeded vectors): costs no download and little CPU."""
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True, **kw):
+        import numpy as np
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(t.encode("utf-8")).digest()[:8], "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        if normalize_embeddings and len(texts):
+            out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out
+
+WORDS = ("notification inbox linked data activity stream provenance index chunk vector model embedding query "
+         "retrieval document section archive metadata service orchestrator pipeline graph semantic resource "
+         "version change update announce create token cache latency throughput storage record").split()
+
+def make_corpus(path: str, kb: int, seed: int = 0) -> list:
+    """Writes about `kb` KiB of Markdown (headings, paragraphs, a code fence now and then); returns sample sentences."""
+    rng, size, samples, section = random.Random(seed), 0, [], 0
+    with open(path, "w", encoding="utf-8") as f:
+        while size < kb * 1024:
+            section += 1
+            block = [f"## Section {section}: {' '.join(rng.choices(WORDS, k=3))}", ""]
+            for _ in range(rng.randint(3, 9)):
+                sentences = [" ".join(rng.choices(WORDS, k=rng.randint(8, 20))).capitalize() + "."
+                             for _ in range(rng.randint(2, 6))]
+                block += [" ".join(sentences), ""]
+                if len(samples) < 1000:
+                    samples.append(sentences[0])
+            if section % 7 == 0:
+                block += ["```", "# not a heading", "print('code')", "```", ""]
+            text = "\n".join(block) + "\n"
+            f.write(text)
+            size += len(text.encode("utf-8"))
+    return samples
+
+def bench_rag(a, workdir: str) -> dict:
+    sys.path.insert(0, RAG_DIR)
+    import embedder, indexer, pipeline, query, splitter
+
+    model = embedder.load_model(a.embed_model) if a.embed_model else StandInModel()
+    model_name = a.embed_model or embedder.DEFAULT_MODEL
+    rows, results = [], []
+    for kb in sorted(a.corpus_kb):
+        d = os.path.join(workdir, f"rag-{kb}k")
+        os.makedirs(d, exist_ok=True)
+        doc = os.path.join(d, "corpus.md")
+        samples = make_corpus(doc, kb)
+        chunks, embeddings, index = (os.path.join(d, n) for n in ("chunks.jsonl", "embeddings.jsonl", "index.bin"))
+        timing = {}
+        t = time.perf_counter(); splitter.run(f"file://{doc}", chunks, tokenizer=a.tokenizer); timing["split"] = time.perf_counter() - t
+        t = time.perf_counter(); embedder.run(chunks, embeddings, model, model_name=model_name); timing["embed"] = time.perf_counter() - t
+        t = time.perf_counter(); indexer.run(embeddings, index, model_name, merge=True); timing["index"] = time.perf_counter() - t
+        idx = query.load_index(index)
+        qs = random.Random(1).sample(samples, min(a.queries, len(samples)))
+        t = time.perf_counter(); query.search_batch(idx, qs, 5, model); timing["query_per_question"] = (time.perf_counter() - t) / len(qs)
+        t = time.perf_counter()
+        pipeline.run(f"file://{doc}", os.path.join(d, "pipelined.bin"), model, model_name, tokenizer=a.tokenizer)
+        timing["pipeline"] = time.perf_counter() - t
+        n = len(idx)
+        results.append({"kib": kb, "chunks": n, **timing})
+        rows.append([kb, n, ms(timing["split"]), ms(timing["embed"]), ms(timing["index"]),
+                     f"{timing['query_per_question'] * 1000:.2f}", ms(timing["pipeline"]),
+                     f"{kb / 1024 / max(timing['pipeline'], 1e-9):.2f}"])
+    model_label = a.embed_model or "stand-in model"
+    table(f"rag stages ({model_label}, tokenizer {a.tokenizer})",
+          ["KiB", "chunks", "split ms", "embed ms", "index ms", "query ms/q", "pipeline ms", "pipeline MiB/s"], rows)
+    out = {"model": model_label, "tokenizer": a.tokenizer, "corpora": results}
+    if a.rag_e2e:
+        out["orchestrator"] = bench_rag_orchestrator(a, workdir, model, model_name, splitter)
+    return out
+
+def bench_rag_orchestrator(a, workdir: str, model, model_name: str, splitter) -> dict:
+    """Index jobs for each generated corpus, end to end through RAG poll_and_run.py and a warm rag_worker."""
+    import rag_worker
+    # The worker runs in this process, serving the benchmark's model and tokenizer
+    rag_worker._models[model_name] = (model, threading.Lock())
+    splitter.DEFAULT_TOKENIZER = a.tokenizer
+    addr = f"127.0.0.1:{free_port()}"
+    server = rag_worker.Server(rag_worker._split_addr(addr), rag_worker.Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    services = []
+    try:
+        inbox_svc, inbox = start_inbox(RAG_DIR, os.path.join(workdir, "rag-inbox"))
+        services.append(inbox_svc)
+        services.append(Service("rag-orchestrator", [sys.executable, os.path.join(RAG_DIR, "poll_and_run.py")],
+                                os.path.join(workdir, "rag-orchestrator"),
+                                {"INBOX_URL": inbox, "RAG_WORKER": addr, "RAG_PIPELINE": "1" if a.rag_pipeline else "0"}))
+        docs = [os.path.join(workdir, f"rag-{kb}k", "corpus.md") for kb in sorted(a.corpus_kb)]
+        with open(os.path.join(RAG_DIR, "examples", "job.create.json"), encoding="utf-8") as f:
+            template = json.load(f)
+        indexed, stop = [], threading.Event()
+        with httpx.Client(timeout=30) as client:
+            def on_announce(message, seen_at):
+                if (message.get("object") or {}).get("name") == "index":
+                    indexed.append(seen_at)
+            watcher = threading.Thread(target=watch_announces, args=(client, inbox, 0, on_announce, stop), daemon=True)
+            watcher.start()
+            sent = []
+            for doc in docs:
+                job = {**template, "object": {**template["object"], "id": f"file://{doc}", "url": f"file://{doc}"}}
+                sent.append(time.time())
+                client.post(inbox, json=job).raise_for_status()
+            deadline = time.monotonic() + a.timeout
+            while len(indexed) < len(docs) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            stop.set()
+        # Jobs run one after the other: the n-th index Announce completes the n-th job
+        latency = [done - s for s, done in zip(sent, indexed)]
+        table(f"rag orchestrator ({'pipelined' if a.rag_pipeline else 'staged'}, warm worker)",
+              ["KiB", "post → index Announce ms"], [[kb, ms(l)] for kb, l in zip(sorted(a.corpus_kb), latency)])
+        return {"mode": "pipeline" if a.rag_pipeline else "staged", "jobs": len(docs), "completed": len(latency),
+                "latency": dict(zip(map(str, sorted(a.corpus_kb)), latency))}
+    finally:
+        for svc in reversed(services):
+            svc.stop()
+        server.shutdown()
+
+# --- CLI ---
+# --- Scenario: inference.py cold start ---
+def import_time(cwd: str, module: str) -> tuple[float, list]:
+    """Seconds `import module` takes in a fresh interpreter, and its direct imports as (seconds, name), heaviest first."""
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=cwd,
+                       capture_output=True, text=True, check=True)
+    total, direct = 0.0, []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        us = int(cumulative.strip())
+        if name.strip() == module and name.startswith(" " + module):
+            total = us / 1e6
+        elif name.startswith("   ") and not name.startswith("    "):  # one level below the module
+            direct.append((us / 1e6, name.strip()))
+    return total, sorted(direct, reverse=True)
+
+def bench_startup(a, workdir: str) -> dict:
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    script = os.path.join(INFERENCE_DIR, "inference.py")
+    cli = [sys.executable, script, "--provider", "openai", "--api-key", "bench", "--base-url", f"{fake_url}/v1",
+           "--no-cache"]
+    commands = {"--help": [sys.executable, script, "--help"], "--list-models": cli + ["--list-models"],
+                "completion": cli + ["--model", "bench-model", "-u", "hello"]}
+    with Service("fake-openai", [sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(fake_port)],
+                 workdir, ready_url=f"{fake_url}/v1/models"):
+        import_time(INFERENCE_DIR, "inference")  # writes the bytecode cache, as any second run finds it
+        imports = [import_time(INFERENCE_DIR, "inference") for _ in range(a.startup_runs)]
+        wall = {}
+        for name, cmd in commands.items():
+            wall[name] = []
+            for _ in range(a.startup_runs):
+                t = time.perf_counter()
+                subprocess.run(cmd, cwd=workdir, capture_output=True, check=True)
+                wall[name].append(time.perf_counter() - t)
+    import_seconds = sorted(t for t, _ in imports)[len(imports) // 2]
+    heaviest = min(imports)[1][:5]
+    budget = a.import_budget_ms / 1000
+    result = {"import_seconds": import_seconds, "import_budget_seconds": budget, "over_budget": import_seconds > budget,
+              "heaviest_imports": [{"module": n, "seconds": t} for t, n in heaviest],
+              "wall": {name: percentiles(v) for name, v in wall.items()}, "runs": a.startup_runs}
+    table(f"inference.py start-up ({a.startup_runs} runs each)", ["run", "p50 ms", "max ms"],
+          [["import inference", ms(import_seconds), ms(max(t for t, _ in imports))]] +
+          [[name, ms(p["p50"]), ms(p["max"])] for name, p in result["wall"].items()])
+    print("heaviest imports: " + ", ".join(f"{n} {ms(t)} ms" for t, n in heaviest))
+    print(f"import budget {a.import_budget_ms:g} ms: " + ("OVER BUDGET" if result["over_budget"] else "ok"))
+    return result
+
+# --- Scenario: regression checks ---
+def check_duplicate_restart(a, workdir: str):
+    """A job stored twice and acked is still done after an inbox restart (not pending again)."""
+    cwd = os.path.join(workdir, "check-duplicate-restart")
+    message = {"@context": "https://www.w3.org/ns/activitystreams", "id": "urn:check:duplicate", "type": "Create",
+               "object": {"user_prompt": "duplicate"}, "instrument": {"type": "Service", "action": "infer"}}
+    svc, inbox = start_inbox(INFERENCE_DIR, cwd, {"INBOX_STORAGE": a.storage})
+    with svc:
+        base = inbox.rsplit("/", 1)[0]
+        for _ in range(2):
+            httpx.post(inbox, json=message).raise_for_status()
+        claimed = httpx.post(f"{base}/jobs/claim", params={"worker": "check"}).json()["jobs"]
+        for job in claimed:
+            httpx.post(f"{base}/jobs/{job['id']}/ack", params={"token": job["token"]}).raise_for_status()
+        before = httpx.get(f"{base}/jobs").json()
+    svc, inbox = start_inbox(INFERENCE_DIR, cwd, {"INBOX_STORAGE": a.storage})
+    with svc:
+        after = httpx.get(f"{inbox.rsplit('/', 1)[0]}/jobs").json()
+    if before != {"done": 1} or after != before:
+        return f"jobs before restart {before}, after {after}"
+
+def check_results_separate_cwd(a, workdir: str):
+    """Results announced by an orchestrator running from another directory than the inbox are served."""
+    sys.path.insert(0, INFERENCE_DIR)
+    import send_ldn
+    cwd = os.path.join(workdir, "check-results-separate-cwd")
+    results_dir = os.path.join(cwd, "results")
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    with Service("fake-openai", [sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(fake_port)],
+                 cwd, ready_url=f"{fake_url}/v1/models"):
+        svc, inbox = start_inbox(INFERENCE_DIR, os.path.join(cwd, "inbox"), {"RESULTS_DIR": results_dir})
+        env = {"INBOX_URL": inbox, "EXECUTION_MODE": "inprocess", "LLM_API_KEY": "bench", "LLM_CACHE_DIR": "",
+               "RESULTS_DIR": results_dir, "INFERENCE_SCRIPT_URL": os.path.join(INFERENCE_DIR, "inference.py")}
+        with svc, Service("orchestrator", [sys.executable, os.path.join(INFERENCE_DIR, "poll_and_run.py")],
+                          os.path.join(cwd, "orchestrator"), env):
+            prompts = {}
+            for stream in (False, True):
+                n = send_ldn.build_notification({"provider": "openai", "model": "bench-model", "base_url": f"{fake_url}/v1",
+                                                 "user_prompt": f"separate cwd, stream={stream}", "stream": stream})
+                httpx.post(inbox, json=n).raise_for_status()
+                prompts[n["id"]] = n["object"]["user_prompt"]
+            urls, deadline = {}, time.monotonic() + a.timeout
+            while len(urls) < len(prompts) and time.monotonic() < deadline:
+                for it in httpx.get(inbox, params={"since": 0, "limit": 100, "type": "Announce"}).json()["items"]:
+                    urls[activity_id(it["message"])] = it["message"]["object"]["url"]
+                time.sleep(0.1)
+            problems = [f"no Announce for {p!r}" for i, p in prompts.items() if i not in urls]
+            for i, url in urls.items():
+                r = httpx.get(url, timeout=30)
+                if r.status_code != 200 or prompts.get(i, "") not in r.text:
+                    problems.append(f"{url} answered {r.status_code}")
+    if problems:
+        return "; ".join(problems)
+
+CHECKS = {"duplicate-restart": check_duplicate_restart, "results-separate-cwd": check_results_separate_cwd}
+
+def bench_checks(a, workdir: str) -> dict:
+    """Runs the regression checks; each returns None when it passes, else what went wrong."""
+    results = {}
+    for name, check in CHECKS.items():
+        problem = check(a, workdir)
+        results[name] = problem or "ok"
+        print(f"check {name}: {'FAILED: ' + problem if problem else 'ok'}")
+    return {"checks": results, "failed": sum(r != "ok" for r in results.values())}
+
+SCENARIOS = {"inference": bench_inference, "inbox": bench_inbox, "rag": bench_rag, "startup": bench_startup,
+             "checks": bench_checks}
+
+def main(argv=None):
+    sizes = lambda v: [int(x) for x in v.split(",") if x.strip()]
+    ap = argparse.ArgumentParser(description="Offline end-to-end benchmarks for the inference and RAG demos.")
+    ap.add_argument("scenarios", nargs="*", metavar="scenario", help=f"{' | '.join(SCENARIOS)} (default: all of them)")
+    ap.add_argument("--workdir", help="keep state and logs here (default: a temporary directory, removed afterwards)")
+    ap.add_argument("--json", help="also write the results to this JSON file")
+    ap.add_argument("--timeout", type=float, default=300, help="seconds to wait for jobs to complete")
+    ap.add_argument("--storage", choices=("files", "log"), default="files", help="inbox storage backend")
+    g = ap.add_argument_group("inference")
+    g.add_argument("--jobs", type=int, default=200)
+    g.add_argument("--rate", type=float, default=0, help="jobs posted per second (0 = as fast as possible)")
+    g.add_argument("--orchestrators", type=int, default=1, help="more than one implies --job-queue")
+    g.add_argument("--job-queue", action="store_true", help="orchestrators claim leased jobs (JOB_QUEUE=1)")
+    g.add_argument("--execution", choices=("inprocess", "subprocess"), default="inprocess",
+                   help="orchestrator EXECUTION_MODE (subprocess needs uv)")
+    g.add_argument("--concurrency", type=int, default=8, help="orchestrator DEFAULT_CONCURRENCY")
+    g.add_argument("--latency", type=float, default=0.05, help="fake provider mean latency (s)")
+    g.add_argument("--jitter", type=float, default=0.02)
+    g.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 answers")
+    g.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of 429 answers")
+    g = ap.add_argument_group("inbox")
+    g.add_argument("--inbox-sizes", type=sizes, default=[1000, 5000, 20000], help="history sizes, comma-separated")
+    g.add_argument("--reps", type=int, default=20, help="GETs timed per measurement")
+    g.add_argument("--full-listing-max", type=int, default=20000, help="skip the full GET /inbox above this size")
+    g = ap.add_argument_group("rag")
+    g.add_argument("--corpus-kb", type=sizes, default=[64, 512, 4096], help="corpus sizes in KiB, comma-separated")
+    g.add_argument("--tokenizer", default="chars", help="splitter tokenizer: 'chars' or a local tokenizer.json")
+    g.add_argument("--embed-model", help="local sentence-transformers model directory (default: stand-in model)")
+    g.add_argument("--queries", type=int, default=32)
+    g.add_argument("--no-rag-e2e", dest="rag_e2e", action="store_false", help="skip the RAG orchestrator run")
+    g.add_argument("--rag-pipeline", action="store_true", help="RAG orchestrator in pipelined mode (RAG_PIPELINE=1)")
+    g = ap.add_argument_group("startup")
+    g.add_argument("--startup-runs", type=int, default=5, help="runs of each measurement")
+    g.add_argument("--import-budget-ms", type=float, default=150, help="fail when importing inference.py takes longer")
+    a = ap.parse_args(argv)
+    unknown = set(a.scenarios) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    a.job_queue = a.job_queue or a.orchestrators > 1
+
+    workdir = a.workdir or tempfile.mkdtemp(prefix="llm-notify-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"[bench] workdir {workdir}", file=sys.stderr)
+    results = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0]}
+    try:
+        for name in a.scenarios or list(SCENARIOS):
+            results[name] = SCENARIOS[name](a, workdir)
+    finally:
+        if not a.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[bench] results → {a.json}", file=sys.stderr)
+    return 1 if results.get("startup", {}).get("over_budget") or results.get("checks", {}).get("failed") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
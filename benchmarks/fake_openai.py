@@ -0,0 +1,104 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = ["fastapi>=0.112", "uvicorn>=0.30"]
+# ///
+"""
+Local stand-in for an OpenAI-compatible provider, for offline benchmarks.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/models. The answer echoes
+the last user message. Latency, errors and rate-limit responses are configurable,
+so inference.py (reached through --base-url) can be measured against a provider
+that behaves like a real one under load. /stats reports what the server saw:
+request count, status codes, and the arrival time of each distinct prompt.
+
+  uv run benchmarks/fake_openai.py --port 9999 --latency 0.2 --jitter 0.1 --error-rate 0.02
+"""
+import argparse, asyncio, json, random, time
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake OpenAI-compatible provider")
+config = argparse.Namespace(latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0,
+                            tokens_per_second=200.0, models=["bench-model"])
+statuses = Counter()
+arrivals = {}  # prompt -> time.time() of its first request
+
+def answer_for(body: dict) -> str:
+    messages = body.get("messages") or [{}]
+    return "echo: " + str(messages[-1].get("content", ""))
+
+def failure():
+    """A 429 or 503 response, drawn with the configured probabilities, else None."""
+    r = random.random()
+    if r < config.rate_limit_rate:
+        return JSONResponse({"error": {"message": "rate limited", "type": "rate_limit"}}, status_code=429,
+                            headers={"retry-after": str(config.retry_after)})
+    if r < config.rate_limit_rate + config.error_rate:
+        return JSONResponse({"error": {"message": "overloaded", "type": "server_error"}}, status_code=503)
+    return None
+
+@app.post("/v1/chat/completions")
+async def chat_completions(req: Request):
+    body = await req.json()
+    messages = body.get("messages") or [{}]
+    arrivals.setdefault(str(messages[-1].get("content", "")), time.time())
+    await asyncio.sleep(max(0.0, random.gauss(config.latency, config.jitter)) if config.jitter else config.latency)
+    error = failure()
+    if error is not None:
+        statuses[error.status_code] += 1
+        return error
+    statuses[200] += 1
+    text = answer_for(body)
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+    completion_tokens = len(text.split())
+    if body.get("stream"):
+        async def events():
+            for i, word in enumerate(text.split(" ")):
+                delta = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model"),
+                         "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word}, "finish_reason": None}]}
+                yield f"data: {json.dumps(delta)}\n\n"
+                await asyncio.sleep(1 / config.tokens_per_second)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    return {
+        "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "bench"} for m in config.models]}
+
+@app.get("/stats")
+async def stats():
+    return {"requests": sum(statuses.values()), "statuses": dict(statuses), "arrivals": arrivals}
+
+@app.post("/stats/reset")
+async def stats_reset():
+    statuses.clear(); arrivals.clear()
+    return {"status": "ok"}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9999)
+    ap.add_argument("--latency", type=float, default=0.0, help="mean seconds before answering")
+    ap.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the latency")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    ap.add_argument("--tokens-per-second", type=float, default=200.0, help="streamed words per second")
+    ap.add_argument("--models", default="bench-model", help="comma-separated ids listed by /v1/models")
+    a = ap.parse_args(argv)
+    vars(config).update(latency=a.latency, jitter=a.jitter, error_rate=a.error_rate, rate_limit_rate=a.rate_limit_rate,
+                        retry_after=a.retry_after, tokens_per_second=a.tokens_per_second, models=a.models.split(","))
+    import uvicorn
+    uvicorn.run(app, host=a.host, port=a.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
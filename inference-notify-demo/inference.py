@@ -2,9 +2,8 @@
 # /// script
 # requires-python = ">=3.11"
 # dependencies = [
-#   "requests",
-#   "openai>=1.40.0",
-#   "pandas"
+#   "httpx>=0.27",
+#   "openai>=1.40.0"
 # ]
 # ///
 
@@ -20,27 +19,235 @@ uv run llm_client.py --provider openai --model o3-mini \
 # Or pass via options-json:
 uv run llm_client.py --provider openai --model o3-mini \
   -u "Test" --options-json '{"reasoning_effort":"medium"}'
+
+# Batch: one JSON object per line in, one result per line out (same order)
+uv run llm_client.py --provider groq --model llama3-8b-8192 \
+  --prompts-file prompts.jsonl --output results.jsonl --concurrency 16
+
+Every job is a fresh process, so start-up is paid per request: httpx and asyncio
+are imported on first use only, the OpenAI SDK only by batch mode (single calls
+speak HTTP directly), and providers are looked up in a registry (PROVIDERS) whose entries
+may be "module:Class" strings imported only when that provider is selected.
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
+import importlib
 import json
 import os
+import random
 import sys
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Any, Iterable, Iterator, List, Optional, Type, Union
+
+
+class _LazyModule:
+    """Stands for a module that is imported on first attribute access."""
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def _imported(name: str) -> Any:
+    """The module if something already imported it, else None (never imports it)."""
+    return sys.modules.get(name)
+
+
+if TYPE_CHECKING:
+    import asyncio
+    import httpx
+    import openai
+else:
+    asyncio = _LazyModule("asyncio")
+    httpx = _LazyModule("httpx")
+    openai = _LazyModule("openai")
+
+
+# Exit status for bad arguments (sysexits.h EX_USAGE). Not 2, which argparse's default and
+# `uv run` (e.g. when it cannot fetch the script) share, so callers can tell the two apart.
+EX_USAGE = 64
 
-import requests
-from openai import OpenAI
+
+class UsageError(ValueError):
+    """Missing or invalid arguments: the CLI exits with EX_USAGE, and retrying the same job cannot help."""
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    def error(self, message: str):
+        self.print_usage(sys.stderr)
+        self.exit(EX_USAGE, f"{self.prog}: error: {message}\n")
+
+
+# =========================
+# Rate limiting and retries
+# =========================
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute (None = unlimited).
+
+    acquire() waits until a request estimated at `tokens` fits in both buckets; a
+    bucket may go into debt, which later callers wait out, so concurrent callers
+    are spread evenly. settle() corrects an estimate with the actual usage, and
+    pause() holds every caller back, e.g. for a provider's Retry-After.
+    """
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.rpm, self.tpm = rpm or None, tpm or None
+            self._requests, self._tokens = (self.rpm or 0.0, now), (self.tpm or 0.0, now)
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "RateLimiter":
+        """Limits from <PREFIX>_RPM / <PREFIX>_TPM, else LLM_RPM / LLM_TPM."""
+        def read(name: str) -> Optional[float]:
+            value = os.getenv(f"{prefix}_{name}") or os.getenv(f"LLM_{name}")
+            return float(value) if value else None
+        return cls(read("RPM"), read("TPM"))
+
+    @staticmethod
+    def _take(bucket: tuple[float, float], per_minute: float, amount: float, now: float) -> tuple[tuple[float, float], float]:
+        level, at = bucket
+        level = min(per_minute, level + (now - at) * per_minute / 60) - min(amount, per_minute)
+        return (level, now), max(0.0, -level * 60 / per_minute)
+
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self.rpm:
+                self._requests, wait = self._take(self._requests, self.rpm, 1, now)
+                delay = max(delay, wait)
+            if self.tpm and tokens:
+                self._tokens, wait = self._take(self._tokens, self.tpm, tokens, now)
+                delay = max(delay, wait)
+            return delay
+
+    def acquire(self, tokens: float = 0) -> None:
+        delay = self._reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: float = 0) -> None:
+        delay = self._reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated: float, actual: float) -> None:
+        if self.tpm and actual != estimated:
+            with self._lock:
+                level, at = self._tokens
+                self._tokens = (level - (actual - estimated), at)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RetryPolicy:
+    """
+    Retries rate-limited (429), server-side (5xx, 408, 409) and connection errors
+    up to `max_retries` times, waiting for the provider's Retry-After when it sends
+    one and otherwise an exponential backoff with full jitter.
+    """
+    RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def status_and_headers(error: BaseException) -> tuple[Optional[int], Optional[httpx.Headers]]:
+        """(status, headers) of a failed call, (None, None) for connection errors, raises nothing."""
+        # An error can only come from a library that is already loaded: do not import one to check
+        if _imported("openai") and isinstance(error, openai.APIStatusError):
+            return error.status_code, error.response.headers
+        if _imported("httpx") and isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code, error.response.headers
+        return None, None
+
+    def retryable(self, error: BaseException) -> bool:
+        if _imported("openai") and isinstance(error, openai.APIConnectionError):
+            return True
+        if _imported("httpx") and isinstance(error, httpx.TransportError):
+            return True
+        status, _ = self.status_and_headers(error)
+        return status in self.RETRY_STATUSES
+
+    @staticmethod
+    def retry_after(headers: Optional[httpx.Headers]) -> Optional[float]:
+        """Seconds asked for by retry-after-ms or Retry-After (seconds or an HTTP date)."""
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return max(0.0, float(headers["retry-after-ms"]) / 1000)
+            value = headers.get("retry-after")
+            if not value:
+                return None
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                import email.utils
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt: int, error: BaseException, limiter: RateLimiter) -> float:
+        """Seconds to wait before retry number `attempt` (0-based); a Retry-After pauses the whole limiter."""
+        status, headers = self.status_and_headers(error)
+        wait = self.retry_after(headers)
+        if wait is not None:
+            wait = min(wait, self.max_delay * 4)
+            if status == 429:
+                limiter.pause(wait)
+            return wait
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
 
 
 # =========================
 # Provider loader classes
 # =========================
 
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "32"))
+_shared: Dict[tuple, Any] = {}
+_shared_lock = threading.Lock()
+
+
+def _shared_instance(key: tuple, factory: Callable[[], Any]) -> Any:
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
 class LLMLoader(ABC):
     """Abstract Base Class for loading LLM models."""
+    # Prefix of the <PREFIX>_RPM / <PREFIX>_TPM rate limit variables
+    env_prefix = "LLM"
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "LLMLoader":
+        """Builds the loader from the CLI arguments; override to read provider-specific ones."""
+        return cls()
+
     @abstractmethod
     def get_base_url(self) -> str:
         pass
@@ -49,8 +256,20 @@ class LLMLoader(ABC):
     def get_provider_name(self) -> str:
         pass
 
+    # Shared by every client of the same base URL in this process: one keep-alive
+    # connection pool, and one rate limit budget.
+    def get_http_client(self) -> httpx.Client:
+        return _shared_instance(("http", self.get_base_url()), lambda: httpx.Client(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(600, connect=10), follow_redirects=True))
+
+    def get_rate_limiter(self) -> RateLimiter:
+        return _shared_instance(("limiter", self.get_base_url()), lambda: RateLimiter.from_env(self.env_prefix))
+
 
 class GroqLLMLoader(LLMLoader):
+    env_prefix = "GROQ"
+
     def __init__(self):
         self.base_url = "https://api.groq.com/openai/v1"
     def get_base_url(self) -> str:
@@ -60,6 +279,8 @@ class GroqLLMLoader(LLMLoader):
 
 
 class OpenaiLLMLoader(LLMLoader):
+    env_prefix = "OPENAI"
+
     def __init__(self):
         self.base_url = "https://api.openai.com/v1"
     def get_base_url(self) -> str:
@@ -69,8 +290,10 @@ class OpenaiLLMLoader(LLMLoader):
 
 
 class OllamaLLMLoader(LLMLoader):
-    def __init__(self, runpod_endpoint_id: str):
-        self.base_url = f"http://localhost:11434/v1"
+    env_prefix = "OLLAMA"
+
+    def __init__(self):
+        self.base_url = "http://localhost:11434/v1"
     def get_base_url(self) -> str:
         return self.base_url
     def get_provider_name(self) -> str:
@@ -78,21 +301,179 @@ class OllamaLLMLoader(LLMLoader):
 
 
 class HuggingFaceLLMLoader(LLMLoader):
+    env_prefix = "HF"
+
     def __init__(self, provider_subpath: str):
         self.base_url = f"https://router.huggingface.co/{provider_subpath}"
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "HuggingFaceLLMLoader":
+        return cls(getattr(args, "hf_subpath", None) or "openai/v1")
     def get_base_url(self) -> str:
         return self.base_url
     def get_provider_name(self) -> str:
         return "HuggingFace"
 
 
+# =========================
+# Provider registry
+# =========================
+
+# Provider name -> LLMLoader subclass, or "module:Class" imported the first time the
+# provider is used, so plugins cost nothing to the runs that do not select them.
+# LLM_PROVIDERS="name=module:Class,..." registers more at start-up.
+PROVIDERS: Dict[str, Union[str, Type[LLMLoader]]] = {
+    "openai": OpenaiLLMLoader,
+    "groq": GroqLLMLoader,
+    "ollama": OllamaLLMLoader,
+    "hf": HuggingFaceLLMLoader,
+    "huggingface": HuggingFaceLLMLoader,
+}
+
+
+def register_provider(name: str, loader: Union[str, Type[LLMLoader]]) -> None:
+    """Registers a provider: an LLMLoader subclass or a lazy "module:Class" reference."""
+    PROVIDERS[name.lower()] = loader
+
+
+def get_provider(name: str) -> Type[LLMLoader]:
+    """
+    The loader class of a provider, importing it on first use. Raises UsageError if
+    unknown, ValueError if its registered module cannot be loaded.
+    """
+    key = name.lower()
+    entry = PROVIDERS.get(key)
+    if entry is None:
+        raise UsageError(f"Unknown provider: {name}")
+    if isinstance(entry, str):
+        module, _, attr = entry.partition(":")
+        try:
+            entry = getattr(importlib.import_module(module), attr)
+        except (ImportError, AttributeError) as e:
+            raise ValueError(f"Provider {name}: cannot load {PROVIDERS[key]}: {e}")
+        PROVIDERS[key] = entry
+    return entry
+
+
+for _spec in filter(None, (p.strip() for p in os.getenv("LLM_PROVIDERS", "").split(","))):
+    _name, _, _ref = _spec.partition("=")
+    register_provider(_name.strip(), _ref.strip())
+
+
+# =========================
+# Response cache
+# =========================
+
+class ResponseCache:
+    """
+    Cache of chat completion texts keyed on the normalized request payload, the base URL
+    and a hash of the API key, so callers with different credentials never share entries.
+
+    Two tiers: an in-memory LRU of `memory_entries` items, and an optional SQLite
+    file under `directory` shared by every process using it, whose entries expire
+    after `ttl` seconds and whose least recently used entries are evicted beyond
+    `max_bytes`. Streaming and sampled (temperature > `max_temperature`) requests
+    are never cached. Concurrent identical requests in one process wait for the
+    first one instead of all calling the provider.
+    """
+    def __init__(self, directory: Optional[str] = None, ttl: float = 86400, max_bytes: int = 256 * 2**20,
+                 memory_entries: int = 256, max_temperature: float = 0.3):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.max_temperature = max_temperature
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, list] = {}  # key -> [lock, waiters]
+        self._db = None
+        if directory:
+            import sqlite3  # only runs with a disk cache pay for it
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(directory, "responses.db"), timeout=30,
+                                       check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL, "
+                             "created REAL NOT NULL, used REAL NOT NULL, size INTEGER NOT NULL) WITHOUT ROWID")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    def cacheable(self, payload: Dict[str, Any]) -> bool:
+        temperature = payload.get("temperature")
+        return not payload.get("stream") and (temperature is None or temperature <= self.max_temperature)
+
+    @staticmethod
+    def key(base_url: str, payload: Dict[str, Any], api_key: str = "") -> str:
+        # Only a digest of the key goes into the blob, so neither memory nor the SQLite file holds it
+        credential = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+        blob = json.dumps({"base_url": base_url.rstrip("/"), "credential": credential, "payload": payload},
+                          sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def single_flight(self, key: str):
+        """Serializes requests for the same key, so followers find the leader's response cached."""
+        with self._lock:
+            entry = self._inflight.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._inflight[key]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit and now - hit[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                return hit[1]
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT text, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                return None
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self._remember(key, row[1], row[0])
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, text)
+            if self._db is None:
+                return
+            size = len(text.encode("utf-8"))
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, text, now, now, size))
+            self._evict(now)
+
+    def _remember(self, key: str, created: float, text: str) -> None:
+        self._memory[key] = (created, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total > self.max_bytes:
+            freed = 0
+            for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+                if total - freed <= self.max_bytes * 0.9:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                freed += size
+
+
 # =========================
 # Base OpenAI client
 # =========================
 
 class BaseOpenAILLMClient:
     """Base class for OpenAI-compatible providers."""
-    def __init__(self, api_key: str, model: str, llm_loader: LLMLoader, options: Optional[Dict[str, Any]] = None):
+    def __init__(self, api_key: str, model: str, llm_loader: LLMLoader, options: Optional[Dict[str, Any]] = None,
+                 cache: Optional[ResponseCache] = None, retry: Optional[RetryPolicy] = None):
         self.base_url = llm_loader.get_base_url()
         self.api_key = api_key
         self.headers = {
@@ -101,19 +482,77 @@ class BaseOpenAILLMClient:
         }
         self.model = model
         self.llm_loader = llm_loader
-        self.openai_client = self._create_openai_client()
+        self.rate_limiter = llm_loader.get_rate_limiter()
+        self.retry = retry or RetryPolicy()
         self._default_completion_options = {"temperature": 0.1}
         if options:
             self._default_completion_options.update(options)
-
-    def _create_openai_client(self) -> OpenAI:
-        return OpenAI(base_url=self.base_url, api_key=self.api_key)
+        self.cache = cache
+        # "hit" / "miss" for the last completion when the cache was consulted, else None
+        self.last_cache_status: Optional[str] = None
+        # Items that failed in the last create_chat_completions_batch call
+        self.last_batch_failed = 0
+        # Provider call of the last completion (None when answered from the cache): its
+        # duration, retries included, and the token usage it reported, if any
+        self.last_call_seconds: Optional[float] = None
+        self.last_usage: Optional[Dict[str, int]] = None
+
+    def _create_async_openai_client(self, connections: int = HTTP_MAX_CONNECTIONS) -> openai.AsyncOpenAI:
+        # Async transports are bound to their event loop, so each batch gets its own pool.
+        # Retries are ours, so the SDK's are disabled
+        http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+                                        timeout=httpx.Timeout(600, connect=10), follow_redirects=True)
+        return openai.AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, http_client=http_client, max_retries=0)
+
+    def _with_retries(self, call: Callable[[], Any], tokens: float = 0) -> Any:
+        """Runs call() within the rate limit, retrying transient failures per self.retry."""
+        for attempt in range(self.retry.max_retries + 1):
+            self.rate_limiter.acquire(tokens)
+            try:
+                return call()
+            except Exception as e:
+                if attempt == self.retry.max_retries or not self.retry.retryable(e):
+                    raise
+                time.sleep(self.retry.delay(attempt, e, self.rate_limiter))
+
+    async def _awith_retries(self, call: Callable[[], Any], tokens: float = 0) -> Any:
+        for attempt in range(self.retry.max_retries + 1):
+            await self.rate_limiter.aacquire(tokens)
+            try:
+                return await call()
+            except Exception as e:
+                if attempt == self.retry.max_retries or not self.retry.retryable(e):
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt, e, self.rate_limiter))
+
+    @staticmethod
+    def _estimate_tokens(payload: Dict[str, Any]) -> float:
+        """Rough token cost of a request for the TPM budget: ~4 characters per prompt token, plus max_tokens."""
+        chars = sum(len(str(m.get("content") or "")) for m in payload.get("messages", []))
+        return chars / 4 + (payload.get("max_tokens") or payload.get("max_completion_tokens") or 0)
+
+    @staticmethod
+    def _usage(completion: Any) -> Dict[str, int]:
+        """Token counts reported with a completion, from a JSON body or an SDK object ({} if none)."""
+        usage = completion.get("usage") if isinstance(completion, dict) else getattr(completion, "usage", None)
+        if usage is None:
+            return {}
+        get = usage.get if isinstance(usage, dict) else (lambda k: getattr(usage, k, None))
+        return {k: get(k) for k in ("prompt_tokens", "completion_tokens", "total_tokens") if isinstance(get(k), int)}
+
+    def _settle(self, estimated: float, completion: Any) -> None:
+        total = self._usage(completion).get("total_tokens")
+        if total:
+            self.rate_limiter.settle(estimated, total)
 
     def list_models(self) -> Any:
         url = f"{self.base_url}/models"
-        resp = requests.request("GET", url, headers=self.headers, timeout=60)
-        resp.raise_for_status()
-        return resp.json()
+
+        def get() -> Any:
+            resp = self.llm_loader.get_http_client().get(url, headers=self.headers, timeout=60)
+            resp.raise_for_status()
+            return resp.json()
+        return self._with_retries(get)
 
     def create_chat_completion(
         self,
@@ -127,6 +566,23 @@ class BaseOpenAILLMClient:
         Optional arguments supported include: temperature, top_p, max_tokens, stream,
         and reasoning_effort (for reasoning models): "low" | "medium" | "high".
         """
+        payload = self._build_payload(user_prompt, system_prompt, options)
+        self.last_cache_status = self.last_call_seconds = self.last_usage = None
+        if payload.get("stream"):
+            return "".join(self._stream(payload))
+        if not (self.cache and self.cache.cacheable(payload)):
+            return self._complete(payload)
+        key = self.cache.key(self.base_url, payload, self.api_key)
+        with self.cache.single_flight(key):
+            text = self.cache.get(key)
+            self.last_cache_status = "miss" if text is None else "hit"
+            if text is None:
+                text = self._complete(payload)
+                if text is not None:
+                    self.cache.put(key, text)
+        return text
+
+    def _build_payload(self, user_prompt: str, system_prompt: str, options: Dict[str, Any]) -> Dict[str, Any]:
         merged_options = {**self._default_completion_options, **options}
 
         base_payload: Dict[str, Any] = {
@@ -143,8 +599,150 @@ class BaseOpenAILLMClient:
         if "reasoning_effort" in merged_options and merged_options["reasoning_effort"] is not None:
             base_payload["reasoning_effort"] = merged_options.pop("reasoning_effort")
 
-        payload = {**base_payload, **merged_options}
-        completion = self.openai_client.chat.completions.create(**payload)
+        return {**base_payload, **merged_options}
+
+    # One-off calls go straight through the loader's pooled httpx transport: the OpenAI
+    # SDK takes longer to import than a short completion takes, and each CLI run pays it
+    def _post_chat(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        resp = self.llm_loader.get_http_client().post(f"{self.base_url}/chat/completions",
+                                                      headers=self.headers, json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _open_chat_stream(self, payload: Dict[str, Any]) -> httpx.Response:
+        http = self.llm_loader.get_http_client()
+        resp = http.send(http.build_request("POST", f"{self.base_url}/chat/completions",
+                                            headers=self.headers, json=payload), stream=True)
+        if resp.is_error:
+            resp.read()
+            resp.close()
+            resp.raise_for_status()
+        return resp
+
+    def _complete(self, payload: Dict[str, Any]) -> str:
+        tokens = self._estimate_tokens(payload)
+        started = time.perf_counter()
+        completion = self._with_retries(lambda: self._post_chat(payload), tokens)
+        self.last_call_seconds = time.perf_counter() - started
+        self._settle(tokens, completion)
+        self.last_usage = self._usage(completion) or None
+        return completion["choices"][0]["message"]["content"]
+
+    def stream_chat_completion(
+        self,
+        user_prompt: str,
+        system_prompt: str = "You are a helpful assistant.",
+        **options: Any,
+    ) -> Iterator[str]:
+        """
+        Like create_chat_completion, but yields the text deltas as the provider sends
+        them (stream=True), so callers can forward the answer before it is complete.
+        """
+        payload = self._build_payload(user_prompt, system_prompt, {**options, "stream": True})
+        self.last_cache_status = self.last_call_seconds = self.last_usage = None
+        return self._stream(payload)
+
+    def _stream(self, payload: Dict[str, Any]) -> Iterator[str]:
+        # Only opening the stream is retried: deltas already yielded cannot be taken back
+        started = time.perf_counter()
+        resp = self._with_retries(lambda: self._open_chat_stream(payload), self._estimate_tokens(payload))
+        try:
+            # Server-sent events: one `data: <chunk JSON>` line per delta, then `data: [DONE]`
+            for line in resp.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices")
+                # Some providers send choice-less chunks (e.g. usage) or empty deltas
+                content = choices and (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
+        finally:
+            resp.close()
+        self.last_call_seconds = time.perf_counter() - started
+
+    def create_chat_completions_batch(
+        self,
+        items: Iterable[Union[str, Dict[str, Any]]],
+        system_prompt: str = "You are a helpful assistant.",
+        concurrency: int = 8,
+        **options: Any,
+    ) -> List[Dict[str, Any]]:
+        """
+        Runs many chat completions concurrently and returns one result per item, in input order.
+
+        An item is a user prompt, or a dict with `user_prompt` and optionally `id`,
+        `system_prompt` and per-item completion options (which override `options`).
+        Results are dicts {"index", "id", "text", "error", "cache"}: a failed item
+        gets its error message instead of aborting the batch. At most `concurrency`
+        requests are in flight at once.
+        """
+        return asyncio.run(self.acreate_chat_completions_batch(items, system_prompt, concurrency, **options))
+
+    async def acreate_chat_completions_batch(
+        self,
+        items: Iterable[Union[str, Dict[str, Any]]],
+        system_prompt: str = "You are a helpful assistant.",
+        concurrency: int = 8,
+        **options: Any,
+    ) -> List[Dict[str, Any]]:
+        """Async form of create_chat_completions_batch, for callers already running an event loop."""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        inflight: Dict[str, asyncio.Future] = {}  # cache key -> first request for it in this batch
+        client = self._create_async_openai_client(max(1, concurrency))
+
+        async def one(index: int, item: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+            result: Dict[str, Any] = {"index": index, "id": None, "text": None, "error": None, "cache": None}
+            try:
+                item = dict(item) if isinstance(item, dict) else {"user_prompt": item}
+                result["id"] = item.pop("id", None)
+                user_prompt = item.pop("user_prompt", None)
+                if not isinstance(user_prompt, str) or not user_prompt:
+                    raise ValueError("item has no user_prompt")
+                item_system_prompt = item.pop("system_prompt", system_prompt)
+                # Streaming makes no sense for a collected batch result
+                payload = self._build_payload(user_prompt, item_system_prompt, {**options, **item, "stream": False})
+                if not (self.cache and self.cache.cacheable(payload)):
+                    async with semaphore:
+                        result["text"] = await self._acomplete(client, payload)
+                    return result
+                key = self.cache.key(self.base_url, payload, self.api_key)
+                if key in inflight:  # identical item earlier in the batch: share its response
+                    result["text"] = await asyncio.shield(inflight[key])
+                    result["cache"] = "hit"
+                    return result
+                inflight[key] = asyncio.get_running_loop().create_future()
+                inflight[key].add_done_callback(lambda f: f.exception())  # may have no follower
+                try:
+                    text = self.cache.get(key)
+                    result["cache"] = "miss" if text is None else "hit"
+                    if text is None:
+                        async with semaphore:
+                            text = await self._acomplete(client, payload)
+                        if text is not None:
+                            self.cache.put(key, text)
+                    inflight[key].set_result(text)
+                except BaseException as e:
+                    inflight.pop(key).set_exception(e)
+                    raise
+                result["text"] = text
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            return result
+
+        try:
+            results = list(await asyncio.gather(*(one(i, item) for i, item in enumerate(items))))
+        finally:
+            await client.close()
+        self.last_batch_failed = sum(1 for r in results if r["error"])
+        return results
+
+    async def _acomplete(self, client: openai.AsyncOpenAI, payload: Dict[str, Any]) -> str:
+        tokens = self._estimate_tokens(payload)
+        completion = await self._awith_retries(lambda: client.chat.completions.create(**payload), tokens)
+        self._settle(tokens, completion)
         return completion.choices[0].message.content
 
 
@@ -177,25 +775,14 @@ def _infer_api_key(provider: str, cli_key: Optional[str]) -> Optional[str]:
 
 
 def build_loader(provider: str, args: argparse.Namespace) -> LLMLoader:
-    p = provider.lower()
-    if p == "openai":
-        return OpenaiLLMLoader()
-    elif p == "groq":
-        return GroqLLMLoader()
-    elif p == "ollama":
-        return OllamaLLMLoader()
-    elif p in {"hf", "huggingface"}:
-        sub = args.hf_subpath or "openai/v1"
-        return HuggingFaceLLMLoader(sub)
-    else:
-        raise ValueError(f"Unknown provider: {provider}")
+    return get_provider(provider).from_args(args)
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
-    parser = argparse.ArgumentParser(
+    parser = _ArgumentParser(
         description="Universal OpenAI-compatible LLM CLI (OpenAI, Groq, Ollama, HuggingFace)."
     )
-    parser.add_argument("--provider", required=True, help="openai | groq | ollama | hf|huggingface")
+    parser.add_argument("--provider", required=True, help=" | ".join(PROVIDERS))
     parser.add_argument("--model", required=False, help="Model name (required unless --list-models).")
     parser.add_argument("--api-key", help="API key (otherwise read from env).")
     parser.add_argument("--base-url", help="Override base URL (advanced).")
@@ -212,11 +799,18 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     parser.add_argument("-u", "--user-prompt", help="User prompt text.")
     parser.add_argument("-s", "--system-prompt", default="You are a helpful assistant.", help="System prompt text.")
 
+    # Batch mode
+    parser.add_argument("--prompts-file",
+                        help="JSONL of prompts to run concurrently: a string or {\"user_prompt\", \"id\", \"system_prompt\", options...} per line.")
+    parser.add_argument("--output", help="Write batch results (JSONL, input order) to this file instead of stdout.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Batch requests in flight at once (default 8).")
+
     # Common completion options
     parser.add_argument("--temperature", type=float, help="Sampling temperature.")
     parser.add_argument("--top-p", type=float, help="Top-p sampling.")
     parser.add_argument("--max-tokens", type=int, help="Max tokens in response.")
-    parser.add_argument("--stream", type=lambda v: str(v).lower() in {"1","true","yes"}, help="Enable streaming (bool).")
+    parser.add_argument("--stream", nargs="?", const=True, type=lambda v: str(v).lower() in {"1","true","yes"},
+                        help="Stream the answer to stdout as it is generated (bare flag or a bool).")
 
     # Reasoning effort (optional, only sent if provided)
     parser.add_argument("--reasoning-effort", choices=["low", "medium", "high"],
@@ -225,10 +819,138 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     # Pass arbitrary options via JSON
     parser.add_argument("--options-json", help='Arbitrary options as JSON, e.g. \'{"presence_penalty":0.1}\'')
 
+    # Response cache (identical low-temperature requests are answered locally)
+    parser.add_argument("--cache-dir", default=os.getenv("LLM_CACHE_DIR"),
+                        help="Persistent response cache directory (default: LLM_CACHE_DIR; unset = no cache).")
+    parser.add_argument("--no-cache", dest="cache_dir", action="store_const", const=None, help="Disable the response cache.")
+    parser.add_argument("--cache-ttl", type=float, default=float(os.getenv("LLM_CACHE_TTL", "86400")),
+                        help="Seconds a cached response stays valid (default 86400).")
+    parser.add_argument("--cache-max-mb", type=float, default=float(os.getenv("LLM_CACHE_MAX_MB", "256")),
+                        help="Disk cache size before least recently used entries are evicted (default 256).")
+
+    # Rate limits and retries (limits default to <PROVIDER>_RPM/_TPM, then LLM_RPM/LLM_TPM)
+    parser.add_argument("--rpm", type=float, help="Requests per minute allowed by the provider quota.")
+    parser.add_argument("--tpm", type=float, help="Tokens per minute allowed by the provider quota.")
+    parser.add_argument("--max-retries", type=int, default=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                        help="Retries of rate-limited, 5xx and connection failures (default 4).")
+
     args = parser.parse_args(argv)
     return args
 
 
+def resolve_loader(args: argparse.Namespace) -> LLMLoader:
+    """Builds the provider loader, honouring --base-url overrides."""
+    loader = build_loader(args.provider, args)
+    if args.base_url:
+        class _OverrideLoader(LLMLoader):
+            env_prefix = loader.env_prefix
+            def get_base_url(self) -> str:
+                return args.base_url
+            def get_provider_name(self) -> str:
+                return f"{args.provider}(override)"
+        loader = _OverrideLoader()
+    return loader
+
+
+def collect_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """Merges completion options from CLI flags and the --options-json blob. Raises UsageError if it is invalid."""
+    opt: Dict[str, Any] = {}
+    if args.temperature is not None:
+        opt["temperature"] = args.temperature
+    if args.top_p is not None:
+        opt["top_p"] = args.top_p
+    if args.max_tokens is not None:
+        opt["max_tokens"] = args.max_tokens
+    if args.stream is not None:
+        opt["stream"] = args.stream
+    if args.reasoning_effort is not None:
+        opt["reasoning_effort"] = args.reasoning_effort
+    if args.options_json:
+        try:
+            extra = json.loads(args.options_json)
+        except json.JSONDecodeError as e:
+            raise UsageError(f"Invalid --options-json: {e}")
+        if not isinstance(extra, dict):
+            raise UsageError("Invalid --options-json: not a JSON object")
+        opt.update(extra)
+    return opt
+
+
+def run(args: argparse.Namespace, client: BaseOpenAILLMClient, opt: Dict[str, Any],
+        on_delta: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Executes the requested operation and returns the text the CLI prints.
+    With `on_delta`, a streamed completion (--stream, plain text output) is also
+    passed to it piece by piece as it arrives; the full text is still returned.
+    Raises UsageError for missing arguments.
+    """
+    if args.list_models:
+        data = client.list_models()
+        if args.json_output:
+            return json.dumps(data, ensure_ascii=False, indent=2)
+        models = data.get("data") if isinstance(data, dict) else None
+        if isinstance(models, list):
+            return "\n".join(m.get("id") if isinstance(m, dict) else str(m) for m in models)
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    if not args.model:
+        raise UsageError("--model is required unless --list-models is used.")
+    if args.prompts_file:
+        return run_batch(args, client, opt)
+    if not args.user_prompt:
+        raise UsageError("--user-prompt is required for chat completion.")
+
+    if opt.get("stream") and on_delta and not args.json_output:
+        parts = []
+        for delta in client.stream_chat_completion(args.user_prompt, args.system_prompt, **opt):
+            on_delta(delta)
+            parts.append(delta)
+        return "".join(parts)
+
+    text = client.create_chat_completion(
+        user_prompt=args.user_prompt,
+        system_prompt=args.system_prompt,
+        **opt,
+    )
+
+    if args.json_output:
+        return json.dumps({"text": text}, ensure_ascii=False, indent=2)
+    return text
+
+
+def read_prompts(path: str) -> List[Union[str, Dict[str, Any]]]:
+    """Reads a --prompts-file ("-" for stdin); blank lines are skipped."""
+    items = []
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise UsageError(f"{path}:{n}: invalid JSON: {e}")
+            if not isinstance(item, (str, dict)):
+                raise UsageError(f"{path}:{n}: expected a string or an object")
+            items.append(item)
+    return items
+
+
+def run_batch(args: argparse.Namespace, client: BaseOpenAILLMClient, opt: Dict[str, Any]) -> str:
+    """Runs --prompts-file and returns its JSONL results, or writes them to --output and returns a summary."""
+    items = read_prompts(args.prompts_file)
+    started = time.time()
+    results = client.create_chat_completions_batch(items, args.system_prompt, args.concurrency, **opt)
+    ok = len(results) - client.last_batch_failed
+    summary = f"{ok}/{len(results)} completions ok in {time.time() - started:.1f}s"
+    lines = "\n".join(json.dumps(r, ensure_ascii=False) for r in results)
+    if not args.output:
+        print(f"[llm] batch: {summary}", file=sys.stderr)
+        return lines
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(lines + "\n" if lines else "")
+    return f"Wrote {summary} → {args.output}"
+
+
 def main(argv: list[str]) -> int:
     args = parse_args(argv)
 
@@ -238,81 +960,46 @@ def main(argv: list[str]) -> int:
     api_key = _infer_api_key(args.provider, args.api_key)
     if not api_key:
         print("ERROR: No API key provided. Use --api-key or set an appropriate env var.", file=sys.stderr)
-        return 2
+        return EX_USAGE
 
     try:
-        loader = build_loader(args.provider, args)
-        if args.base_url:
-            class _OverrideLoader(LLMLoader):
-                def get_base_url(self) -> str:
-                    return args.base_url
-                def get_provider_name(self) -> str:
-                    return f"{args.provider}(override)"
-            loader = _OverrideLoader()
-
-        # Merge options from CLI flags and JSON blob
-        opt: Dict[str, Any] = {}
-        if args.temperature is not None:
-            opt["temperature"] = args.temperature
-        if args.top_p is not None:
-            opt["top_p"] = args.top_p
-        if args.max_tokens is not None:
-            opt["max_tokens"] = args.max_tokens
-        if args.stream is not None:
-            opt["stream"] = args.stream
-        if args.reasoning_effort is not None:
-            opt["reasoning_effort"] = args.reasoning_effort
-        if args.options_json:
-            try:
-                extra = json.loads(args.options_json)
-                if not isinstance(extra, dict):
-                    raise ValueError("options-json must be a JSON object")
-                opt.update(extra)
-            except json.JSONDecodeError as e:
-                print(f"ERROR: Invalid --options-json: {e}", file=sys.stderr)
-                return 2
+        loader = resolve_loader(args)
+        opt = collect_options(args)
 
         model_name = args.model or ""
-        client = BaseOpenAILLMClient(api_key=api_key, model=model_name, llm_loader=loader, options=opt)
-
-        if args.list_models:
-            data = client.list_models()
-            if args.json_output:
-                print(json.dumps(data, ensure_ascii=False, indent=2))
-            else:
-                models = data.get("data") if isinstance(data, dict) else None
-                if isinstance(models, list):
-                    for m in models:
-                        mid = m.get("id") if isinstance(m, dict) else str(m)
-                        print(mid)
-                else:
-                    print(json.dumps(data, ensure_ascii=False, indent=2))
-            return 0
-
-        if not args.model:
-            print("ERROR: --model is required unless --list-models is used.", file=sys.stderr)
-            return 2
-        if not args.user_prompt:
-            print("ERROR: --user-prompt is required for chat completion.", file=sys.stderr)
-            return 2
-
-        text = client.create_chat_completion(
-            user_prompt=args.user_prompt,
-            system_prompt=args.system_prompt,
-            **opt,
-        )
-
-        if args.json_output:
-            print(json.dumps({"text": text}, ensure_ascii=False, indent=2))
-        else:
-            print(text)
-
-        return 0
-
-    except requests.HTTPError as e:
-        print(f"HTTP ERROR: {e.response.status_code} {e.response.text}", file=sys.stderr)
-        return 3
+        cache = ResponseCache(args.cache_dir, args.cache_ttl, int(args.cache_max_mb * 2**20)) if args.cache_dir else None
+        if args.rpm or args.tpm:
+            limiter = loader.get_rate_limiter()
+            limiter.configure(args.rpm or limiter.rpm, args.tpm or limiter.tpm)
+        client = BaseOpenAILLMClient(api_key=api_key, model=model_name, llm_loader=loader, options=opt, cache=cache,
+                                     retry=RetryPolicy(max_retries=max(0, args.max_retries)))
+
+        streamed = []
+
+        def write_delta(delta: str) -> None:
+            sys.stdout.write(delta)
+            sys.stdout.flush()
+            streamed.append(delta)
+
+        output = run(args, client, opt, on_delta=write_delta)
+        # Always reported: orchestrators read these lines to record cache hits, timings and usage
+        if client.last_cache_status:
+            print(f"[llm] cache {client.last_cache_status}", file=sys.stderr)
+        if client.last_call_seconds is not None:
+            usage = " ".join(f"{k}={v}" for k, v in (client.last_usage or {}).items())
+            print(f"[llm] call seconds={client.last_call_seconds:.6f} {usage}".rstrip(), file=sys.stderr)
+
+        print("" if streamed else output)
+        # Batch mode: every item ran, but report failures to scripts
+        return 1 if client.last_batch_failed else 0
+
+    except UsageError as e:  # other errors, e.g. a malformed provider response, are not the caller's
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EX_USAGE
     except Exception as e:
+        if _imported("httpx") and isinstance(e, httpx.HTTPStatusError):
+            print(f"HTTP ERROR: {e.response.status_code} {e.response.text}", file=sys.stderr)
+            return 3
         print(f"ERROR: {e}", file=sys.stderr)
         return 4
 
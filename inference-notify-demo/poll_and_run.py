@@ -1,6 +1,6 @@
 # /// script
 # requires-python = ">=3.10"
-# dependencies = ["httpx>=0.27"]
+# dependencies = ["httpx>=0.27", "openai>=1.40.0", "zstandard>=0.22"]
 # ///
 # Ensure UTF-8 encoding for the entire script
 import sys
@@ -10,40 +10,335 @@ os.environ['PYTHONIOENCODING'] = 'utf-8'
 import time
 import json
 import httpx
+import codecs
+import gzip
 import hashlib
+import http.server
+import importlib.util
+import socket
+import sqlite3
 import subprocess
+import threading
 import uuid
-import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import zstandard
+except ImportError:  # results are then compressed with gzip
+    zstandard = None
 
 # --- Configuration ---
 INBOX_URL = os.getenv("INBOX_URL", "http://localhost:8080/inbox")
 # Use current working directory for state, not script location (since script runs from temp when remote)
 STATE_DIR = os.path.join(os.getcwd(), "state")
-SEEN_FILE = os.path.join(STATE_DIR, "seen.txt")
+SEEN_FILE = os.path.join(STATE_DIR, "seen.txt")  # legacy store, imported into SEEN_DB once
+SEEN_DB = os.path.join(STATE_DIR, "seen.db")
+SEEN_TTL_DAYS = float(os.getenv("SEEN_TTL_DAYS", "0"))  # forget processed ids after N days (0 = never)
+PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "100"))
+LONG_POLL_SECONDS = float(os.getenv("INBOX_LONG_POLL", "30"))  # 0 disables long-polling
+FALLBACK_SECONDS = 60  # plain polling period after a long-poll failure
+# Concurrency: jobs run in one thread pool per provider, e.g. PROVIDER_CONCURRENCY="groq=8,ollama=2"
+DEFAULT_CONCURRENCY = int(os.getenv("DEFAULT_CONCURRENCY", "4"))
+PROVIDER_CONCURRENCY = os.getenv("PROVIDER_CONCURRENCY", "")
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "32"))  # queued + running jobs before polling pauses
+# Execution: "subprocess" spawns `uv run <remote inference.py>` per job (isolated);
+# "inprocess" imports a pinned local copy once and calls the client directly.
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "subprocess")
+INFERENCE_SCRIPT_URL = os.getenv("INFERENCE_SCRIPT_URL", "https://raw.githubusercontent.com/gegedenice/LLM-notify/main/inference-notify-demo/inference.py")
+INFERENCE_SCRIPT = os.getenv("INFERENCE_SCRIPT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "inference.py"))
+INFERENCE_SHA256 = os.getenv("INFERENCE_SHA256")  # expected digest of INFERENCE_SCRIPT, checked before import
+EX_USAGE = 64  # inference.py's exit status for bad arguments; uv's own failures exit 1 or 2 and are retried
+# Job queue: JOB_QUEUE=1 claims leased jobs from the inbox (POST /jobs/claim) instead of
+# polling and deduplicating locally, so several orchestrators can share one inbox.
+JOB_QUEUE = os.getenv("JOB_QUEUE", "0") == "1"
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))  # renewed every third of it while a job runs
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Response cache shared by all jobs (identical low-temperature requests skip the provider); "" disables it
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(STATE_DIR, "llm-cache"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # serve GET /metrics (Prometheus) on this port; 0 = off
+# Result store, served by the inbox's /results/: both processes must see the same directory, so
+# set RESULTS_DIR to one path (or shared volume) for both when they do not run from the same cwd
+RESULTS_DIR = os.path.abspath(os.getenv("RESULTS_DIR", os.path.join(STATE_DIR, "results")))
+RESULT_COMPRESSION = os.getenv("RESULT_COMPRESSION", "zstd")  # zstd | gzip | none
+RESULT_RETENTION_DAYS = float(os.getenv("RESULT_RETENTION_DAYS", "0"))  # 0 = keep everything
+RESULT_MAX_MB = float(os.getenv("RESULT_MAX_MB", "0"))  # 0 = no quota
 os.makedirs(STATE_DIR, exist_ok=True)
 
+# --- Metrics ---
+class Metrics:
+    """
+    Timing spans and counters, rendered in the Prometheus text format: one
+    `<prefix>_span_seconds` histogram labelled by span, and `<prefix>_<name>_total`
+    counters. span() also copies its duration into a per-job dict when given one.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._spans = {}     # span -> [cumulative bucket counts..., count, sum]
+        self._counters = {}  # (name, labels) -> value
+
+    def observe(self, span: str, seconds: float):
+        with self._lock:
+            h = self._spans.setdefault(span, [0] * len(self.BUCKETS) + [0, 0.0])
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += seconds
+
+    @contextmanager
+    def span(self, name: str, into: dict = None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe(name, seconds)
+            if into is not None:
+                into[name] = round(into.get(name, 0) + seconds, 6)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        label = lambda items: "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+        name = f"{self.prefix}_span_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        with self._lock:
+            for span, h in sorted(self._spans.items()):
+                for bound, n in zip(self.BUCKETS, h):
+                    lines.append(f'{name}_bucket{label([("span", span), ("le", bound)])} {n}')
+                lines.append(f'{name}_bucket{label([("span", span), ("le", "+Inf")])} {h[-2]}')
+                lines.append(f'{name}_sum{label([("span", span)])} {h[-1]:.6f}')
+                lines.append(f'{name}_count{label([("span", span)])} {h[-2]}')
+            for counter in sorted({n for n, _ in self._counters}):
+                lines.append(f"# TYPE {self.prefix}_{counter}_total counter")
+                lines += [f"{self.prefix}_{counter}_total{label(labels)} {value:g}"
+                          for (n, labels), value in sorted(self._counters.items()) if n == counter]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics("inference_orchestrator")
+
+def serve_metrics(port: int):
+    """Serves GET /metrics in the Prometheus text format from a background thread."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://0.0.0.0:{port}/metrics", file=sys.stderr)
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
 # --- State Management ---
-def get_seen_ids():
-    """Reads the set of seen message IDs from the state file."""
-    if not os.path.exists(SEEN_FILE):
-        return set()
-    with open(SEEN_FILE, "r", encoding='utf-8') as f:
-        return set(line.strip() for line in f)
-
-def mark_as_seen(message_id):
-    """Marks a message ID as seen by appending it to the state file."""
-    with open(SEEN_FILE, "a", encoding='utf-8') as f:
-        f.write(message_id + "\n")
+class SeenStore:
+    """
+    Processed message ids in SQLite, looked up by primary key instead of loaded
+    into memory, plus the poller's high-water mark: the inbox cursor up to which
+    every message is processed, so a restart resumes there instead of re-reading
+    the whole inbox. Ids older than `ttl_days` are pruned at startup (0 = never).
+    """
+    def __init__(self, path: str, ttl_days: float = 0, legacy: str = None):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, at REAL NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE INDEX IF NOT EXISTS seen_at ON seen (at)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy and os.path.exists(legacy) and self._meta("legacy_imported") is None:
+            at = os.path.getmtime(legacy)
+            with open(legacy, encoding="utf-8") as f, self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)",
+                                     ((line.strip(), at) for line in f if line.strip()))
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_imported', '1')")
+        if ttl_days > 0:
+            self._db.execute("DELETE FROM seen WHERE at < ?", (time.time() - ttl_days * 86400,))
+
+    def _meta(self, key: str):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, msg_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM seen WHERE id = ?", (msg_id,)).fetchone() is not None
+
+    def add(self, msg_id: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO seen VALUES (?, ?)", (msg_id, time.time()))
+
+    def cursor(self) -> int:
+        with self._lock:
+            return int(self._meta("cursor") or 0)
+
+    def set_cursor(self, cursor: int):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('cursor', ?)", (str(cursor),))
 
 def get_message_id(message: dict) -> str:
-    """Computes a stable SHA1 hash for a given message dictionary."""
+    """Computes a stable SHA1 hash for a given message dictionary (for inboxes that do not send ids)."""
     return hashlib.sha1(json.dumps(message, sort_keys=True).encode()).hexdigest()
 
+# --- Result Store ---
+class ResultStore:
+    """
+    Content-addressed job outputs: each distinct output is stored once, as
+    objects/<sha[:2]>/<sha256>[.zst|.gz] (compressed when that saves space), and
+    names/<result name> holds the hash of each job's result; parts/<result name>.part
+    holds the output of a streaming job while it runs. Storing an output
+    again only refreshes its mtime. Retention and the size quota go by that mtime,
+    the least recently stored objects going first; they are enforced after a put,
+    at most every `gc_interval` seconds. The inbox serves both kinds of key under
+    /results/.
+    """
+    SUFFIXES = {"zstd": ".zst", "gzip": ".gz", "identity": ""}
+    MIN_COMPRESS_BYTES = 512  # smaller outputs are stored as they are
+
+    def __init__(self, root: str, compression: str = "zstd", retention_days: float = 0, max_bytes: int = 0,
+                 gc_interval: float = 60):
+        if compression == "zstd" and zstandard is None:
+            print("zstandard is not installed; compressing results with gzip.", file=sys.stderr)
+            compression = "gzip"
+        if compression not in ("zstd", "gzip", "none"):
+            raise ValueError(f"RESULT_COMPRESSION must be zstd, gzip or none, not {compression!r}")
+        self.root, self.compression = root, compression
+        self.retention, self.max_bytes, self.gc_interval = retention_days * 86400, max_bytes, gc_interval
+        self.objects, self.names = os.path.join(root, "objects"), os.path.join(root, "names")
+        self.parts = os.path.join(root, "parts")
+        for path in (self.objects, self.names, self.parts):
+            os.makedirs(path, exist_ok=True)
+        self._gc_lock = threading.Lock()
+        self._last_gc = 0.0
+
+    def _path(self, digest: str, encoding: str) -> str:
+        return os.path.join(self.objects, digest[:2], digest + self.SUFFIXES[encoding])
+
+    def find(self, digest: str):
+        """Path of the stored object, or None."""
+        for encoding in self.SUFFIXES:
+            path = self._path(digest, encoding)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _encode(self, data: bytes) -> tuple[bytes, str]:
+        if self.compression == "none" or len(data) < self.MIN_COMPRESS_BYTES:
+            return data, "identity"
+        if self.compression == "zstd":
+            encoded = zstandard.ZstdCompressor(level=9).compress(data)  # records the size, for Range requests
+        else:
+            encoded = gzip.compress(data, compresslevel=6, mtime=0)
+        # Incompressible output: not worth decoding on every read
+        return (encoded, self.compression) if len(encoded) < len(data) * 0.9 else (data, "identity")
+
+    def put(self, data: bytes) -> str:
+        """Stores `data` unless an identical output is already stored; returns its SHA-256."""
+        digest = hashlib.sha256(data).hexdigest()
+        existing = self.find(digest)
+        if existing:
+            try:
+                os.utime(existing)
+            except FileNotFoundError:  # evicted since find(): store it again
+                existing = None
+        if not existing:
+            encoded, encoding = self._encode(data)
+            path = self._path(digest, encoding)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(encoded)
+            os.replace(tmp, path)
+        self.maybe_gc(keep=digest)
+        return digest
+
+    def name(self, name: str, digest: str):
+        """Points the result name `name` at a stored output."""
+        tmp = os.path.join(self.names, f".{name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(digest)
+        os.replace(tmp, os.path.join(self.names, name))
+
+    def maybe_gc(self, keep: str = None):
+        if not (self.retention or self.max_bytes) or time.monotonic() - self._last_gc < self.gc_interval:
+            return
+        if self._gc_lock.acquire(blocking=False):
+            try:
+                self._last_gc = time.monotonic()
+                self.gc(keep)
+            finally:
+                self._gc_lock.release()
+
+    def gc(self, keep: str = None) -> int:
+        """
+        Removes objects (and names) past retention, then the least recently stored objects over quota.
+        The object `keep` (the one just stored) is never removed, even when it alone exceeds the quota.
+        """
+        expired_before = time.time() - self.retention if self.retention else 0
+        objects, removed = [], 0
+        for shard in os.scandir(self.objects):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    st = entry.stat()
+                    objects.append((st.st_mtime, st.st_size, entry.path))
+        objects.sort()
+        total = sum(size for _, size, _ in objects)
+        for mtime, size, path in objects:
+            if mtime >= expired_before and (not self.max_bytes or total <= self.max_bytes):
+                break
+            if keep and os.path.basename(path).split(".")[0] == keep:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        if expired_before:
+            # Names of evicted objects are left for the inbox to answer 410 Gone until they expire too
+            for entry in os.scandir(self.names):
+                if entry.stat().st_mtime < expired_before:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+        if removed:
+            print(f"Result store: removed {removed} object(s); {total / 2**20:.1f} MiB kept.", file=sys.stderr)
+        return removed
+
+results = ResultStore(RESULTS_DIR, RESULT_COMPRESSION, RESULT_RETENTION_DAYS, int(RESULT_MAX_MB * 2**20))
+
 # --- Notification Helpers ---
-def post_announce(object_name, file_path, generating_activity):
-    """Posts an 'Announce' notification to the inbox about a generated resource."""
+def post_announce(object_name, file_path, generating_activity, activity_details=None, object_url=None):
+    """
+    Posts an 'Announce' notification to the inbox about a generated resource.
+    With `activity_details` (e.g. {"cache": "hit"}), the generating activity is
+    described as an object carrying them instead of a bare id.
+    """
     base_url = INBOX_URL.rsplit('/', 1)[0]
-    object_url = f"{base_url}/{STATE_DIR}/{object_name}"
+    object_url = object_url or f"{base_url}/results/{object_name}"
     payload = {
         "@context": ["https://www.w3.org/ns/activitystreams", "https://www.w3.org/ns/prov#"],
         "type": "Announce",
@@ -54,7 +349,8 @@ def post_announce(object_name, file_path, generating_activity):
             "name": object_name,
             "url": object_url
         },
-        "prov:wasGeneratedBy": generating_activity
+        "prov:wasGeneratedBy": ({"id": generating_activity, "type": "Activity", **activity_details}
+                                if activity_details else generating_activity)
     }
     try:
         httpx.post(INBOX_URL, headers={"Content-Type": "application/ld+json"}, json=payload, timeout=30)
@@ -63,7 +359,7 @@ def post_announce(object_name, file_path, generating_activity):
 
 # --- Core Logic ---
 def run_command(command):
-    """Executes a command, logs its output, and returns the captured stdout."""
+    """Executes a command, logs its output, and returns the captured (stdout, stderr)."""
     print(f"Running command: {' '.join(command)}", file=sys.stderr)
     
     # Set environment variables to ensure UTF-8 encoding
@@ -71,6 +367,7 @@ def run_command(command):
     env['PYTHONIOENCODING'] = 'utf-8'
     env['LC_ALL'] = 'C.UTF-8'
     env['LANG'] = 'C.UTF-8'
+    env['LLM_CACHE_DIR'] = LLM_CACHE_DIR
     
     try:
         process = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8', errors='replace', env=env)
@@ -78,7 +375,7 @@ def run_command(command):
             print(process.stdout)
         if process.stderr:
             print(process.stderr, file=sys.stderr)
-        return process.stdout
+        return process.stdout, process.stderr
     except UnicodeDecodeError as e:
         print(f"Unicode decode error: {e}", file=sys.stderr)
         # Fallback: capture as bytes and decode with errors='replace'
@@ -89,7 +386,44 @@ def run_command(command):
             print(stdout_text)
         if stderr_text:
             print(stderr_text, file=sys.stderr)
-        return stdout_text
+        return stdout_text, stderr_text
+
+def stream_command(command, on_output):
+    """
+    Executes a command, passing its stdout to on_output as it is produced instead
+    of once the process exits. Returns the captured (stdout, stderr) and raises
+    CalledProcessError on a non-zero exit, like run_command.
+    """
+    print(f"Running command: {' '.join(command)}", file=sys.stderr)
+    env = os.environ.copy()
+    env['PYTHONIOENCODING'] = 'utf-8'
+    env['LC_ALL'] = 'C.UTF-8'
+    env['LANG'] = 'C.UTF-8'
+    env['LLM_CACHE_DIR'] = LLM_CACHE_DIR
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    stderr_chunks = []
+    reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    reader.start()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    stdout_parts = []
+    while True:
+        chunk = process.stdout.read1(65536)
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            on_output(text)
+            stdout_parts.append(text)
+        if not chunk:
+            break
+    returncode = process.wait()
+    reader.join()
+    stdout_text = "".join(stdout_parts)
+    stderr_text = b"".join(stderr_chunks).decode("utf-8", errors="replace")
+    if stderr_text:
+        print(stderr_text, file=sys.stderr)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command, stdout_text, stderr_text)
+    return stdout_text, stderr_text
 
 def build_inference_command(params: dict) -> list[str]:
     """
@@ -97,7 +431,11 @@ def build_inference_command(params: dict) -> list[str]:
     notification parameters.
     """
     # Base command using the remote script URL
-    cmd = ["uv", "run", "https://raw.githubusercontent.com/gegedenice/LLM-notify/main/inference-notify-demo/inference.py"]
+    return ["uv", "run", INFERENCE_SCRIPT_URL] + build_inference_args(params)
+
+def build_inference_args(params: dict) -> list[str]:
+    """Maps notification parameters to inference.py command-line arguments."""
+    cmd = []
 
     # Dynamically map all keys from the notification to command-line flags
     for key, value in params.items():
@@ -113,65 +451,456 @@ def build_inference_command(params: dict) -> list[str]:
 
     return cmd
 
+# --- In-process Execution ---
+_inference = None
+_response_cache = None
+_inference_lock = threading.Lock()
+
+def load_inference_module():
+    """Imports the pinned local inference.py once, after checking its SHA-256 if INFERENCE_SHA256 is set."""
+    global _inference
+    with _inference_lock:
+        if _inference is None:
+            with open(INFERENCE_SCRIPT, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if INFERENCE_SHA256 and digest != INFERENCE_SHA256.lower():
+                raise RuntimeError(f"{INFERENCE_SCRIPT} has sha256 {digest}, expected {INFERENCE_SHA256}")
+            with metrics.span("module_load"):
+                spec = importlib.util.spec_from_file_location("inference", INFERENCE_SCRIPT)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            print(f"Loaded {INFERENCE_SCRIPT} (sha256 {digest})", file=sys.stderr)
+            _inference = module
+        return _inference
+
+class InvalidJob(Exception):
+    """The job's parameters cannot run as given: it is nacked without retry."""
+
+def run_in_process(params: dict, on_delta=None) -> tuple[str, dict]:
+    """
+    Runs a job through the imported inference client. Jobs share each provider's pooled
+    connections and rate limit (kept by inference.py per base URL) and one response
+    cache. Returns (text, report), the report as parse_llm_report() builds it.
+    A streamed answer is also passed to on_delta as it arrives. Raises InvalidJob
+    when the parameters do not parse; anything raised by the provider call is left
+    as is, so the job can be retried.
+    """
+    global _response_cache
+    inference = load_inference_module()
+    try:
+        args = inference.parse_args(build_inference_args(params))
+    except SystemExit:
+        raise InvalidJob(f"Invalid inference parameters: {sorted(params)}")
+    api_key = inference._infer_api_key(args.provider, args.api_key)
+    if not api_key:
+        raise InvalidJob("No API key provided. Set api_key in the job or an appropriate env var.")
+    try:
+        loader = inference.resolve_loader(args)  # unknown provider
+        opt = inference.collect_options(args)    # bad options_json
+    except inference.UsageError as e:
+        raise InvalidJob(str(e))
+    with _inference_lock:
+        if _response_cache is None and LLM_CACHE_DIR:
+            _response_cache = inference.ResponseCache(LLM_CACHE_DIR)
+    client = inference.BaseOpenAILLMClient(api_key=api_key, model=args.model or "", llm_loader=loader,
+                                           options=opt, cache=_response_cache,
+                                           retry=inference.RetryPolicy(max_retries=max(0, args.max_retries)))
+    # Same text the CLI would have printed, trailing newline included
+    try:
+        text = inference.run(args, client, opt, on_delta=on_delta) + "\n"
+    except inference.UsageError as e:  # missing model or prompt
+        raise InvalidJob(str(e))
+    report = {"cache": client.last_cache_status, "call_seconds": client.last_call_seconds, "usage": client.last_usage}
+    return text, {k: v for k, v in report.items() if v is not None}
+
+def parse_llm_report(stderr: str) -> dict:
+    """
+    Reads the `[llm] cache ...` and `[llm] call seconds=... prompt_tokens=...` lines
+    that inference.py prints to stderr into {"cache", "call_seconds", "usage"}
+    (keys present only when reported).
+    """
+    report = {}
+    found = re.search(r"^\[llm\] cache (hit|miss)$", stderr or "", re.M)
+    if found:
+        report["cache"] = found.group(1)
+    found = re.search(r"^\[llm\] call (.*)$", stderr or "", re.M)
+    if found:
+        fields = dict(f.split("=", 1) for f in found.group(1).split() if "=" in f)
+        try:
+            report["call_seconds"] = float(fields.pop("seconds"))
+            usage = {k: int(v) for k, v in fields.items()}
+        except (KeyError, ValueError):
+            return report
+        if usage:
+            report["usage"] = usage
+    return report
+
+def fetch_page(cursor: int, wait: float = 0) -> tuple[list, int, bool, int]:
+    """
+    Fetches the inference jobs stored after `cursor`.
+    With `wait`, the inbox holds the request open until a new job arrives (long-poll).
+    Returns (items, next_cursor, more, last): items are (cursor, id, message) triples,
+    `more` tells whether a full page was returned and `last` is the newest inbox cursor.
+    """
+    params = {"since": cursor, "limit": PAGE_SIZE, "type": "Create", "instrument.action": "infer"}
+    if wait:
+        params["wait"] = wait
+    response = httpx.get(INBOX_URL, params=params, timeout=30 + wait)
+    response.raise_for_status()
+    page = response.json()
+    items = [(it["cursor"], it.get("id") or get_message_id(it["message"]), it["message"]) for it in page["items"]]
+    return items, page["next"], len(items) == PAGE_SIZE, page.get("last", page["next"])
+
+# --- Job Pool ---
+def parse_provider_limits(spec: str) -> dict[str, int]:
+    """Parses "groq=8,ollama=2" into {"groq": 8, "ollama": 2}."""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        limits[normalize_provider(name)] = int(value)
+    return limits
+
+def normalize_provider(name) -> str:
+    name = str(name or "").strip().lower()
+    return "huggingface" if name == "hf" else name
+
+class JobPool:
+    """
+    Runs jobs concurrently with one thread pool per provider, so a slow provider
+    only stalls its own queue. `max_in_flight` bounds queued plus running jobs:
+    submit() blocks when it is reached, which pauses inbox polling (backpressure).
+    """
+    def __init__(self, provider_limits: dict[str, int], default_limit: int, max_in_flight: int):
+        self.provider_limits = provider_limits
+        self.default_limit = default_limit
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def _executor(self, provider: str) -> ThreadPoolExecutor:
+        with self._lock:
+            if provider not in self._executors:
+                limit = self.provider_limits.get(provider, self.default_limit)
+                self._executors[provider] = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"job-{provider or 'default'}")
+            return self._executors[provider]
+
+    def submit(self, provider: str, fn, *args):
+        self._slots.acquire()
+        def run():
+            try:
+                fn(*args)
+            finally:
+                self._slots.release()
+        self._executor(normalize_provider(provider)).submit(run)
+
+# --- Core Job ---
+def is_streaming(params: dict) -> bool:
+    """Whether a job asks for a streamed answer (`stream` as a JSON bool or a string, as inference.py reads it)."""
+    return str(params.get("stream", False)).lower() in {"1", "true", "yes"}
+
+def stream_result(params: dict, result_name: str, on_first_output) -> tuple[str, dict]:
+    """
+    Runs a streaming job, appending its output to the result store's
+    `parts/<result_name>.part` as it arrives (the inbox's /results/ endpoint
+    follows that file), and moves it to the
+    result store under `result_name` once the job succeeds. on_first_output() runs
+    when the first bytes are written, or at the end for an empty answer.
+    Returns (text, report).
+    """
+    part_path = os.path.join(results.parts, result_name + ".part")
+    written = []
+    try:
+        with open(part_path, "w", encoding="utf-8") as f:
+            def write(text: str):
+                f.write(text)
+                f.flush()
+                if not written:
+                    on_first_output()
+                written.append(text)
+
+            if EXECUTION_MODE == "inprocess":
+                result_text, report = run_in_process(params, on_delta=write)  # streams bypass the cache
+                # The trailing newline (or a whole --json-output document) was not streamed
+                rest = result_text[len("".join(written)):]
+                if rest:
+                    write(rest)
+            else:
+                result_text, stderr = stream_command(build_inference_command(params), write)
+                report = parse_llm_report(stderr)
+        if not written:
+            on_first_output()
+        # Named before the .part file goes away, so readers always find one or the other
+        results.name(result_name, results.put(result_text.encode("utf-8")))
+        os.remove(part_path)
+        return result_text, report
+    except BaseException:
+        # Ends the stream of any reader following the partial result
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def record_llm_call(report: dict, durations: dict):
+    """Adds a job's provider call (if it made one) to the metrics and to its durations."""
+    if "call_seconds" in report:
+        metrics.observe("llm_call", report["call_seconds"])
+        durations["llm_call"] = round(report["call_seconds"], 6)
+    for kind, count in report.get("usage", {}).items():
+        metrics.inc("llm_tokens", count, kind=kind.removesuffix("_tokens"))
+    if "cache" in report:
+        metrics.inc("llm_cache", cache=report["cache"])
+
+def process_job(message: dict, msg_id: str, on_done):
+    """
+    Runs one inference job, saves and announces its result, then calls
+    on_done(msg_id, outcome): "ok", "invalid" (bad parameters, retrying cannot help)
+    or "failed".
+    The Announce's generating activity carries the job's start and end times, its
+    cache status, token usage and the duration of each step ("durations", seconds).
+    """
+    job_params = message.get("object", {})
+    outcome = "failed"
+    started_at, started = now_iso(), time.perf_counter()
+    durations = {}
+
+    try:
+        if not isinstance(job_params, dict):
+            raise InvalidJob("the job's object is not a JSON object")
+        result_filename = f"inference-result-{uuid.uuid4()}.txt"
+        base_url = INBOX_URL.rsplit('/', 1)[0]
+        generating_activity = message.get("id", f"urn:uuid:{msg_id}")
+
+        if is_streaming(job_params):
+            # Announced as soon as the first bytes are written, with a URL that streams
+            # the rest of the answer, so a consumer does not wait for the whole generation:
+            # the activity is still running, so it has no end time yet
+            def announce_stream():
+                durations["first_output"] = round(time.perf_counter() - started, 6)
+                with metrics.span("announce"):
+                    post_announce(
+                        object_name=result_filename,
+                        file_path=None,
+                        generating_activity=generating_activity,
+                        activity_details={"prov:startedAtTime": started_at, "durations": dict(durations)},
+                        object_url=f"{base_url}/results/{result_filename}",
+                    )
+            with metrics.span("generate", durations):
+                _, report = stream_result(job_params, result_filename, announce_stream)
+            record_llm_call(report, durations)
+            print(f"Inference complete. Result streamed to {base_url}/results/{result_filename}", file=sys.stderr)
+        else:
+            if EXECUTION_MODE == "inprocess":
+                with metrics.span("generate", durations):
+                    result_text, report = run_in_process(job_params)
+            else:
+                # Build and run the inference command
+                command = build_inference_command(job_params)
+                with metrics.span("subprocess", durations):
+                    result_text, stderr = run_command(command)
+                report = parse_llm_report(stderr)
+                # What the job paid on top of the provider call: uv, interpreter start-up, imports
+                if "call_seconds" in report:
+                    overhead = max(0.0, durations["subprocess"] - report["call_seconds"])
+                    metrics.observe("subprocess_overhead", overhead)
+                    durations["subprocess_overhead"] = round(overhead, 6)
+            record_llm_call(report, durations)
+
+            # Store the result: identical outputs share one compressed object
+            with metrics.span("result_write", durations):
+                digest = results.put(result_text.encode("utf-8"))
+                results.name(result_filename, digest)
+
+            print(f"Inference complete. Result stored as {digest}", file=sys.stderr)
+
+            # Announce the result
+            details = {"prov:startedAtTime": started_at, "prov:endedAtTime": now_iso()}
+            if "cache" in report:
+                details["cache"] = report["cache"]
+            if "usage" in report:
+                details["usage"] = report["usage"]
+            details["durations"] = {**durations, "job": round(time.perf_counter() - started, 6)}
+            with metrics.span("announce"):
+                post_announce(
+                    object_name=result_filename,
+                    file_path=None,
+                    generating_activity=generating_activity,
+                    activity_details=details,
+                    object_url=f"{base_url}/results/{digest}",  # immutable, so cacheable by any client
+                )
+        outcome = "ok"
+
+    # Only parameters that do not parse make a job "invalid"; errors from the provider
+    # call (even KeyError or ValueError from a malformed response) leave it "failed", so it is retried
+    except InvalidJob as e:
+        print(f"ERROR: Invalid job parameters for message {msg_id}: {e}", file=sys.stderr)
+        outcome = "invalid"
+    except subprocess.CalledProcessError as e:
+        print(f"ERROR: Inference script failed for message {msg_id}:\n{e.stderr}", file=sys.stderr)
+        if e.returncode == EX_USAGE:  # inference.py: bad arguments or parameters
+            outcome = "invalid"
+    except Exception as e:
+        print(f"An unexpected error occurred while processing message {msg_id}: {e}", file=sys.stderr)
+    finally:
+        metrics.observe("job", time.perf_counter() - started)
+        metrics.inc("jobs", outcome=outcome)
+        on_done(msg_id, outcome)
+
+# --- Job queue mode ---
+class Leases:
+    """Leases held by this worker; a background thread extends them while their jobs run."""
+    def __init__(self, jobs_url: str, lease: float):
+        self.jobs_url = jobs_url
+        self.lease = lease
+        self._tokens = {}  # msg_id -> token
+        self._lock = threading.Lock()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
+
+    def add(self, msg_id: str, token: str):
+        with self._lock:
+            self._tokens[msg_id] = token
+
+    def release(self, msg_id: str, outcome: str):
+        """Acks the job ("ok") or nacks it: "failed" jobs are retried by the inbox, "invalid" ones are not."""
+        with self._lock:
+            token = self._tokens.pop(msg_id, None)
+        if token is None:
+            return
+        if outcome == "ok":
+            url, params = f"{self.jobs_url}/{msg_id}/ack", {"token": token}
+        else:
+            url, params = f"{self.jobs_url}/{msg_id}/nack", {"token": token, "retry": outcome != "invalid", "error": outcome}
+        try:
+            r = httpx.post(url, params=params, timeout=30)
+            if r.status_code == 409:
+                print(f"Lease on {msg_id} was lost before it finished; another worker may run it again.", file=sys.stderr)
+        except httpx.HTTPError as e:
+            print(f"Could not release job {msg_id} ({e}); it returns to the queue when its lease expires.", file=sys.stderr)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                held = list(self._tokens.items())
+            for msg_id, token in held:
+                try:
+                    r = httpx.post(f"{self.jobs_url}/{msg_id}/extend", params={"token": token, "lease": self.lease}, timeout=30)
+                    if r.status_code == 409:
+                        print(f"Lease on {msg_id} expired; another worker may run it again.", file=sys.stderr)
+                except httpx.HTTPError as e:
+                    print(f"Could not extend lease on {msg_id}: {e}", file=sys.stderr)
+
+def run_job_queue(pool: JobPool, seen: SeenStore):
+    """Claims leased `infer` jobs from the inbox, runs them in the pool and acks or nacks each one."""
+    jobs_url = INBOX_URL.rsplit('/', 1)[0] + "/jobs"
+    leases = Leases(jobs_url, JOB_LEASE_SECONDS)
+
+    def on_done(msg_id, outcome):
+        if outcome == "ok":
+            seen.add(msg_id)
+        leases.release(msg_id, outcome)
+
+    while True:
+        free = MAX_IN_FLIGHT - len(leases)
+        if free <= 0:
+            time.sleep(0.5)
+            continue
+        params = {"worker": WORKER_ID, "limit": min(free, PAGE_SIZE), "instrument.action": "infer",
+                  "lease": JOB_LEASE_SECONDS, "wait": LONG_POLL_SECONDS}
+        try:
+            # Long-polls include their wait for new jobs, hence their own span
+            with metrics.span("poll_fetch_wait" if LONG_POLL_SECONDS else "poll_fetch"):
+                response = httpx.post(f"{jobs_url}/claim", params=params, timeout=30 + LONG_POLL_SECONDS)
+                response.raise_for_status()
+                claimed = response.json()["jobs"]
+        except (httpx.HTTPError, json.JSONDecodeError, KeyError) as e:
+            print(f"Error claiming jobs: {e}", file=sys.stderr)
+            time.sleep(5)
+            continue
+        for job in claimed:
+            msg_id, message = job["id"], job["message"]
+            leases.add(msg_id, job["token"])
+            with metrics.span("dedup"):
+                duplicate = msg_id in seen
+            if duplicate:
+                # Already run by this orchestrator before it used the queue (or before a lost ack)
+                leases.release(msg_id, "ok")
+                continue
+            print(f"Claimed inference job: {msg_id} (attempt {job['attempt']})", file=sys.stderr)
+            provider = (message.get("object") or {}).get("provider", "")
+            pool.submit(provider, process_job, message, msg_id, on_done)
+
 def main():
     """Main polling loop to process inference notifications."""
     print(f"Orchestrator started. Polling inbox at {INBOX_URL}...", file=sys.stderr)
-    seen_ids = get_seen_ids()
+    seen = SeenStore(SEEN_DB, SEEN_TTL_DAYS, legacy=SEEN_FILE)
+    pool = JobPool(parse_provider_limits(PROVIDER_CONCURRENCY), DEFAULT_CONCURRENCY, MAX_IN_FLIGHT)
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
+    if JOB_QUEUE:
+        print(f"Claiming jobs as {WORKER_ID}.", file=sys.stderr)
+        return run_job_queue(pool, seen)
+    in_flight = {}  # msg_id -> inbox cursor of the jobs queued or running
+    seen_lock = threading.Lock()
+    cursor = seen.cursor()
+    fetched = cursor  # everything up to here has been handed to the pool or skipped
+    fallback_until = 0.0
+
+    def advance():
+        # High-water mark: just below the oldest unfinished job, so a restart re-reads only those
+        seen.set_cursor(min(in_flight.values()) - 1 if in_flight else fetched)
+
+    def on_done(msg_id, outcome):
+        # Jobs finish out of order; each one marks only its own message as seen, whatever
+        # the outcome: without the job queue a failed job is not retried
+        with seen_lock:
+            seen.add(msg_id)
+            in_flight.pop(msg_id, None)
+            advance()
 
     while True:
+        wait = LONG_POLL_SECONDS if time.monotonic() >= fallback_until else 0
         try:
-            response = httpx.get(INBOX_URL, timeout=30)
-            response.raise_for_status()
-            messages = response.json()
-        except (httpx.RequestError, json.JSONDecodeError) as e:
+            # Long-polls include their wait for new jobs, hence their own span
+            with metrics.span("poll_fetch_wait" if wait else "poll_fetch"):
+                items, cursor, more, last = fetch_page(cursor, wait)
+        except (httpx.HTTPError, json.JSONDecodeError) as e:
             print(f"Error fetching or parsing inbox: {e}", file=sys.stderr)
+            if wait:
+                print(f"Long-poll failed, falling back to polling for {FALLBACK_SECONDS}s.", file=sys.stderr)
+                fallback_until = time.monotonic() + FALLBACK_SECONDS
             time.sleep(5)
             continue
 
-        for message in messages:
-            msg_id = get_message_id(message)
-            if msg_id in seen_ids:
+        if last < fetched:
+            # The inbox was reset: its cursors start over, and ids still dedup re-sent messages
+            print(f"Inbox cursor went back from {fetched} to {last}; rescanning.", file=sys.stderr)
+            cursor = fetched = 0
+            continue
+
+        for item_cursor, msg_id, message in items:
+            with seen_lock, metrics.span("dedup"):
+                duplicate = msg_id in in_flight or msg_id in seen
+            if duplicate:
                 continue
 
             # Check if it's a valid inference job
             if message.get("type") == "Create" and message.get("instrument", {}).get("action") == "infer":
                 print(f"Received new inference job: {msg_id}", file=sys.stderr)
+                with seen_lock:
+                    in_flight[msg_id] = item_cursor
+                provider = (message.get("object") or {}).get("provider", "")
+                pool.submit(provider, process_job, message, msg_id, on_done)
 
-                job_params = message.get("object", {})
-
-                try:
-                    # Build and run the inference command
-                    command = build_inference_command(job_params)
-                    result_text = run_command(command)
-
-                    # Save the result to a file
-                    result_id = str(uuid.uuid4())
-                    result_filename = f"inference-result-{result_id}.txt"
-                    result_filepath = os.path.join(STATE_DIR, result_filename)
-                    with open(result_filepath, "w", encoding='utf-8') as f:
-                        f.write(result_text)
-
-                    print(f"Inference complete. Result saved to {result_filepath}", file=sys.stderr)
-
-                    # Announce the result
-                    post_announce(
-                        object_name=result_filename,
-                        file_path=result_filepath,
-                        generating_activity=message.get("id", f"urn:uuid:{msg_id}")
-                    )
+        with seen_lock:
+            fetched = cursor
+            advance()
 
-                except (KeyError, TypeError) as e:
-                    print(f"ERROR: Invalid job parameters for message {msg_id}. Missing key: {e}", file=sys.stderr)
-                except subprocess.CalledProcessError as e:
-                    print(f"ERROR: Inference script failed for message {msg_id}:\n{e.stderr}", file=sys.stderr)
-                except Exception as e:
-                    print(f"An unexpected error occurred while processing message {msg_id}: {e}", file=sys.stderr)
-                finally:
-                    # Mark message as processed regardless of outcome to avoid retries
-                    mark_as_seen(msg_id)
-                    seen_ids.add(msg_id)
-
-        time.sleep(2)
+        # A long-poll already waited server-side; only plain polling needs a pause
+        if not more and not wait:
+            time.sleep(2)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,25 +1,124 @@
 # /// script
 # requires-python = ">=3.10"
-# dependencies = ["httpx>=0.27"]
+# dependencies = ["httpx[http2]>=0.27"]
 # ///
 import argparse
+import itertools
 import json
 import httpx
 import sys
+import threading
+import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-def main():
+SENDER_ARGS = {"inbox", "actor", "payload_file", "batch_size", "concurrency", "http2"}
+
+def build_notification(job_object: dict, actor: str = "https://example.org/users/cli-user") -> dict:
+    """The `Create` notification asking the orchestrator to run inference.py with `job_object` as its arguments."""
+    return {
+        "@context": "https://www.w3.org/ns/activitystreams",
+        "id": f"urn:uuid:{uuid.uuid4()}",
+        "type": "Create",
+        "actor": actor,
+        "object": job_object,
+        "instrument": {
+            "type": "Service",
+            "action": "infer"
+        }
+    }
+
+def read_jobs(path: str, defaults: dict, actor: str):
+    """
+    Yields (line number, notification) for each line of a JSONL file. A line is a
+    job object, completed by `defaults` (the flags given on the command line), or
+    a complete notification when it has a `type`. Invalid lines yield the error.
+    """
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as e:
+                yield n, e
+                continue
+            yield n, job if "type" in job else build_notification({**defaults, **job}, actor)
+
+def send_batches(inbox: str, notifications, batch_size: int = 500, concurrency: int = 4,
+                 http2: bool = False) -> tuple[int, int]:
+    """
+    Posts (line number, notification) pairs to the inbox's /inbox/batch endpoint as
+    NDJSON: `batch_size` per request, up to `concurrency` requests at a time, over
+    one pool of keep-alive connections (HTTP/2 when asked for and the server offers
+    it). Inboxes without the batch endpoint get one POST /inbox per notification,
+    over the same pool. Reports failures on stderr; returns (stored, failed).
+    """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    batch_url = inbox.rstrip("/") + "/batch"
+    no_batch_endpoint = threading.Event()  # set once the inbox answers 404/405 to a batch
+
+    def post(client, batch):
+        valid = [(n, m) for n, m in batch if not isinstance(m, Exception)]
+        out = [(n, {"status": "error", "error": str(m)}) for n, m in batch if isinstance(m, Exception)]
+        try:
+            if not no_batch_endpoint.is_set():
+                body = "".join(json.dumps(m, ensure_ascii=False) + "\n" for _, m in valid).encode("utf-8")
+                r = client.post(batch_url, content=body, headers={"Content-Type": "application/x-ndjson"})
+                if r.status_code not in (404, 405):
+                    r.raise_for_status()
+                    return out + [(n, item) for (n, _), item in zip(valid, r.json()["items"])]
+                no_batch_endpoint.set()
+            for n, m in valid:
+                r = client.post(inbox, headers={"Content-Type": "application/ld+json"}, json=m)
+                out.append((n, {"status": "ok", **r.json()} if r.is_success
+                            else {"status": "error", "error": f"HTTP {r.status_code}"}))
+        except httpx.HTTPError as e:
+            done = {n for n, _ in out}
+            out += [(n, {"status": "error", "error": str(e)}) for n, _ in valid if n not in done]
+        return out
+
+    stored = failed = 0
+    def collect(futures):
+        nonlocal stored, failed
+        for future in futures:
+            for n, item in future.result():
+                if item["status"] == "ok":
+                    stored += 1
+                else:
+                    failed += 1
+                    print(f"[ERROR] line {n}: {item['error']}", file=sys.stderr)
+
+    it = iter(notifications)
+    with httpx.Client(http2=http2, limits=limits, timeout=60) as client, ThreadPoolExecutor(concurrency) as pool:
+        inflight = set()
+        while batch := list(itertools.islice(it, batch_size)):
+            if len(inflight) >= concurrency * 2:  # bounded read-ahead: the file is never loaded whole
+                done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(done)
+            inflight.add(pool.submit(post, client, batch))
+        collect(inflight)
+    return stored, failed
+
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Send a detailed inference job to an LDN inbox, mirroring all of inference.py's arguments."
     )
     # --- Arguments for send_ldn.py
     parser.add_argument("--inbox", required=True, help="URL of the LDN inbox.")
     parser.add_argument("--actor", default="https://example.org/users/cli-user", help="Actor URI for the notification.")
+    parser.add_argument("--payload-file", help="JSONL file of jobs ('-' for stdin): job objects, completed by the flags "
+                                               "below, or complete notifications. Sent through POST /inbox/batch.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Notifications per batch request (--payload-file).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Batch requests in flight (--payload-file).")
+    parser.add_argument("--http2", action="store_true", help="Use HTTP/2 when the inbox offers it (--payload-file).")
 
     # --- Arguments mirrored from inference.py
     # Core
-    parser.add_argument("--provider", required=True, help="openai | groq | ollama | hf|huggingface")
-    parser.add_argument("--model", required=True, help="Model name to use for inference.")
+    parser.add_argument("--provider", help="openai | groq | ollama | hf|huggingface")
+    parser.add_argument("--model", help="Model name to use for inference.")
     parser.add_argument("--base-url", help="Override base URL for the provider.")
 
     # Provider-specific
@@ -31,43 +130,52 @@ def main():
     parser.add_argument("--verbose", action="store_true", help="Request verbose logs from inference.")
 
     # Prompts
-    parser.add_argument("-u", "--user-prompt", required=True, help="User prompt text.")
+    parser.add_argument("-u", "--user-prompt", help="User prompt text.")
     parser.add_argument("-s", "--system-prompt", help="System prompt text.")
 
     # Common completion options
     parser.add_argument("--temperature", type=float, help="Sampling temperature.")
     parser.add_argument("--top-p", type=float, help="Top-p sampling.")
     parser.add_argument("--max-tokens", type=int, help="Max tokens in response.")
-    parser.add_argument("--stream", type=lambda v: str(v).lower() in {"1", "true", "yes"}, help="Enable streaming (bool).")
+    parser.add_argument("--stream", nargs="?", const=True, type=lambda v: str(v).lower() in {"1", "true", "yes"},
+                        help="Stream the answer into the result as it is generated (bare flag or a bool).")
 
     # Reasoning effort
     parser.add_argument("--reasoning-effort", choices=["low", "medium", "high"], help="Request extra reasoning effort.")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if not args.payload_file:
+        missing = [flag for flag, value in (("--provider", args.provider), ("--model", args.model),
+                                            ("--user-prompt", args.user_prompt)) if value is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
 
     # Build the 'object' part of the LDN message from all provided args
     job_object = {}
     for arg, value in vars(args).items():
         # Exclude args specific to the sending script and only include args that were actually provided
-        if arg not in ['inbox', 'actor'] and value is not None:
+        if arg not in SENDER_ARGS and value is not None:
             # Convert boolean flags to a more explicit representation if they are True
             if isinstance(value, bool) and value:
                 job_object[arg] = True
             elif not isinstance(value, bool):
                 job_object[arg] = value
 
+    if args.payload_file:
+        started = time.perf_counter()
+        try:
+            stored, failed = send_batches(args.inbox, read_jobs(args.payload_file, job_object, args.actor),
+                                          args.batch_size, args.concurrency, args.http2)
+        except OSError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            return 1
+        seconds = time.perf_counter() - started
+        print(f"=> Stored {stored} notification(s), {failed} failed, in {seconds:.1f}s "
+              f"({stored / seconds if seconds else 0:.0f}/s).")
+        return 1 if failed else 0
+
     # Build the full LDN notification payload
-    payload = {
-        "@context": "https://www.w3.org/ns/activitystreams",
-        "id": f"urn:uuid:{uuid.uuid4()}",
-        "type": "Create",
-        "actor": args.actor,
-        "object": job_object,
-        "instrument": {
-            "type": "Service",
-            "action": "infer"
-        }
-    }
+    payload = build_notification(job_object, args.actor)
 
     print("--- Sending Notification ---")
     print(json.dumps(payload, indent=2))